@@ -0,0 +1,196 @@
+"""
+Compact representation of compiled tasks.
+
+Large ``dodo.py`` files can keep hundreds of thousands of compiled tasks
+in memory. A ``CompactTask`` stores file dependencies and targets as
+integer ids of normalized paths interned in a shared ``PathTable``. Other
+values are shared between tasks where possible. Plain tuples that doit
+expects are created only when ``to_dict`` is called, e.g., from a task
+creator or ``lazy_task``.
+"""
+
+import os
+import sys
+from array import array
+from typing import Any, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+
+from doit_ext.compose import ComposeTask
+
+# Keys of compiled tasks that are stored in dedicated slots
+_SLOT_KEYS = frozenset(("name", "actions", "file_dep", "targets", "task_dep"))
+
+
+class PathTable:
+    """
+    Interning table of normalized paths.
+
+    >>> table = PathTable()
+    >>> table.intern("./src/a.py") == table.intern("src/a.py")
+    True
+    >>> table.path(table.intern("src//a.py"))
+    'src/a.py'
+    """
+
+    __slots__ = ("_ids", "_paths", "_shared")
+
+    def __init__(self):
+        """
+        Initialize empty table.
+        """
+        self._ids: Dict[str, int] = {}
+        self._paths: List[str] = []
+        self._shared: Dict[Hashable, Any] = {}
+
+    def __len__(self) -> int:
+        """
+        Get amount of interned paths.
+        """
+        return len(self._paths)
+
+    def intern(self, path: Any) -> int:
+        """
+        Get id of normalized path, adding it to the table if needed.
+        """
+        key = os.fspath(path)
+        path_id = self._ids.get(key)
+        if path_id is None:
+            normalized = sys.intern(os.path.normpath(key))
+            path_id = self._ids.get(normalized)
+            if path_id is None:
+                path_id = len(self._paths)
+                self._paths.append(normalized)
+                self._ids[normalized] = path_id
+            # Unnormalized spellings map to the same id
+            self._ids[sys.intern(key)] = path_id
+        return path_id
+
+    def intern_all(self, paths: Iterable[Any]) -> array:
+        """
+        Get ids of paths as an unsigned integer array.
+        """
+        return array("I", [self.intern(path) for path in paths])
+
+    def share(self, key: Hashable, value: Any) -> Any:
+        """
+        Get the value first shared with key or share value with key.
+        """
+        return self._shared.setdefault(key, value)
+
+    def path(self, path_id: int) -> str:
+        """
+        Get normalized path of id.
+        """
+        return self._paths[path_id]
+
+    def paths(self, path_ids: Iterable[int]) -> Tuple[str, ...]:
+        """
+        Get normalized paths of ids.
+        """
+        paths = self._paths
+        return tuple(paths[path_id] for path_id in path_ids)
+
+
+PATH_TABLE = PathTable()
+
+
+class CompactTask:
+    """
+    Compiled task with interned paths.
+
+    Values other than name, actions, file_dep, targets and task_dep are kept
+    as is in extra, which is shared between tasks with identical values.
+    String actions and task_dep names are interned.
+    """
+
+    __slots__ = ("name", "actions", "file_dep", "targets", "task_dep", "extra", "table")
+
+    def __init__(
+        self,
+        name: Optional[str],
+        actions: Tuple[Any, ...],
+        file_dep: array,
+        targets: array,
+        task_dep: Tuple[str, ...],
+        extra: Tuple[Tuple[str, Any], ...],
+        table: PathTable,
+    ):
+        """
+        Initialize compact task.
+        """
+        self.name = name
+        self.actions = actions
+        self.file_dep = file_dep
+        self.targets = targets
+        self.task_dep = task_dep
+        self.extra = extra
+        self.table = table
+
+    @classmethod
+    def from_compiled(
+        cls, compiled: Mapping[str, Any], table: PathTable = PATH_TABLE
+    ) -> "CompactTask":
+        """
+        Create CompactTask from a compiled doit task dictionary.
+        """
+        extra = tuple(
+            (key, value) for key, value in compiled.items() if key not in _SLOT_KEYS
+        )
+        # The shared tuple keeps its values alive so their ids stay unique
+        extra = table.share(
+            ("extra", tuple((key, id(value)) for key, value in extra)), extra
+        )
+        return cls(
+            name=compiled.get("name"),
+            actions=tuple(
+                sys.intern(action) if isinstance(action, str) else action
+                for action in compiled.get("actions", ())
+            ),
+            file_dep=table.intern_all(compiled.get("file_dep", ())),
+            targets=table.intern_all(compiled.get("targets", ())),
+            task_dep=tuple(sys.intern(dep) for dep in compiled.get("task_dep", ())),
+            extra=extra,
+            table=table,
+        )
+
+    @classmethod
+    def from_compose_task(
+        cls, compose_task: ComposeTask, table: PathTable = PATH_TABLE
+    ) -> "CompactTask":
+        """
+        Compile compose_task into a CompactTask.
+
+        Compiled uptodate values of tasks with structurally equal uptodate
+        definitions are shared.
+        """
+        compiled = compose_task.compile(use_cache=False)
+        if "uptodate" in compiled:
+            try:
+                key = compose_task.compile_actions().uptodate.fingerprint()
+            except TypeError:
+                pass
+            else:
+                compiled["uptodate"] = table.share(
+                    ("uptodate", key), compiled["uptodate"]
+                )
+        return cls.from_compiled(compiled, table=table)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert into a compiled doit task dictionary.
+
+        Paths are returned normalized and empty values are left out as in
+        ``ComposeTask.compile``.
+        """
+        compiled: Dict[str, Any] = {}
+        if self.actions:
+            compiled["actions"] = self.actions
+        if self.file_dep:
+            compiled["file_dep"] = self.table.paths(self.file_dep)
+        if self.task_dep:
+            compiled["task_dep"] = self.task_dep
+        if self.targets:
+            compiled["targets"] = self.table.paths(self.targets)
+        compiled.update(self.extra)
+        if self.name is not None:
+            compiled["name"] = self.name
+        return compiled
@@ -2,23 +2,126 @@
 Compose doit tasks.
 """
 
-from pathlib import Path
+import json
+import os
+import re
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from hashlib import sha256
+from itertools import product
+from pathlib import Path, PurePath
+from string import Formatter
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     Dict,
+    Hashable,
+    Iterable,
+    Iterator,
     List,
+    Mapping,
     NamedTuple,
     Optional,
     Sequence,
     Tuple,
+    Type,
     Union,
 )
 
-from doit.tools import config_changed, result_dep, run_once
+from doit_ext import instrument
+from doit_ext.paths import (
+    DEFAULT_HASH_STRATEGY,
+    ContentChanged,
+    FileGlob,
+    MerkleTree,
+    SubtreeChanged,
+    listing_cache_generation,
+)
+
+if TYPE_CHECKING:
+    from doit.tools import result_dep
 
 FuncType = Union[Callable, str]
 StrPathType = Union[Path, str]
+FileDepType = Union[StrPathType, FileGlob]
+
+COMPILE_CACHE_MAXSIZE = 1024
+
+_COMPILE_CACHE: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+_COMPILE_CACHE_COUNTS = {"hits": 0, "misses": 0}
+
+
+class CompileCacheInfo(NamedTuple):
+    """
+    Statistics of the ComposeTask.compile cache.
+    """
+
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+def compile_cache_info() -> CompileCacheInfo:
+    """
+    Get ComposeTask.compile cache statistics.
+    """
+    return CompileCacheInfo(
+        hits=_COMPILE_CACHE_COUNTS["hits"],
+        misses=_COMPILE_CACHE_COUNTS["misses"],
+        maxsize=COMPILE_CACHE_MAXSIZE,
+        currsize=len(_COMPILE_CACHE),
+    )
+
+
+def compile_cache_clear():
+    """
+    Clear ComposeTask.compile cache and its statistics.
+    """
+    _COMPILE_CACHE.clear()
+    _COMPILE_CACHE_COUNTS["hits"] = 0
+    _COMPILE_CACHE_COUNTS["misses"] = 0
+
+
+_SELF_FINGERPRINT_TYPES = frozenset(
+    (str, bytes, type(None), type(Path()), type(lambda: None))
+)
+
+
+def _fingerprint_value(value: Any) -> Hashable:
+    """
+    Resolve a hashable structural fingerprint of value.
+
+    Containers are fingerprinted recursively with their types so that e.g.
+    ``1`` and ``True`` or ``"a"`` and ``Path("a")`` differ. Other values
+    must be hashable (callables are hashed by identity) or TypeError is
+    raised.
+
+    >>> _fingerprint_value((1, "a")) == _fingerprint_value((1, "a"))
+    True
+    >>> _fingerprint_value({"x": 1}) == _fingerprint_value({"x": True})
+    False
+    """
+    value_type = type(value)
+    if value_type in _SELF_FINGERPRINT_TYPES:
+        # Never equal to values of other types
+        fingerprint: Hashable = value
+        return fingerprint
+    if isinstance(value, (tuple, list)):
+        return (value_type, tuple(map(_fingerprint_value, value)))
+    if isinstance(value, dict):
+        return (
+            value_type,
+            tuple(
+                (_fingerprint_value(key), _fingerprint_value(item))
+                for key, item in value.items()
+            ),
+        )
+    if isinstance(value, (set, frozenset)):
+        return (value_type, frozenset(map(_fingerprint_value, value)))
+    hash(value)
+    return (value_type, value)
 
 
 class FileDep(NamedTuple):
@@ -37,9 +140,246 @@ class Target(NamedTuple):
     value: StrPathType
 
 
+class Batch(NamedTuple):
+    """
+    Batch of parameters rendered as a space-separated list.
+
+    >>> str(Batch((FileDep("a.py"), FileDep("b.py"))))
+    'a.py b.py'
+    """
+
+    values: Tuple[Union[FileDep, Target, Any], ...]
+
+    def __str__(self) -> str:
+        """
+        Join unwrapped values with spaces.
+        """
+        return " ".join(str(_unwrap_parameter(value)) for value in self.values)
+
+
+def _flatten_parameters(parameters: Iterable[Any]) -> Iterator[Any]:
+    """
+    Yield parameters with the values of Batch parameters inlined.
+    """
+    for param in parameters:
+        if isinstance(param, Batch):
+            yield from param.values
+        else:
+            yield param
+
+
+def _base_str(base: Union[str, Sequence[str]]) -> str:
+    """
+    Join base into a string.
+    """
+    if isinstance(base, str):
+        return base
+    return str.join(" ", base)
+
+
+def _unwrap_parameter(value: Any) -> Any:
+    """
+    Resolve value of FileDep and Target parameters.
+    """
+    if isinstance(value, (FileDep, Target)):
+        return value.value
+    return value
+
+
+class ActionTemplate:
+    """
+    Precompiled action template with positional and named placeholders.
+
+    The base is parsed once on initialization. Rendering a parameter set
+    fills the cached placeholder slots and joins the parts. Slots
+    (positional indexes or names) given in file_deps and targets are
+    reported as file dependencies and targets of a rendered action in
+    addition to ``FileDep`` and ``Target`` wrapped parameters.
+
+    >>> template = ActionTemplate("ruff check {src} --output {}", targets=(0,))
+    >>> template.render("report.txt", src="src/")
+    'ruff check src/ --output report.txt'
+    >>> template.targets("report.txt", src="src/")
+    ['report.txt']
+    """
+
+    __slots__ = (
+        "base_str",
+        "positional_count",
+        "names",
+        "file_dep_slots",
+        "target_slots",
+        "_parts",
+        "_slots",
+    )
+
+    def __init__(
+        self,
+        base: Union[str, Sequence[str]],
+        file_deps: Sequence[Union[int, str]] = (),
+        targets: Sequence[Union[int, str]] = (),
+    ):
+        """
+        Parse base into literal parts and placeholder slots.
+        """
+        self.base_str = _base_str(base)
+        parts: List[Optional[str]] = []
+        slots: List[Tuple[int, Union[int, str], Optional[str], str]] = []
+        auto_index = 0
+        manual_index = False
+        names: List[str] = []
+        positional_count = 0
+        for literal, field_name, format_spec, conversion in Formatter().parse(
+            self.base_str
+        ):
+            if literal:
+                parts.append(literal)
+            if field_name is None:
+                continue
+            key: Union[int, str]
+            if field_name == "":
+                if manual_index:
+                    raise ValueError(
+                        "Cannot switch from manual to automatic field numbering."
+                    )
+                key = auto_index
+                auto_index += 1
+            elif field_name.isdigit():
+                if auto_index > 0:
+                    raise ValueError(
+                        "Cannot switch from automatic to manual field numbering."
+                    )
+                manual_index = True
+                key = int(field_name)
+            elif field_name.isidentifier():
+                key = field_name
+            else:
+                raise ValueError(f"Unsupported placeholder: {{{field_name}}}.")
+            if isinstance(key, int):
+                positional_count = max(positional_count, key + 1)
+            elif key not in names:
+                names.append(key)
+            if format_spec and "{" in format_spec:
+                raise ValueError("Nested placeholders are not supported.")
+            slots.append((len(parts), key, conversion, format_spec or ""))
+            parts.append(None)
+        self.positional_count = positional_count
+        self.names = tuple(names)
+        self.file_dep_slots = tuple(file_deps)
+        self.target_slots = tuple(targets)
+        self._parts = parts
+        self._slots = tuple(slots)
+
+    def _validate(self, args: Sequence[Any], kwargs: Mapping[str, Any]):
+        """
+        Validate that parameters match the placeholders.
+        """
+        if len(args) != self.positional_count or len(kwargs) != len(self.names):
+            raise ValueError(
+                f"Expected {self.positional_count} positional and "
+                f"{self.names} named parameters for {self.base_str!r}."
+            )
+
+    def render(self, *args: Any, **kwargs: Any) -> str:
+        """
+        Render action string from parameters.
+        """
+        self._validate(args, kwargs)
+        parts = self._parts.copy()
+        for index, key, conversion, format_spec in self._slots:
+            value = _unwrap_parameter(
+                args[key] if isinstance(key, int) else kwargs[key]
+            )
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "a":
+                value = ascii(value)
+            parts[index] = format(value, format_spec) if format_spec else str(value)
+        return "".join(parts)  # type: ignore[arg-type]
+
+    def _slot_values(
+        self,
+        slots: Tuple[Union[int, str], ...],
+        wrapper: Union[Type[FileDep], Type[Target]],
+        args: Sequence[Any],
+        kwargs: Mapping[str, Any],
+    ) -> List[StrPathType]:
+        """
+        Get values of slots and of parameters wrapped in wrapper.
+        """
+        values = [
+            _unwrap_parameter(args[slot] if isinstance(slot, int) else kwargs[slot])
+            for slot in slots
+        ]
+        values.extend(
+            param.value
+            for param in _flatten_parameters((*args, *kwargs.values()))
+            if isinstance(param, wrapper)
+        )
+        return values
+
+    def file_deps(self, *args: Any, **kwargs: Any) -> List[StrPathType]:
+        """
+        Get file dependencies of a rendered action.
+        """
+        return self._slot_values(self.file_dep_slots, FileDep, args, kwargs)
+
+    def targets(self, *args: Any, **kwargs: Any) -> List[StrPathType]:
+        """
+        Get targets of a rendered action.
+        """
+        return self._slot_values(self.target_slots, Target, args, kwargs)
+
+
+_ACTION_TOKEN = re.compile(r"\{\{|\}\}|\{\}")
+
+
+@lru_cache(maxsize=4096)
+def _action_parts(base_str: str) -> Tuple[str, ...]:
+    """
+    Split base_str into literal parts around its bare ``{}`` slots.
+
+    Escaped ``{{`` and ``}}`` are unescaped as with ``str.format`` and all
+    other braces are kept as is.
+
+    >>> _action_parts("awk '{print $1}' {} > ${OUT}")
+    ("awk '{print $1}' ", ' > ${OUT}')
+    >>> _action_parts("awk '{{print $1}}' {}")
+    ("awk '{print $1}' ", '')
+    """
+    parts = [""]
+    position = 0
+    for match in _ACTION_TOKEN.finditer(base_str):
+        parts[-1] += base_str[position : match.start()]
+        token = match.group()
+        if token == "{}":
+            parts.append("")
+        else:
+            parts[-1] += token[0]
+        position = match.end()
+    parts[-1] += base_str[position:]
+    return tuple(parts)
+
+
+def _is_batchable_base(base_str: str) -> bool:
+    """
+    Check if base_str has a single ``{}`` slot delimited by whitespace.
+    """
+    parts = _action_parts(base_str)
+    if len(parts) != 2:
+        return False
+    before, after = parts
+    return (not before or before[-1].isspace()) and (not after or after[0].isspace())
+
+
 class Action(NamedTuple):
     """
     Action.
+
+    Each bare ``{}`` in base is filled with a parameter. Escaped ``{{`` and
+    ``}}`` are unescaped when there are parameters and all other braces are
+    kept as is, e.g., ``${HOME}``. Use ``ActionTemplate`` for named and
+    formatted placeholders.
     """
 
     base: Union[str, Sequence[str]]
@@ -50,15 +390,13 @@ class Action(NamedTuple):
         """
         Get base as a joined string.
         """
-        if isinstance(self.base, str):
-            return self.base
-        return str.join(" ", self.base)
+        return _base_str(self.base)
 
     def validate(self):
         """
         Validate inputs.
         """
-        if not self.base_str.count("{}") == len(self.parameters):
+        if len(_action_parts(self.base_str)) - 1 != len(self.parameters):
             raise ValueError(
                 "Expected base to have {} format spots for every parameter."
             )
@@ -70,19 +408,27 @@ class Action(NamedTuple):
         self.validate()
         if len(self.parameters) == 0:
             return self.base_str
-        return self.base_str.format(
-            *[
-                param if not isinstance(param, (FileDep, Target)) else param.value
-                for param in self.parameters
-            ]
-        )
+        parts = _action_parts(self.base_str)
+        rendered = [parts[0]]
+        for param, part in zip(self.parameters, parts[1:]):
+            rendered.append(str(_unwrap_parameter(param)))
+            rendered.append(part)
+        return "".join(rendered)
+
+    def fingerprint(self) -> Hashable:
+        """
+        Get structural fingerprint.
+        """
+        return _fingerprint_value(self)
 
     def file_deps(self) -> List[StrPathType]:
         """
         Get file dependencies.
         """
         file_deps = [
-            param.value for param in self.parameters if isinstance(param, FileDep)
+            param.value
+            for param in _flatten_parameters(self.parameters)
+            if isinstance(param, FileDep)
         ]
         return file_deps
 
@@ -91,7 +437,9 @@ class Action(NamedTuple):
         Get targets dependencies.
         """
         targets = [
-            param.value for param in self.parameters if isinstance(param, Target)
+            param.value
+            for param in _flatten_parameters(self.parameters)
+            if isinstance(param, Target)
         ]
         return targets
 
@@ -103,6 +451,63 @@ class Action(NamedTuple):
 
 ActionsType = Union[Action, FuncType]
 
+# Compiled shell actions are passed to the shell as a single argument, which
+# Linux limits to 128 KiB, and Windows limits command lines to 8191 chars.
+DEFAULT_MAX_ARG_LENGTH = 8000
+
+
+def batch_actions(
+    actions: Iterable[ActionsType], max_arg_length: int = DEFAULT_MAX_ARG_LENGTH
+) -> Tuple[ActionsType, ...]:
+    """
+    Merge Actions with the same single-placeholder base into batched Actions.
+
+    Similar to ``xargs``, the parameters of Actions that share a base with a
+    single bare ``{}`` placeholder are passed together in chunked
+    invocations whose compiled length stays under max_arg_length. A batch
+    replaces the first Action of its base so the Actions must not depend on
+    each other. File dependencies and targets of the batched parameters are
+    kept. Other actions are left as is.
+
+    >>> actions = [Action("ruff check {}", (FileDep(path),)) for path in "abc"]
+    >>> [action.compile() for action in batch_actions(actions, max_arg_length=14)]
+    ['ruff check a b', 'ruff check c']
+    """
+    groups: Dict[str, List[Any]] = {}
+    # Either (base_str, None) of a batch or (None, action) of other actions
+    positions: List[Tuple[Optional[str], Optional[ActionsType]]] = []
+    for action in actions:
+        if (
+            isinstance(action, Action)
+            and len(action.parameters) == 1
+            and _is_batchable_base(action.base_str)
+        ):
+            if action.base_str not in groups:
+                groups[action.base_str] = []
+                positions.append((action.base_str, None))
+            groups[action.base_str].extend(_flatten_parameters(action.parameters))
+        else:
+            positions.append((None, action))
+
+    batched: List[ActionsType] = []
+    for base_str, other_action in positions:
+        if base_str is None:
+            batched.append(other_action)  # type: ignore[arg-type]
+            continue
+        # Length without values and with a separator per value
+        base_length = sum(map(len, _action_parts(base_str)))
+        chunk: List[Any] = []
+        length = base_length - 1
+        for param in groups[base_str]:
+            param_length = len(str(_unwrap_parameter(param))) + 1
+            if chunk and length + param_length > max_arg_length:
+                batched.append(Action(base_str, (Batch(tuple(chunk)),)))
+                chunk, length = [], base_length - 1
+            chunk.append(param)
+            length += param_length
+        batched.append(Action(base_str, (Batch(tuple(chunk)),)))
+    return tuple(batched)
+
 
 def _resolve_task_dep(task_dep: FuncType) -> str:
     """
@@ -115,6 +520,47 @@ def _resolve_task_dep(task_dep: FuncType) -> str:
     return task_dep_str
 
 
+def _path_key(value: Any) -> Any:
+    """
+    Normalize a path-like value for deduplication.
+
+    >>> _path_key(Path("a")) == _path_key("./a") == _path_key("b/../a")
+    True
+    """
+    if isinstance(value, (str, PurePath)):
+        return os.path.normpath(os.fspath(value))
+    return value
+
+
+def _dedup(values: Sequence[Any], key: Callable[[Any], Any]) -> Tuple[Any, ...]:
+    """
+    Remove duplicates by key preserving the order of first occurrences.
+    """
+    seen = set()
+    deduped = []
+    for value in values:
+        value_key = key(value)
+        if value_key not in seen:
+            seen.add(value_key)
+            deduped.append(value)
+    return tuple(deduped)
+
+
+def _dedup_compiled(compiled: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Remove duplicate file_dep, targets and task_dep entries.
+    """
+    deduped = dict(compiled)
+    for key, dedup_key in (
+        ("file_dep", _path_key),
+        ("targets", _path_key),
+        ("task_dep", lambda value: value),
+    ):
+        if deduped.get(key):
+            deduped[key] = _dedup(deduped[key], key=dedup_key)
+    return deduped
+
+
 def _resolve_named_tuple_dict(named_tuple: NamedTuple):
     """
     Resolve self into dict.
@@ -122,6 +568,42 @@ def _resolve_named_tuple_dict(named_tuple: NamedTuple):
     return {field: getattr(named_tuple, field) for field in named_tuple._fields}
 
 
+def _json_default(value: Any) -> Any:
+    """
+    Serialize values that json does not support by default.
+    """
+    if isinstance(value, PurePath):
+        return value.as_posix()
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    raise TypeError(f"Cannot serialize {type(value)} config value.")
+
+
+_CONFIG_ENCODER = json.JSONEncoder(
+    sort_keys=True, separators=(",", ":"), default=_json_default
+)
+
+
+def digest_config_value(value: Any) -> str:
+    """
+    Digest a config value by streaming its canonical JSON into sha256.
+
+    Paths are serialized as posix strings and bytes (e.g. hashes from
+    ``create_path_content_dict``) as hex.
+
+    >>> digest_config_value({"b": 1, "a": [1, 2]}) == digest_config_value(
+    ...     {"a": [1, 2], "b": 1}
+    ... )
+    True
+    """
+    hasher = sha256()
+    for chunk in _CONFIG_ENCODER.iterencode(value):
+        hasher.update(chunk.encode("utf-8"))
+    return hasher.hexdigest()
+
+
 class UpToDate(NamedTuple):
     """
     Class for uptodate spec.
@@ -131,17 +613,13 @@ class UpToDate(NamedTuple):
     config_changed: Optional[Dict[str, Any]]
     run_once: bool
     extra_entries: Tuple
+    config_digests: Optional[Dict[str, str]] = None
 
     def update_result_deps(self, *result_deps: Any) -> "UpToDate":
         """
         Update result_deps values.
         """
-        return UpToDate(
-            result_deps=tuple([*self.result_deps, *result_deps]),
-            config_changed=self.config_changed,
-            run_once=self.run_once,
-            extra_entries=self.extra_entries,
-        )
+        return self._replace(result_deps=tuple([*self.result_deps, *result_deps]))
 
     def update_config_changed(self, config: Dict[str, Any]) -> "UpToDate":
         """
@@ -152,45 +630,94 @@ class UpToDate(NamedTuple):
         else:
             updated_config_changed = self.config_changed.copy()
             updated_config_changed.update(config)
-        return UpToDate(
-            result_deps=self.result_deps,
-            config_changed=updated_config_changed,
-            run_once=self.run_once,
-            extra_entries=self.extra_entries,
+        return self._replace(config_changed=updated_config_changed)
+
+    def update_config_digests(self, config: Dict[str, Any]) -> "UpToDate":
+        """
+        Update config_changed values in digest mode.
+
+        Each value is digested immediately and only the digest is kept.
+        """
+        updated_config_digests = (
+            {} if self.config_digests is None else self.config_digests.copy()
         )
+        for key, value in config.items():
+            updated_config_digests[key] = digest_config_value(value)
+        return self._replace(config_digests=updated_config_digests)
 
     def update_run_once(self, value: bool) -> "UpToDate":
         """
         Update run_once addition.
         """
-        return UpToDate(
-            result_deps=self.result_deps,
-            config_changed=self.config_changed,
-            run_once=value,
-            extra_entries=self.extra_entries,
-        )
+        return self._replace(run_once=value)
 
     def update_extra_entries(self, value: Any) -> "UpToDate":
         """
         Update extra_entries.
         """
-        return UpToDate(
-            result_deps=self.result_deps,
-            config_changed=self.config_changed,
-            run_once=self.run_once,
-            extra_entries=tuple([*self.extra_entries, value]),
+        return self._replace(extra_entries=tuple([*self.extra_entries, value]))
+
+    def merge(self, other: "UpToDate") -> "UpToDate":
+        """
+        Merge other into a single uptodate spec.
+
+        Config values of other overwrite those of self so that the merged
+        spec compiles into a single ``config_changed``.
+        """
+        merged = self.update_result_deps(*other.result_deps)
+        if other.config_changed is not None:
+            merged = merged.update_config_changed(other.config_changed)
+        if other.config_digests is not None:
+            merged = merged._replace(
+                config_digests={**(merged.config_digests or {}), **other.config_digests}
+            )
+        return merged._replace(
+            run_once=self.run_once or other.run_once,
+            extra_entries=self.extra_entries + other.extra_entries,
         )
 
+    def config_digest(self) -> Optional[str]:
+        """
+        Get a single canonical digest of config_digests and config_changed.
+
+        Returns None if no digest mode config has been added.
+        """
+        if self.config_digests is None:
+            return None
+        config_digests = {
+            key: digest_config_value(value)
+            for key, value in (self.config_changed or {}).items()
+        }
+        config_digests.update(self.config_digests)
+        hasher = sha256()
+        for key in sorted(config_digests):
+            hasher.update(f"{key}\0{config_digests[key]}\0".encode("utf-8"))
+        return hasher.hexdigest()
+
+    def fingerprint(self) -> Hashable:
+        """
+        Get structural fingerprint.
+        """
+        return _fingerprint_value(self)
+
     def compile(self) -> Tuple[Any, ...]:
         """
         Compile UpToDate into doit uptodate values.
         """
+        # doit is imported only when needed to keep importing doit_ext fast
+        # pylint: disable=import-outside-toplevel
+        from doit.tools import config_changed, result_dep, run_once
+
         compiled = [result_dep(dep) for dep in self.result_deps]
 
         if self.run_once:
             compiled = [*compiled, run_once]
 
-        if self.config_changed is not None:
+        config_digest = self.config_digest()
+        if config_digest is not None:
+            # Only the digest is passed to doit and stored in its database
+            compiled = [*compiled, config_changed(config_digest)]
+        elif self.config_changed is not None:
             compiled = [*compiled, config_changed(self.config_changed)]
 
         compiled = [*compiled, *self.extra_entries]
@@ -203,7 +730,7 @@ class ComposeTask(NamedTuple):
     """
 
     actions: Tuple[Union[FuncType, Action], ...] = ()
-    file_dep: Tuple[StrPathType, ...] = ()
+    file_dep: Tuple[FileDepType, ...] = ()
     task_dep: Tuple[FuncType, ...] = ()
     targets: Tuple[StrPathType, ...] = ()
     uptodate: UpToDate = UpToDate(
@@ -211,6 +738,7 @@ class ComposeTask(NamedTuple):
     )
     name: Optional[str] = None
 
+    @instrument.timed
     def update(
         self,
         **update_values: Union[
@@ -218,7 +746,7 @@ class ComposeTask(NamedTuple):
                 Union[
                     FuncType,
                     StrPathType,
-                    result_dep,
+                    "result_dep",
                 ],
                 ...,
             ],
@@ -245,6 +773,13 @@ class ComposeTask(NamedTuple):
                 )
                 continue
 
+            if key == "config_digest":
+                assert isinstance(new_values, dict)
+                old_values_dict["uptodate"] = self.uptodate.update_config_digests(
+                    new_values
+                )
+                continue
+
             if key == "result_deps":
                 assert isinstance(new_values, tuple)
                 old_values_dict["uptodate"] = self.uptodate.update_result_deps(
@@ -294,7 +829,7 @@ class ComposeTask(NamedTuple):
             attr = old_values_dict[key]
             if isinstance(attr, tuple):
                 # Add values to current values
-                old_values_dict[key] = tuple([*attr, *new_values])
+                old_values_dict[key] = attr + tuple(new_values)
             elif isinstance(attr, str):
                 # Overwrite current value
                 old_values_dict[key] = new_values
@@ -312,9 +847,28 @@ class ComposeTask(NamedTuple):
         """
         return self.update(actions=actions)
 
-    def add_file_deps(self, *file_deps: StrPathType) -> "ComposeTask":
+    def add_template_action(
+        self, template: ActionTemplate, *args: Any, **kwargs: Any
+    ) -> "ComposeTask":
+        """
+        Add an action rendered from a precompiled ActionTemplate.
+
+        File dependencies and targets of the rendered action are added to
+        the task and the task depends on the template base similar to
+        ``Action``.
+        """
+        return self.update(
+            actions=(template.render(*args, **kwargs),),
+            file_dep=tuple(template.file_deps(*args, **kwargs)),
+            targets=tuple(template.targets(*args, **kwargs)),
+            config_changed={template.base_str: template.base_str},
+        )
+
+    def add_file_deps(self, *file_deps: FileDepType) -> "ComposeTask":
         """
         Add file dependencies to task.
+
+        ``FileGlob`` dependencies are resolved when the task is compiled.
         """
         return self.update(file_dep=file_deps)
 
@@ -351,6 +905,56 @@ class ComposeTask(NamedTuple):
         """
         return self.update(config_changed=config_deps)
 
+    def add_config_digest_dependency(
+        self, config_deps: Dict[str, Any]
+    ) -> "ComposeTask":
+        """
+        Add a config_changed dependency in digest mode.
+
+        Values are digested when added and only a single digest of all
+        config dependencies is passed to doit. This keeps the task
+        definition and doit dependency database small for large configs,
+        e.g., from ``create_path_content_dict``.
+        """
+        return self.update(config_digest=config_deps)
+
+    def add_content_dependency(
+        self,
+        *file_paths: StrPathType,
+        globs: Sequence[str] = (),
+        base_dir: StrPathType = ".",
+        strategy: str = DEFAULT_HASH_STRATEGY,
+        key: str = "",
+    ) -> "ComposeTask":
+        """
+        Add a lazy dependency on the contents of file_paths and glob matches.
+
+        Contents are hashed with strategy only when doit checks the task and
+        unchanged files (by stat data) are not re-hashed. Digests are saved
+        under key, which defaults to a key unique to the arguments. See
+        ``ContentChanged`` and ``HASH_STRATEGIES``.
+        """
+        return self.add_uptodate_entry(
+            ContentChanged(
+                file_paths=file_paths,
+                globs=globs,
+                base_dir=base_dir,
+                key=key,
+                strategy=strategy,
+            )
+        )
+
+    def add_subtree_dependency(
+        self, tree: MerkleTree, rel_path: str = ""
+    ) -> "ComposeTask":
+        """
+        Add a dependency on the digest of a subtree of a MerkleTree.
+
+        The tree is walked once per process when the first dependent task is
+        checked. See ``SubtreeChanged``.
+        """
+        return self.add_uptodate_entry(SubtreeChanged(tree=tree, rel_path=rel_path))
+
     def add_name(self, name: str) -> "ComposeTask":
         """
         Add a name overwriting any existing.
@@ -380,48 +984,420 @@ class ComposeTask(NamedTuple):
         # current_config_changed.update(config_deps)
         # return self.uptodate.update(dict(_config_changed=current_config_changed))
 
+    def builder(self) -> "ComposeTaskBuilder":
+        """
+        Create a mutable builder initialized with the values of this task.
+
+        Each ``ComposeTask`` update copies all existing values which makes
+        long update chains quadratic. A builder appends in place and is
+        turned back into a ``ComposeTask`` with ``build``.
+        """
+        return ComposeTaskBuilder(self)
+
+    def batch_actions(
+        self, max_arg_length: int = DEFAULT_MAX_ARG_LENGTH
+    ) -> "ComposeTask":
+        """
+        Merge Actions with the same single-placeholder base into batches.
+
+        See ``batch_actions``.
+        """
+        return self._replace(actions=batch_actions(self.actions, max_arg_length))
+
     def compile_actions(self) -> "ComposeTask":
-        old_values_dict = _resolve_named_tuple_dict(self)
-        old_values_dict.pop("actions")
-        compiled_actions = []
+        """
+        Compile Actions into action strings.
+
+        File dependencies and targets of Actions are added to the task and
+        the task is made dependent on the Action base strings. Compiled
+        Actions that duplicate an earlier string action are skipped.
+        """
+        compiled_actions: List[Union[FuncType, str]] = []
+        seen_string_actions = set()
+        file_deps = list(self.file_dep)
+        targets = list(self.targets)
+        uptodate = self.uptodate
         for action in self.actions:
             if not isinstance(action, Action):
                 compiled_actions.append(action)
+                if isinstance(action, str):
+                    seen_string_actions.add(action)
             else:
                 compiled_action = action.compile()
-                if compiled_action not in compiled_actions:
+                if compiled_action not in seen_string_actions:
                     compiled_actions.append(compiled_action)
-                file_deps = action.file_deps()
-                targets = action.targets()
-                old_values_dict["file_dep"] = tuple(
-                    [*old_values_dict["file_dep"], *file_deps]
-                )
-                old_values_dict["targets"] = tuple(
-                    [*old_values_dict["targets"], *targets]
-                )
+                    seen_string_actions.add(compiled_action)
+                file_deps.extend(action.file_deps())
+                targets.extend(action.targets())
 
                 # Make task depend on the base action string
-                old_values_dict["uptodate"] = self.uptodate.update_config_changed(
+                uptodate = uptodate.update_config_changed(
                     config={action.base_str: action.base_str}
                 )
-        old_values_dict["actions"] = tuple(compiled_actions)
-        return ComposeTask(**old_values_dict)
+        return self._replace(
+            actions=tuple(compiled_actions),
+            file_dep=tuple(file_deps),
+            targets=tuple(targets),
+            uptodate=uptodate,
+        )
 
-    def compile(self) -> Dict[str, Any]:
+    def fingerprint(self) -> Hashable:
+        """
+        Get structural fingerprint.
+
+        Raises TypeError if the task contains unhashable values that are not
+        containers.
+        """
+        return _fingerprint_value(self)
+
+    @instrument.timed
+    def compile(self, use_cache: bool = True) -> Dict[str, Any]:
         """
         Compile into doit task dictionary definition.
+
+        Compiled definitions are cached by the structural fingerprint of the
+        task in a process-wide LRU cache of COMPILE_CACHE_MAXSIZE entries.
+        Tasks that cannot be fingerprinted are compiled without the cache.
+        See ``compile_cache_info`` for cache statistics.
+        """
+        key: Optional[Hashable] = None
+        if use_cache:
+            try:
+                # Resolved FileGlobs are stale after the listing cache is cleared
+                key = (self.fingerprint(), listing_cache_generation())
+            except TypeError:
+                key = None
+        if key is not None:
+            cached = _COMPILE_CACHE.get(key)
+            if cached is not None:
+                _COMPILE_CACHE.move_to_end(key)
+                _COMPILE_CACHE_COUNTS["hits"] += 1
+                return dict(cached)
+            _COMPILE_CACHE_COUNTS["misses"] += 1
+
+        compiled = self._compile()
+        if key is not None:
+            _COMPILE_CACHE[key] = compiled
+            while len(_COMPILE_CACHE) > COMPILE_CACHE_MAXSIZE:
+                _COMPILE_CACHE.popitem(last=False)
+        return dict(compiled)
+
+    def _compile(self) -> Dict[str, Any]:
+        """
+        Compile into doit task dictionary definition without caching.
         """
         actions_composed = self.compile_actions()
         resolved = _resolve_named_tuple_dict(actions_composed)
         resolved["uptodate"] = actions_composed.uptodate.compile()
+        if any(isinstance(file_dep, FileGlob) for file_dep in resolved["file_dep"]):
+            resolved["file_dep"] = tuple(
+                resolved_file_dep
+                for file_dep in resolved["file_dep"]
+                for resolved_file_dep in (
+                    file_dep.resolve()
+                    if isinstance(file_dep, FileGlob)
+                    else (file_dep,)
+                )
+            )
 
-        cleaned_resolved = resolved.copy()
+        cleaned_resolved = _dedup_compiled(resolved)
         for key, items in resolved.items():
             # Remove dictionary keys with empty tuples as values
             if items is None or len(items) == 0:
                 cleaned_resolved.pop(key)
-            # Remove duplicate file deps and targets
-            if key in ("file_deps", "targets"):
-                cleaned_resolved[key] = tuple(set(items))
 
         return cleaned_resolved
+
+
+class ComposeTaskBuilder:
+    """
+    Mutable builder with the same add methods as ``ComposeTask``.
+
+    Additions are amortized O(1) appends to lists.
+
+    >>> (
+    ...     ComposeTask(name="task")
+    ...     .builder()
+    ...     .add_file_deps("a.py")
+    ...     .add_file_deps("b.py")
+    ...     .build()
+    ...     .file_dep
+    ... )
+    ('a.py', 'b.py')
+    """
+
+    def __init__(self, compose_task: Optional[ComposeTask] = None):
+        """
+        Initialize builder from an existing ComposeTask.
+        """
+        compose_task = ComposeTask() if compose_task is None else compose_task
+        self.actions: List[ActionsType] = list(compose_task.actions)
+        self.file_dep: List[FileDepType] = list(compose_task.file_dep)
+        self.task_dep: List[FuncType] = list(compose_task.task_dep)
+        self.targets: List[StrPathType] = list(compose_task.targets)
+        self.result_deps: List[str] = list(compose_task.uptodate.result_deps)
+        self.config_changed: Optional[Dict[str, Any]] = (
+            None
+            if compose_task.uptodate.config_changed is None
+            else dict(compose_task.uptodate.config_changed)
+        )
+        self.config_digests: Optional[Dict[str, str]] = (
+            None
+            if compose_task.uptodate.config_digests is None
+            else dict(compose_task.uptodate.config_digests)
+        )
+        self.run_once: bool = compose_task.uptodate.run_once
+        self.extra_entries: List[Any] = list(compose_task.uptodate.extra_entries)
+        self.name: Optional[str] = compose_task.name
+
+    def add_actions(self, *actions: ActionsType) -> "ComposeTaskBuilder":
+        """
+        Add actions to task.
+        """
+        self.actions.extend(actions)
+        return self
+
+    def add_template_action(
+        self, template: ActionTemplate, *args: Any, **kwargs: Any
+    ) -> "ComposeTaskBuilder":
+        """
+        Add an action rendered from a precompiled ActionTemplate.
+        """
+        self.actions.append(template.render(*args, **kwargs))
+        self.file_dep.extend(template.file_deps(*args, **kwargs))
+        self.targets.extend(template.targets(*args, **kwargs))
+        return self.add_config_dependency({template.base_str: template.base_str})
+
+    def batch_actions(
+        self, max_arg_length: int = DEFAULT_MAX_ARG_LENGTH
+    ) -> "ComposeTaskBuilder":
+        """
+        Merge Actions with the same single-placeholder base into batches.
+        """
+        self.actions = list(batch_actions(self.actions, max_arg_length))
+        return self
+
+    def add_file_deps(self, *file_deps: FileDepType) -> "ComposeTaskBuilder":
+        """
+        Add file dependencies to task.
+        """
+        self.file_dep.extend(file_deps)
+        return self
+
+    def add_task_deps(self, *task_deps: FuncType) -> "ComposeTaskBuilder":
+        """
+        Add task dependencies to task.
+        """
+        self.task_dep.extend(_resolve_task_dep(task_dep) for task_dep in task_deps)
+        return self
+
+    def add_targets(self, *targets: StrPathType) -> "ComposeTaskBuilder":
+        """
+        Add targets to task.
+        """
+        self.targets.extend(targets)
+        return self
+
+    def add_result_dep(self, *result_deps: FuncType) -> "ComposeTaskBuilder":
+        """
+        Add a result dependency.
+        """
+        self.result_deps.extend(_resolve_task_dep(dep) for dep in result_deps)
+        return self
+
+    def add_config_dependency(
+        self, config_deps: Dict[str, Any]
+    ) -> "ComposeTaskBuilder":
+        """
+        Add a config_changed dependency.
+        """
+        if self.config_changed is None:
+            self.config_changed = {}
+        self.config_changed.update(config_deps)
+        return self
+
+    def add_config_digest_dependency(
+        self, config_deps: Dict[str, Any]
+    ) -> "ComposeTaskBuilder":
+        """
+        Add a config_changed dependency in digest mode.
+        """
+        if self.config_digests is None:
+            self.config_digests = {}
+        for key, value in config_deps.items():
+            self.config_digests[key] = digest_config_value(value)
+        return self
+
+    def add_content_dependency(
+        self,
+        *file_paths: StrPathType,
+        globs: Sequence[str] = (),
+        base_dir: StrPathType = ".",
+        strategy: str = DEFAULT_HASH_STRATEGY,
+        key: str = "",
+    ) -> "ComposeTaskBuilder":
+        """
+        Add a lazy dependency on the contents of file_paths and glob matches.
+        """
+        return self.add_uptodate_entry(
+            ContentChanged(
+                file_paths=file_paths,
+                globs=globs,
+                base_dir=base_dir,
+                key=key,
+                strategy=strategy,
+            )
+        )
+
+    def add_subtree_dependency(
+        self, tree: MerkleTree, rel_path: str = ""
+    ) -> "ComposeTaskBuilder":
+        """
+        Add a dependency on the digest of a subtree of a MerkleTree.
+        """
+        return self.add_uptodate_entry(SubtreeChanged(tree=tree, rel_path=rel_path))
+
+    def add_name(self, name: str) -> "ComposeTaskBuilder":
+        """
+        Add a name overwriting any existing.
+        """
+        self.name = name
+        return self
+
+    def add_uptodate_entry(self, entry: Any) -> "ComposeTaskBuilder":
+        """
+        Add an entry to uptodate list.
+        """
+        self.extra_entries.append(entry)
+        return self
+
+    def toggle_run_once(self) -> "ComposeTaskBuilder":
+        """
+        Toggle run_once in uptodate config.
+        """
+        self.run_once = not self.run_once
+        return self
+
+    def build(self) -> ComposeTask:
+        """
+        Build an immutable ComposeTask from current values.
+        """
+        return ComposeTask(
+            actions=tuple(self.actions),
+            file_dep=tuple(self.file_dep),
+            task_dep=tuple(self.task_dep),
+            targets=tuple(self.targets),
+            uptodate=UpToDate(
+                result_deps=tuple(self.result_deps),
+                config_changed=(
+                    None if self.config_changed is None else dict(self.config_changed)
+                ),
+                run_once=self.run_once,
+                extra_entries=tuple(self.extra_entries),
+                config_digests=(
+                    None if self.config_digests is None else dict(self.config_digests)
+                ),
+            ),
+            name=self.name,
+        )
+
+
+def _merge_compiled(base: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge two compiled task definitions.
+
+    Tuple values are concatenated with values of base first and other
+    values of other overwrite those of base.
+    """
+    merged = dict(base)
+    for key, value in other.items():
+        base_value = merged.get(key)
+        if isinstance(base_value, tuple) and isinstance(value, tuple):
+            merged[key] = base_value + value
+        else:
+            merged[key] = value
+    return _dedup_compiled(merged)
+
+
+def compose_matrix(
+    base: ComposeTask,
+    axes: Mapping[str, Sequence[Any]],
+    subtask: Callable[..., ComposeTask],
+    name: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yield compiled doit subtasks over the product of parameter axes.
+
+    base is compiled once and shared by all subtasks. For each combination
+    of axes values, subtask is called with the values as keyword arguments
+    and should return the per-subtask part as a ``ComposeTask``. It is
+    compiled and merged with the compiled base only when the subtask is
+    consumed. Uptodate specs are merged before compiling so that each
+    subtask gets a single ``config_changed``. The subtask name is taken
+    from the returned ``ComposeTask``, from the name format template or
+    defaults to the values joined with ``-``.
+
+    >>> subtasks = compose_matrix(
+    ...     base=ComposeTask().add_file_deps("dodo.py"),
+    ...     axes={"python": ["3.8", "3.9"]},
+    ...     subtask=lambda python: ComposeTask().add_actions(f"nox -p {python}"),
+    ...     name="py{python}",
+    ... )
+    >>> [(task["name"], task["actions"]) for task in subtasks]
+    [('py3.8', ('nox -p 3.8',)), ('py3.9', ('nox -p 3.9',))]
+    """
+    compiled_base = base.compile()
+    compiled_base.pop("name", None)
+    compiled_base.pop("uptodate", None)
+    base_uptodate = base.compile_actions().uptodate
+    keys = list(axes)
+    for values in product(*(axes[key] for key in keys)):
+        parameters = dict(zip(keys, values))
+        composed = subtask(**parameters).compile_actions()
+        compiled_subtask = composed._replace(
+            uptodate=base_uptodate.merge(composed.uptodate)
+        ).compile(use_cache=False)
+        if "name" not in compiled_subtask:
+            compiled_subtask["name"] = (
+                name.format(**parameters)
+                if name is not None
+                else "-".join(str(value) for value in values)
+            )
+        yield _merge_compiled(compiled_base, compiled_subtask)
+
+
+def lazy_task(
+    factory: Callable[[], Union[ComposeTask, Iterable[ComposeTask]]],
+) -> Callable[[], Any]:
+    """
+    Create a doit task creator that composes the task only when needed.
+
+    factory returns a ``ComposeTask`` or an iterable of named
+    ``ComposeTask``s (subtasks). The task is registered with doit as a
+    delayed task named after factory without the ``task_`` prefix. Commands
+    such as ``doit list`` and tab completion do not call factory and it is
+    called and compiled only when doit runs the task. Targets of lazy tasks
+    are unknown to doit before creation so consumers should depend on them
+    with ``task_dep``.
+
+    >>> @lazy_task
+    ... def task_hello():
+    ...     return ComposeTask().add_actions("echo hello")
+    >>> task_hello()
+    {'actions': ('echo hello',)}
+    """
+    # pylint: disable=import-outside-toplevel
+    from doit.loader import create_after
+
+    name = factory.__name__
+    basename = name[len("task_") :] if name.startswith("task_") else name
+
+    @wraps(factory)
+    def _creator() -> Union[Dict[str, Any], Iterator[Dict[str, Any]]]:
+        composed = factory()
+        if isinstance(composed, ComposeTask):
+            return composed.compile()
+        return (compose_task.compile() for compose_task in composed)
+
+    creator: Callable[[], Any] = create_after(creates=[basename])(_creator)
+    return creator
@@ -0,0 +1,292 @@
+"""
+Execution of Python-callable actions in a persistent process pool.
+
+doit runs Python-callable actions in its own process, so with the
+thread-based parallel runner (``doit -n 8 -P thread``) CPU-bound actions
+are serialized by the GIL. Wrapping callables with ``pool_action``
+dispatches them from the runner threads to a shared, reusable process pool
+instead. Calls submitted while all workers are busy are batched so that
+thousands of tiny calls do not each pay the inter-process round trip.
+
+Without an explicit pool, actions run inline when called from the main
+thread, i.e., with the sequential runner and in the worker processes of the
+default process-based parallel runner (``doit -n 8``). These already run
+actions one at a time per process, where a pool would only add a round trip
+or start a pool per doit worker.
+
+Functions and their arguments must be picklable, i.e., functions must be
+defined at module level.
+"""
+
+import atexit
+import os
+import threading
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_MAX_BATCH_SIZE = 64
+
+CallType = Tuple[Callable[..., Any], Tuple[Any, ...], Dict[str, Any]]
+OutcomeType = Tuple[bool, Any, Optional[str]]
+
+
+class RemoteTraceback(Exception):
+    """
+    Traceback of an exception raised in a pool worker.
+    """
+
+    def __str__(self) -> str:
+        """
+        Show the remote traceback as is.
+        """
+        return str(self.args[0])
+
+
+def _run_batch(calls: List[CallType]) -> List[OutcomeType]:
+    """
+    Run a batch of calls in a worker and collect their outcomes.
+    """
+    outcomes: List[OutcomeType] = []
+    for function, args, kwargs in calls:
+        try:
+            outcomes.append((True, function(*args, **kwargs), None))
+        except Exception as exc:  # pylint: disable=broad-except
+            outcomes.append((False, exc, traceback.format_exc()))
+    return outcomes
+
+
+class ActionPool:
+    """
+    Persistent process pool with adaptive batching of calls.
+
+    Calls are dispatched immediately while fewer than workers batches are
+    running. Otherwise they are queued and sent as a single batch of at most
+    max_batch_size calls when a running batch finishes. The worker processes
+    are started on first use and reused until shutdown.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    ):
+        """
+        Initialize pool without starting worker processes.
+        """
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.max_batch_size = max_batch_size
+        self.stats = {"calls": 0, "batches": 0}
+        self._lock = threading.RLock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._pending: List[Tuple[CallType, Future]] = []
+        self._running = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Pickle only the configuration of the pool.
+        """
+        return dict(workers=self.workers, max_batch_size=self.max_batch_size)
+
+    def __setstate__(self, state: Dict[str, Any]):
+        """
+        Initialize unpickled pool.
+        """
+        self.__init__(**state)  # type: ignore[misc]
+
+    def _executor_locked(self) -> ProcessPoolExecutor:
+        """
+        Get the process pool, starting it in this process if needed.
+        """
+        if self._executor is None or self._pid != os.getpid():
+            # Pools inherited from a parent process cannot be used
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def _submit_locked(self, calls: List[CallType]) -> Future:
+        """
+        Submit a batch of calls to the process pool.
+
+        A pool broken by a crashed worker is replaced with a new one.
+        """
+        try:
+            return self._executor_locked().submit(_run_batch, calls)
+        except BrokenProcessPool:
+            self._executor = None
+            return self._executor_locked().submit(_run_batch, calls)
+
+    def _flush_locked(self):
+        """
+        Dispatch queued calls as a single batch.
+        """
+        if not self._pending:
+            return
+        batch = self._pending[: self.max_batch_size]
+        del self._pending[: self.max_batch_size]
+        futures = [future for _, future in batch]
+        self._running += 1
+        self.stats["batches"] += 1
+        try:
+            batch_future = self._submit_locked([call for call, _ in batch])
+        except Exception as exc:  # pylint: disable=broad-except
+            # E.g. pool shut down, fail the batch and move on to queued calls
+            self._running -= 1
+            for future in futures:
+                future.set_exception(exc)
+            self._flush_locked()
+            return
+        batch_future.add_done_callback(
+            partial(self._batch_done, self._executor, futures)
+        )
+
+    def _batch_done(
+        self,
+        executor: Optional[ProcessPoolExecutor],
+        futures: List[Future],
+        batch_future: Future,
+    ):
+        """
+        Resolve futures of a finished batch and dispatch queued calls.
+        """
+        try:
+            outcomes = batch_future.result()
+        except BaseException as exc:  # pylint: disable=broad-except
+            # E.g. a crashed worker or unpicklable arguments or results
+            for future in futures:
+                future.set_exception(exc)
+            broken = isinstance(exc, BrokenProcessPool)
+        else:
+            for future, (success, value, remote_traceback) in zip(futures, outcomes):
+                if success:
+                    future.set_result(value)
+                else:
+                    value.__cause__ = RemoteTraceback(remote_traceback)
+                    future.set_exception(value)
+            broken = False
+        with self._lock:
+            if broken and self._executor is executor:
+                # A crashed worker breaks the whole pool for good
+                self._executor = None
+            self._running -= 1
+            self._flush_locked()
+
+    def submit(self, function: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        Submit a call of function to the pool.
+        """
+        future: Future = Future()
+        with self._lock:
+            self.stats["calls"] += 1
+            self._pending.append(((function, args, kwargs), future))
+            if (
+                self._running < self.workers
+                or len(self._pending) >= self.max_batch_size
+            ):
+                self._flush_locked()
+        return future
+
+    def map(self, function: Callable[..., Any], *iterables: Iterable[Any]) -> List[Any]:
+        """
+        Call function with arguments from iterables and return the results.
+
+        The first exception raised by a call is re-raised.
+        """
+        futures = [self.submit(function, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """
+        Stop the worker processes after running calls have finished.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True)
+
+
+_DEFAULT_POOL: Dict[str, ActionPool] = {}
+
+
+def default_pool() -> ActionPool:
+    """
+    Get the shared default ActionPool.
+    """
+    if "pool" not in _DEFAULT_POOL:
+        _DEFAULT_POOL["pool"] = ActionPool()
+    return _DEFAULT_POOL["pool"]
+
+
+def shutdown_default_pool():
+    """
+    Stop the worker processes of the shared default ActionPool.
+    """
+    pool = _DEFAULT_POOL.pop("pool", None)
+    if pool is not None:
+        pool.shutdown()
+
+
+class PoolAction:
+    """
+    doit Python-callable action that runs function in an ActionPool.
+
+    The return value of function is passed back to doit as is, i.e.,
+    ``False`` fails the task and a dictionary is saved as task values.
+    Exceptions are re-raised with the remote traceback as their cause.
+    Without pool, the default pool is used only off the main thread and
+    function is called inline otherwise (see module docstring).
+    """
+
+    __slots__ = ("function", "args", "kwargs", "pool")
+
+    def __init__(
+        self,
+        function: Callable[..., Any],
+        args: Tuple[Any, ...] = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        pool: Optional[ActionPool] = None,
+    ):
+        """
+        Initialize action.
+        """
+        self.function = function
+        self.args = args
+        self.kwargs = {} if kwargs is None else kwargs
+        self.pool = pool
+
+    def __call__(self) -> Any:
+        """
+        Run function in the pool and wait for its result.
+        """
+        pool = self.pool
+        if pool is None:
+            if threading.current_thread() is threading.main_thread():
+                return self.function(*self.args, **self.kwargs)
+            pool = default_pool()
+        return pool.submit(self.function, *self.args, **self.kwargs).result()
+
+    def __repr__(self) -> str:
+        """
+        Represent action by the name of its function.
+        """
+        return f"PoolAction({getattr(self.function, '__qualname__', self.function)})"
+
+
+def pool_action(
+    function: Callable[..., Any],
+    *args,
+    pool: Optional[ActionPool] = None,
+    **kwargs,
+) -> PoolAction:
+    """
+    Wrap a call of function as an action that runs in a process pool.
+
+    The result can be added to a task with ``ComposeTask.add_actions``.
+    """
+    return PoolAction(function=function, args=args, kwargs=kwargs, pool=pool)
+
+
+atexit.register(shutdown_default_pool)
@@ -0,0 +1,323 @@
+"""
+Static analysis of doit task graphs.
+
+Tasks are analyzed without running doit. A task depends on its
+``task_dep`` tasks, on tasks whose results it depends on (``result_dep``)
+and on the tasks that produce its ``file_dep`` files as ``targets``.
+"""
+
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from doit_ext.compose import ComposeTask, _path_key
+
+DEFAULT_DURATION = 1.0
+
+
+class TaskNode(NamedTuple):
+    """
+    Dependency information of a single task.
+    """
+
+    name: str
+    task_dep: Tuple[str, ...] = ()
+    file_dep: Tuple[str, ...] = ()
+    targets: Tuple[str, ...] = ()
+
+
+class TaskGraphReport(NamedTuple):
+    """
+    Summary of a task graph.
+    """
+
+    levels: List[List[str]]
+    critical_path: List[str]
+    critical_path_duration: float
+    max_parallelism: int
+    cycles: List[List[str]]
+
+
+def _result_dep_names(uptodate: Iterable[Any]) -> List[str]:
+    """
+    Get names of tasks from result_dep entries of uptodate.
+    """
+    names = []
+    for entry in uptodate:
+        # doit Task objects store uptodate entries as (entry, args, kwargs)
+        if isinstance(entry, tuple) and len(entry) > 0:
+            entry = entry[0]
+        dep_name = getattr(entry, "dep_name", None)
+        if isinstance(dep_name, str):
+            names.append(dep_name)
+    return names
+
+
+def task_node(name: str, task: Any) -> TaskNode:
+    """
+    Create TaskNode from a ComposeTask, a doit task dictionary or a doit Task.
+    """
+    if isinstance(task, ComposeTask):
+        task = task.compile()
+    if isinstance(task, Mapping):
+        task_dep = list(task.get("task_dep", ()))
+        file_dep = task.get("file_dep", ())
+        targets = task.get("targets", ())
+        uptodate = task.get("uptodate", ())
+    else:
+        task_dep = list(task.task_dep)
+        file_dep = sorted(task.file_dep)
+        targets = task.targets
+        uptodate = task.uptodate
+    task_dep.extend(_result_dep_names(uptodate))
+    return TaskNode(
+        name=name,
+        task_dep=tuple(dict.fromkeys(task_dep)),
+        file_dep=tuple(_path_key(path) for path in file_dep),
+        targets=tuple(_path_key(path) for path in targets),
+    )
+
+
+class TaskGraph:
+    """
+    Dependency graph of tasks.
+
+    durations (e.g. from previous runs) weight the critical path and the
+    parallelism estimate. Tasks without a duration take DEFAULT_DURATION.
+    """
+
+    def __init__(
+        self,
+        nodes: Iterable[TaskNode],
+        durations: Optional[Mapping[str, float]] = None,
+    ):
+        """
+        Resolve dependency edges between nodes.
+        """
+        self.nodes: Dict[str, TaskNode] = {node.name: node for node in nodes}
+        self.durations = {} if durations is None else dict(durations)
+        self.producers: Dict[str, str] = {}
+        for node in self.nodes.values():
+            for target in node.targets:
+                self.producers.setdefault(target, node.name)
+
+        self.dependencies: Dict[str, Set[str]] = {}
+        self.missing: Dict[str, Set[str]] = {}
+        for node in self.nodes.values():
+            dependencies = set()
+            for dep in node.task_dep:
+                if dep in self.nodes:
+                    dependencies.add(dep)
+                else:
+                    self.missing.setdefault(node.name, set()).add(dep)
+            for file_dep in node.file_dep:
+                producer = self.producers.get(file_dep)
+                if producer is not None and producer != node.name:
+                    dependencies.add(producer)
+            self.dependencies[node.name] = dependencies
+
+    def duration(self, name: str) -> float:
+        """
+        Get duration of task.
+        """
+        return self.durations.get(name, DEFAULT_DURATION)
+
+    def find_cycles(self) -> List[List[str]]:
+        """
+        Find dependency cycles as strongly connected components.
+        """
+        index_counter = [0]
+        indexes: Dict[str, int] = {}
+        lowlinks: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack: Set[str] = set()
+        cycles = []
+
+        for root in sorted(self.nodes):
+            if root in indexes:
+                continue
+            # Iterative Tarjan's algorithm
+            work = [(root, iter(sorted(self.dependencies[root])))]
+            indexes[root] = lowlinks[root] = index_counter[0]
+            index_counter[0] += 1
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                name, dependencies = work[-1]
+                for dep in dependencies:
+                    if dep not in indexes:
+                        indexes[dep] = lowlinks[dep] = index_counter[0]
+                        index_counter[0] += 1
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(sorted(self.dependencies[dep]))))
+                        break
+                    if dep in on_stack:
+                        lowlinks[name] = min(lowlinks[name], indexes[dep])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlinks[parent] = min(lowlinks[parent], lowlinks[name])
+                    if lowlinks[name] == indexes[name]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == name:
+                                break
+                        if len(component) > 1 or name in self.dependencies[name]:
+                            cycles.append(sorted(component))
+        return cycles
+
+    def levels(self) -> List[List[str]]:
+        """
+        Group tasks into levels that can run once all earlier levels are done.
+
+        Every level is the set of tasks that are ready to run when the tasks
+        of previous levels have finished. Raises ValueError on cycles.
+        """
+        remaining = {
+            name: len(dependencies) for name, dependencies in self.dependencies.items()
+        }
+        dependents: Dict[str, List[str]] = {name: [] for name in self.nodes}
+        for name, dependencies in self.dependencies.items():
+            for dep in dependencies:
+                dependents[dep].append(name)
+
+        levels = []
+        ready = sorted(name for name, count in remaining.items() if count == 0)
+        while ready:
+            levels.append(ready)
+            next_ready = []
+            for name in ready:
+                for dependent in dependents[name]:
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        next_ready.append(dependent)
+            ready = sorted(next_ready)
+
+        if sum(len(level) for level in levels) != len(self.nodes):
+            raise ValueError(f"Task graph has cycles: {self.find_cycles()}")
+        return levels
+
+    def _schedule(self) -> Dict[str, Tuple[float, float]]:
+        """
+        Resolve start and end times of tasks with unlimited workers.
+        """
+        schedule: Dict[str, Tuple[float, float]] = {}
+        for level in self.levels():
+            for name in level:
+                start = max(
+                    (schedule[dep][1] for dep in self.dependencies[name]), default=0.0
+                )
+                schedule[name] = (start, start + self.duration(name))
+        return schedule
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """
+        Get the longest chain of dependent tasks and its total duration.
+        """
+        schedule = self._schedule()
+        if not schedule:
+            return [], 0.0
+        name = max(schedule, key=lambda task: (schedule[task][1], task))
+        total_duration = schedule[name][1]
+        path = [name]
+        while True:
+            start = schedule[name][0]
+            critical_deps = [
+                dep for dep in self.dependencies[name] if schedule[dep][1] == start
+            ]
+            if not critical_deps:
+                break
+            name = max(critical_deps)
+            path.append(name)
+        return list(reversed(path)), total_duration
+
+    def max_parallelism(self) -> int:
+        """
+        Get the maximum amount of tasks that can run at the same time.
+
+        Tasks are scheduled as soon as their dependencies have finished with
+        unlimited workers. Using more workers (``doit -n``) than the maximum
+        amount of concurrently running tasks in this schedule cannot make
+        the run faster.
+        """
+        events = []
+        for start, end in self._schedule().values():
+            events.append((start, 1))
+            events.append((end, -1))
+        running = 0
+        max_running = 0
+        # Ends sort before starts at equal times
+        for _, change in sorted(events):
+            running += change
+            max_running = max(max_running, running)
+        return max_running
+
+    def report(self) -> TaskGraphReport:
+        """
+        Summarize the task graph.
+        """
+        cycles = self.find_cycles()
+        if cycles:
+            return TaskGraphReport(
+                levels=[],
+                critical_path=[],
+                critical_path_duration=0.0,
+                max_parallelism=0,
+                cycles=cycles,
+            )
+        critical_path, critical_path_duration = self.critical_path()
+        return TaskGraphReport(
+            levels=self.levels(),
+            critical_path=critical_path,
+            critical_path_duration=critical_path_duration,
+            max_parallelism=self.max_parallelism(),
+            cycles=[],
+        )
+
+
+def build_task_graph(
+    tasks: Union[Mapping[str, Any], Sequence[Any]],
+    durations: Optional[Mapping[str, float]] = None,
+) -> TaskGraph:
+    """
+    Build a TaskGraph from named tasks.
+
+    tasks is either a mapping of task names to ``ComposeTask``s or doit task
+    dictionaries, or a sequence of doit ``Task`` objects.
+    """
+    if isinstance(tasks, Mapping):
+        nodes = [task_node(name, task) for name, task in tasks.items()]
+    else:
+        nodes = [task_node(task.name, task) for task in tasks]
+    return TaskGraph(nodes=nodes, durations=durations)
+
+
+def load_dodo_task_graph(
+    dodo_path: Union[Path, str] = "dodo.py",
+    durations: Optional[Mapping[str, float]] = None,
+) -> TaskGraph:
+    """
+    Build a TaskGraph of the tasks defined in a ``dodo.py`` file.
+    """
+    # pylint: disable=import-outside-toplevel
+    from doit.loader import get_module, load_tasks
+
+    dodo_module = get_module(str(dodo_path))
+    tasks = load_tasks(dict(vars(dodo_module)), allow_delayed=True)
+    return build_task_graph(tasks, durations=durations)
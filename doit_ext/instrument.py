@@ -0,0 +1,177 @@
+"""
+Opt-in instrumentation of doit_ext hot paths.
+
+Instrumentation is enabled by setting the ``DOIT_EXT_INSTRUMENT``
+environment variable to a report path (or ``1`` for the default path) or
+with the ``instrumented`` context manager. Call counts, cumulative time,
+bytes hashed and files stat'ed are recorded per task, i.e., per the
+``task_*`` function of ``dodo.py`` that the call originates from. The
+report is written when the process exits or the context manager is
+exited. Reports with a ``.json`` suffix are written as JSON and others in
+the collapsed stack format understood by flamegraph tools.
+"""
+
+import atexit
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from types import FrameType
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar, Union
+
+INSTRUMENT_ENV_VAR = "DOIT_EXT_INSTRUMENT"
+DEFAULT_REPORT_PATH = Path("doit_ext_instrument.json")
+UNKNOWN_TASK_LABEL = "<dodo>"
+
+CALLS = "calls"
+SECONDS = "seconds"
+BYTES_HASHED = "bytes_hashed"
+FILES_STATED = "files_stated"
+
+StatsType = Dict[str, Dict[str, Dict[str, float]]]
+FunctionType = TypeVar("FunctionType", bound=Callable[..., Any])
+
+_STATE: Dict[str, Any] = {"enabled": False, "report_path": None}
+_STATS: StatsType = {}
+
+
+def is_enabled() -> bool:
+    """
+    Check if instrumentation is enabled.
+    """
+    return bool(_STATE["enabled"])
+
+
+def _task_label() -> str:
+    """
+    Resolve name of the doit task function in the current call stack.
+    """
+    frame: Optional[FrameType] = sys._getframe(2)
+    while frame is not None:
+        name = frame.f_code.co_name
+        if name.startswith("task_"):
+            return name[len("task_") :]
+        frame = frame.f_back
+    return UNKNOWN_TASK_LABEL
+
+
+def _counters(label: str, function_name: str) -> Dict[str, float]:
+    """
+    Get counters of function_name under label.
+    """
+    return _STATS.setdefault(label, {}).setdefault(
+        function_name, {CALLS: 0, SECONDS: 0.0, BYTES_HASHED: 0, FILES_STATED: 0}
+    )
+
+
+def count(counter: str, amount: float, function_name: str):
+    """
+    Add amount to counter of function_name if instrumentation is enabled.
+    """
+    if not _STATE["enabled"]:
+        return
+    _counters(_task_label(), function_name)[counter] += amount
+
+
+def timed(function: FunctionType) -> FunctionType:
+    """
+    Record call count and cumulative time of function when enabled.
+    """
+    function_name = function.__qualname__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _STATE["enabled"]:
+            return function(*args, **kwargs)
+        counters = _counters(_task_label(), function_name)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            counters[SECONDS] += time.perf_counter() - start
+            counters[CALLS] += 1
+
+    return wrapper  # type: ignore[return-value]
+
+
+def report() -> StatsType:
+    """
+    Get a copy of recorded statistics.
+    """
+    return {
+        label: {name: dict(counters) for name, counters in functions.items()}
+        for label, functions in _STATS.items()
+    }
+
+
+def dump_report(report_path: Union[Path, str]):
+    """
+    Write recorded statistics to report_path.
+
+    The collapsed stack format contains cumulative time in microseconds.
+    """
+    report_path = Path(report_path)
+    if report_path.suffix == ".json":
+        report_path.write_text(json.dumps(report(), indent=2, sort_keys=True))
+        return
+    lines = [
+        f"{label};{name} {round(counters[SECONDS] * 1e6)}"
+        for label, functions in sorted(_STATS.items())
+        for name, counters in sorted(functions.items())
+    ]
+    report_path.write_text("\n".join(lines) + "\n")
+
+
+def _dump_at_exit():
+    """
+    Dump report at exit if instrumentation is still enabled.
+    """
+    if _STATE["enabled"] and _STATE["report_path"] is not None:
+        dump_report(_STATE["report_path"])
+
+
+def enable(report_path: Optional[Union[Path, str]] = None):
+    """
+    Enable instrumentation with report written at exit to report_path.
+    """
+    _STATE["enabled"] = True
+    _STATE["report_path"] = report_path
+
+
+def disable():
+    """
+    Disable instrumentation and clear recorded statistics.
+    """
+    _STATE["enabled"] = False
+    _STATE["report_path"] = None
+    _STATS.clear()
+
+
+@contextmanager
+def instrumented(report_path: Optional[Union[Path, str]] = None) -> Iterator[StatsType]:
+    """
+    Enable instrumentation within the context.
+
+    Yields the live statistics and writes them to report_path on exit if
+    given.
+    """
+    enable()
+    try:
+        yield _STATS
+        if report_path is not None:
+            dump_report(report_path)
+    finally:
+        disable()
+
+
+atexit.register(_dump_at_exit)
+
+if os.environ.get(INSTRUMENT_ENV_VAR):
+    enable(
+        DEFAULT_REPORT_PATH
+        if os.environ[INSTRUMENT_ENV_VAR] == "1"
+        else os.environ[INSTRUMENT_ENV_VAR]
+    )
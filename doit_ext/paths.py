@@ -2,44 +2,1193 @@
 Path utilities.
 """
 
-from hashlib import sha256
+import fnmatch
+import importlib.util
+import json
+import os
+import re
+import stat
+import time
+from functools import partial
+from hashlib import blake2b, sha256
 from pathlib import Path
 from pickle import dumps
-from typing import Dict, List
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
+from doit_ext import instrument
 
-def find_python_source_files(base_dir: Path) -> List[Path]:
+if TYPE_CHECKING:
+    import sqlite3
+
+StrPathType = Union[Path, str]
+
+DEFAULT_HASH_CACHE_PATH = Path(".doit_ext_hash_cache.sqlite3")
+
+# Files modified within this window are not cached as their mtime cannot yet
+# be trusted to change on a further modification (racily clean files).
+RACY_MTIME_WINDOW_NS = 2_000_000_000
+
+# Files are hashed in fixed size chunks to keep memory use bounded
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Hash strategies are selected by name, see HASH_STRATEGIES
+DEFAULT_HASH_STRATEGY = "sha256"
+
+# The sampled hash strategy reads the head, the tail and evenly spaced blocks
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCKS = 8
+
+# SQLite integers are signed 64-bit
+_INODE_MASK = 0x7FFF_FFFF_FFFF_FFFF
+
+StatKeyType = Tuple[int, int, int]
+
+# Directories and files skipped by default when walking. Generic names are
+# anchored to the walked directory so that, e.g., packages named build are
+# still found.
+DEFAULT_EXCLUDES = (
+    ".git",
+    ".hg",
+    ".svn",
+    ".venv",
+    "/venv",
+    "node_modules",
+    "__pycache__",
+    ".nox",
+    ".tox",
+    ".mypy_cache",
+    ".pytest_cache",
+    ".ruff_cache",
+    "/build",
+    "/dist",
+    "*.egg-info",
+)
+
+
+class _IgnoreRule(NamedTuple):
+    """
+    Single parsed ``.gitignore`` pattern.
+    """
+
+    regex: Pattern
+    negate: bool
+    dir_only: bool
+    anchored: bool
+    base: str
+
+
+def _compile_patterns(patterns: Sequence[str]) -> Optional[Pattern]:
+    """
+    Compile glob patterns into a single regex.
+    """
+    if len(patterns) == 0:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+def _compile_excludes(
+    excludes: Sequence[str],
+) -> Tuple[Optional[Pattern], Optional[Pattern]]:
+    """
+    Compile excludes into regexes of names and of relative paths.
+
+    Patterns containing a ``/`` are matched against the path relative to
+    the walked directory and other patterns against names.
+    """
+    return (
+        _compile_patterns([pattern for pattern in excludes if "/" not in pattern]),
+        _compile_patterns(
+            [pattern.strip("/") for pattern in excludes if "/" in pattern]
+        ),
+    )
+
+
+def _parse_gitignore(path: str, base: str) -> List[_IgnoreRule]:
+    """
+    Parse ``.gitignore`` file at path with patterns relative to base.
+
+    Supports comments, negation, directory-only and anchored patterns.
+    """
+    rules = []
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            if line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if line.startswith("**/"):
+                line = line[3:]
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if not line:
+                continue
+            rules.append(
+                _IgnoreRule(
+                    regex=re.compile(fnmatch.translate(line)),
+                    negate=negate,
+                    dir_only=dir_only,
+                    anchored=anchored,
+                    base=base,
+                )
+            )
+    return rules
+
+
+def _is_ignored(
+    rel_path: str, name: str, is_dir: bool, rules: Sequence[_IgnoreRule]
+) -> bool:
+    """
+    Check if rel_path is ignored by the rules (last matching rule wins).
+    """
+    for rule in reversed(rules):
+        if rule.dir_only and not is_dir:
+            continue
+        if rule.anchored:
+            target = rel_path[len(rule.base) + 1 :] if rule.base else rel_path
+        else:
+            target = name
+        if rule.regex.match(target):
+            return not rule.negate
+    return False
+
+
+# Entries are (name, path, is_dir) tuples sorted by name
+DirectoryListingType = Tuple[Tuple[str, str, bool], ...]
+
+_LISTING_CACHE: Dict[str, DirectoryListingType] = {}
+_LISTING_CACHE_STATE = {"generation": 0}
+
+
+def clear_listing_cache():
+    """
+    Clear the process-wide cache of directory listings.
+    """
+    _LISTING_CACHE.clear()
+    _LISTING_CACHE_STATE["generation"] += 1
+
+
+def listing_cache_generation() -> int:
+    """
+    Get a counter that is incremented every time the listing cache is cleared.
+    """
+    return _LISTING_CACHE_STATE["generation"]
+
+
+def _scan_directory(directory: str, use_listing_cache: bool) -> DirectoryListingType:
+    """
+    List directory entries sorted by name.
+
+    Missing and unreadable directories are listed as empty.
+    """
+    if use_listing_cache:
+        cached = _LISTING_CACHE.get(directory)
+        if cached is not None:
+            return cached
+    try:
+        with os.scandir(directory) as scanned:
+            listing = tuple(
+                sorted(
+                    (entry.name, entry.path, entry.is_dir(follow_symlinks=False))
+                    for entry in scanned
+                )
+            )
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        listing = ()
+    if use_listing_cache:
+        _LISTING_CACHE[directory] = listing
+    return listing
+
+
+def _walk_files(
+    directory: str,
+    rel_dir: str,
+    suffixes: Tuple[str, ...],
+    excludes: Optional[Pattern],
+    rel_excludes: Optional[Pattern],
+    rules: List[_IgnoreRule],
+    respect_gitignore: bool,
+    pattern: Optional[Pattern],
+    use_listing_cache: bool,
+) -> Iterator[Path]:
+    """
+    Walk directory depth-first in sorted order pruning excluded subtrees.
+    """
+    entries = _scan_directory(directory, use_listing_cache=use_listing_cache)
+    if respect_gitignore and any(name == ".gitignore" for name, _, _ in entries):
+        rules = [
+            *rules,
+            *_parse_gitignore(os.path.join(directory, ".gitignore"), base=rel_dir),
+        ]
+    for name, path, is_dir in entries:
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        if excludes is not None and excludes.match(name):
+            continue
+        if rel_excludes is not None and rel_excludes.match(rel_path):
+            continue
+        if rules and _is_ignored(rel_path, name, is_dir, rules):
+            continue
+        if is_dir:
+            yield from _walk_files(
+                directory=path,
+                rel_dir=rel_path,
+                suffixes=suffixes,
+                excludes=excludes,
+                rel_excludes=rel_excludes,
+                rules=rules,
+                respect_gitignore=respect_gitignore,
+                pattern=pattern,
+                use_listing_cache=use_listing_cache,
+            )
+        elif name.endswith(suffixes) and (pattern is None or pattern.match(rel_path)):
+            yield Path(path)
+
+
+def walk_files(
+    base_dir: Path,
+    suffixes: Sequence[str] = (".py",),
+    excludes: Sequence[str] = DEFAULT_EXCLUDES,
+    respect_gitignore: bool = True,
+    pattern: Optional[str] = None,
+    use_listing_cache: bool = False,
+) -> Iterator[Path]:
+    """
+    Lazily find files ending with any of suffixes in base_dir.
+
+    Directories and files with a name matching any of the excludes glob
+    patterns are skipped and whole excluded subtrees are pruned. Patterns
+    containing a ``/`` are matched against the path relative to base_dir.
+    ``.gitignore`` files found within base_dir are honored if
+    respect_gitignore is True. If pattern is given, only files with a
+    relative path matching the glob pattern are included. Paths are yielded
+    in sorted order.
+
+    With use_listing_cache, directory listings are read from and stored in
+    a process-wide cache so walks over the same or overlapping trees list
+    every directory only once. See ``clear_listing_cache``.
+    """
+    name_excludes, rel_excludes = _compile_excludes(excludes)
+    return _walk_files(
+        directory=str(base_dir),
+        rel_dir="",
+        suffixes=tuple(suffixes),
+        excludes=name_excludes,
+        rel_excludes=rel_excludes,
+        rules=[],
+        respect_gitignore=respect_gitignore,
+        pattern=None if pattern is None else _compile_patterns([pattern]),
+        use_listing_cache=use_listing_cache,
+    )
+
+
+class FileGlob(NamedTuple):
+    """
+    Glob of files that can be used as a file dependency.
+
+    Matches files in base_dir with a relative path matching pattern (where
+    ``*`` also matches ``/``) using ``walk_files``. The glob is resolved when
+    a ``ComposeTask`` is compiled using the process-wide directory listing
+    cache.
+    """
+
+    base_dir: StrPathType
+    pattern: str = "*.py"
+    excludes: Tuple[str, ...] = DEFAULT_EXCLUDES
+    respect_gitignore: bool = True
+
+    def resolve(self) -> List[Path]:
+        """
+        Resolve matching files.
+        """
+        return list(
+            walk_files(
+                base_dir=Path(self.base_dir),
+                suffixes=("",),
+                excludes=self.excludes,
+                respect_gitignore=self.respect_gitignore,
+                pattern=self.pattern,
+                use_listing_cache=True,
+            )
+        )
+
+
+@instrument.timed
+def find_python_source_files(
+    base_dir: Path,
+    excludes: Sequence[str] = DEFAULT_EXCLUDES,
+    respect_gitignore: bool = True,
+) -> List[Path]:
     """
     Find python (.py) source files in base_dir.
+
+    See ``walk_files`` for handling of excludes and ``.gitignore`` files.
+    """
+    return list(
+        walk_files(
+            base_dir=base_dir,
+            suffixes=(".py",),
+            excludes=excludes,
+            respect_gitignore=respect_gitignore,
+        )
+    )
+
+
+def _stat_key(stat_result: os.stat_result) -> StatKeyType:
+    """
+    Resolve the cache key of a stat result.
+    """
+    return (
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+        stat_result.st_ino & _INODE_MASK,
+    )
+
+
+def _hash_stream(path: Path, hasher_factory: Callable[[], Any]) -> bytes:
+    """
+    Hash contents of an existing file at path.
+
+    The file is streamed through a fixed size buffer so memory use does not
+    grow with file size.
+    """
+    hasher = hasher_factory()
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    total_size = 0
+    with path.open("rb", buffering=0) as handle:
+        while True:
+            read_size = handle.readinto(buffer)
+            if not read_size:
+                break
+            hasher.update(view[:read_size])
+            total_size += read_size
+    instrument.count(instrument.BYTES_HASHED, total_size, "hash_path_contents")
+    if total_size == 0:
+        return b""
+    digest: bytes = hasher.digest()
+    return digest
+
+
+def _hash_sampled(
+    path: Path, block_size: int = SAMPLE_BLOCK_SIZE, blocks: int = SAMPLE_BLOCKS
+) -> bytes:
+    """
+    Hash size, head, tail and evenly spaced blocks of file at path.
+
+    Files no larger than the sampled blocks are hashed fully.
+    """
+    with path.open("rb", buffering=0) as handle:
+        size = os.fstat(handle.fileno()).st_size
+        if size == 0:
+            return b""
+        hasher = blake2b(digest_size=32)
+        hasher.update(size.to_bytes(8, "little"))
+        offsets: Sequence[int]
+        if size <= block_size * (blocks + 2):
+            offsets = range(0, size, block_size)
+        else:
+            last = size - block_size
+            offsets = sorted(
+                {0, last, *(last * idx // (blocks + 1) for idx in range(1, blocks + 1))}
+            )
+        read_total = 0
+        for offset in offsets:
+            handle.seek(offset)
+            data = handle.read(block_size)
+            hasher.update(data)
+            read_total += len(data)
+    instrument.count(instrument.BYTES_HASHED, read_total, "hash_path_contents")
+    return hasher.digest()
+
+
+def _hash_stat(path: Path) -> bytes:
+    """
+    Fingerprint file at path by its stat data without reading it.
+    """
+    stat_result = path.stat()
+    return blake2b(repr(_stat_key(stat_result)).encode(), digest_size=16).digest()
+
+
+def _xxh3_128() -> Any:
+    """
+    Create a xxhash hasher.
+    """
+    # pylint: disable=import-outside-toplevel
+    import xxhash
+
+    return xxhash.xxh3_128()
+
+
+class HashStrategy(NamedTuple):
+    """
+    Strategy of fingerprinting existing files.
     """
-    return list(base_dir.rglob("*.py"))
 
+    name: str
+    hash_file: Callable[[Path], bytes]
 
-def create_path_content_dict(file_paths: List[Path]) -> Dict[str, bytes]:
+
+HASH_STRATEGIES: Dict[str, HashStrategy] = {}
+
+
+def register_hash_strategy(name: str, hash_file: Callable[[Path], bytes]):
+    """
+    Register a hash strategy that can be selected by name.
+    """
+    if not name.isidentifier():
+        raise ValueError(f"Expected hash strategy name to be an identifier: {name}")
+    HASH_STRATEGIES[name] = HashStrategy(name=name, hash_file=hash_file)
+
+
+def get_hash_strategy(name: str) -> HashStrategy:
+    """
+    Get registered hash strategy by name.
+    """
+    try:
+        return HASH_STRATEGIES[name]
+    except KeyError as exc:
+        raise ValueError(
+            f"Unknown hash strategy {name}. Expected one of {sorted(HASH_STRATEGIES)}."
+        ) from exc
+
+
+register_hash_strategy("sha256", partial(_hash_stream, hasher_factory=sha256))
+register_hash_strategy(
+    "blake2b", partial(_hash_stream, hasher_factory=partial(blake2b, digest_size=32))
+)
+if importlib.util.find_spec("xxhash") is not None:
+    # Only available with the optional xxhash package
+    register_hash_strategy("xxhash", partial(_hash_stream, hasher_factory=_xxh3_128))
+register_hash_strategy("stat", _hash_stat)
+register_hash_strategy("sampled", _hash_sampled)
+
+
+def _hash_file(path: Path, strategy: str = DEFAULT_HASH_STRATEGY) -> bytes:
+    """
+    Hash existing file at path with strategy.
+    """
+    return get_hash_strategy(strategy).hash_file(path)
+
+
+def _resolve_strategy(cache: Optional["PathHashCache"], strategy: Optional[str]) -> str:
+    """
+    Resolve strategy from the arguments and the strategy of cache.
+    """
+    if cache is None:
+        return DEFAULT_HASH_STRATEGY if strategy is None else strategy
+    if strategy is not None and strategy != cache.strategy:
+        raise ValueError(
+            f"Hash strategy {strategy} differs from {cache.strategy} of the cache."
+        )
+    return cache.strategy
+
+
+class PathHashCache:
+    """
+    Persistent stat-keyed cache of file content hashes.
+
+    Entries are keyed on (path, st_size, st_mtime_ns, st_ino) and stored in
+    a SQLite database, by default next to ``.doit.db``. A file is only
+    re-read when its stat data differs from the cached entry. Files are
+    hashed with strategy (see ``HASH_STRATEGIES``) and entries of each
+    strategy are stored separately.
+
+    >>> with PathHashCache(db_path=":memory:") as cache:
+    ...     cache.hash_path_contents(Path("non_existing_file.py"))
+    b''
+    """
+
+    def __init__(
+        self,
+        db_path: StrPathType = DEFAULT_HASH_CACHE_PATH,
+        strategy: str = DEFAULT_HASH_STRATEGY,
+    ):
+        """
+        Initialize cache backed by the SQLite database at db_path.
+        """
+        get_hash_strategy(strategy)
+        self.db_path = db_path
+        self.strategy = strategy
+        # Entries of the default strategy use the original table name
+        self._table = (
+            "path_hashes"
+            if strategy == DEFAULT_HASH_STRATEGY
+            else f"path_hashes_{strategy}"
+        )
+        self._connection: Optional["sqlite3.Connection"] = None
+        self._entries: Dict[str, Tuple[StatKeyType, bytes]] = {}
+        self._dirty: Dict[str, Tuple[StatKeyType, bytes]] = {}
+
+    def _connect(self) -> "sqlite3.Connection":
+        """
+        Open the database and load existing entries on first use.
+        """
+        if self._connection is None:
+            # pylint: disable=import-outside-toplevel
+            import sqlite3
+
+            connection = sqlite3.connect(str(self.db_path))
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "inode INTEGER, digest BLOB)"
+            )
+            self._entries = {
+                path: ((size, mtime_ns, inode), bytes(digest))
+                for path, size, mtime_ns, inode, digest in connection.execute(
+                    f"SELECT path, size, mtime_ns, inode, digest FROM {self._table}"
+                )
+            }
+            self._connection = connection
+        return self._connection
+
+    def lookup(self, path: Path, stat_result: os.stat_result) -> Optional[bytes]:
+        """
+        Get cached hash of path if its stat data is unchanged.
+        """
+        self._connect()
+        entry = self._entries.get(os.path.abspath(path))
+        if entry is None or entry[0] != _stat_key(stat_result):
+            return None
+        return entry[1]
+
+    def store(self, path: Path, stat_result: os.stat_result, digest: bytes):
+        """
+        Store hash of path with its stat data.
+        """
+        self._connect()
+        if _is_racy(stat_result):
+            return
+        entry = (_stat_key(stat_result), digest)
+        key = os.path.abspath(path)
+        self._entries[key] = entry
+        self._dirty[key] = entry
+
+    def hash_path_contents(self, path: Path) -> bytes:
+        """
+        Create hash of file contents at path using the cache.
+        """
+        instrument.count(instrument.FILES_STATED, 1, "hash_path_contents")
+        try:
+            stat_result = path.stat()
+        except OSError:
+            return b""
+        cached = self.lookup(path=path, stat_result=stat_result)
+        if cached is not None:
+            return cached
+        digest = _hash_file(path, self.strategy)
+        self.store(path=path, stat_result=stat_result, digest=digest)
+        return digest
+
+    def invalidate(self, paths: Optional[Iterable[StrPathType]] = None):
+        """
+        Invalidate cached entries of paths or all entries if paths is None.
+        """
+        connection = self._connect()
+        if paths is None:
+            self._entries.clear()
+            self._dirty.clear()
+            connection.execute(f"DELETE FROM {self._table}")
+        else:
+            keys = [os.path.abspath(path) for path in paths]
+            for key in keys:
+                self._entries.pop(key, None)
+                self._dirty.pop(key, None)
+            connection.executemany(
+                f"DELETE FROM {self._table} WHERE path = ?", [(key,) for key in keys]
+            )
+        connection.commit()
+
+    def evict_missing(self) -> int:
+        """
+        Evict entries of paths that no longer exist.
+
+        Returns the amount of evicted entries.
+        """
+        self._connect()
+        missing = [key for key in self._entries if not os.path.exists(key)]
+        self.invalidate(missing)
+        return len(missing)
+
+    def flush(self):
+        """
+        Write new entries to the database.
+        """
+        if self._connection is None or len(self._dirty) == 0:
+            return
+        self._connection.executemany(
+            f"INSERT OR REPLACE INTO {self._table} VALUES (?, ?, ?, ?, ?)",
+            [
+                (key, *stat_key, digest)
+                for key, (stat_key, digest) in self._dirty.items()
+            ],
+        )
+        self._connection.commit()
+        self._dirty.clear()
+
+    def close(self):
+        """
+        Flush and close the database.
+        """
+        if self._connection is None:
+            return
+        self.flush()
+        self._connection.close()
+        self._connection = None
+
+    def __enter__(self) -> "PathHashCache":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def create_path_content_dict(
+    file_paths: List[Path],
+    cache: Optional[PathHashCache] = None,
+    workers: Optional[int] = None,
+    use_processes: bool = False,
+    strategy: Optional[str] = None,
+) -> Dict[str, bytes]:
     """
     Create hash from paths including their possible contents.
+
+    With workers above one, files are hashed in a thread pool (or a process
+    pool with use_processes) of that size. hashlib releases the GIL while
+    hashing so threads scale with the amount of cores. The result is
+    identical to sequential hashing. Files are hashed with strategy, which
+    defaults to the strategy of cache.
     """
-    path_content_dict = {str(path): hash_path_contents(path) for path in file_paths}
+    strategy = _resolve_strategy(cache, strategy)
+    if workers is None or workers <= 1:
+        return {
+            str(path): hash_path_contents(path, cache=cache, strategy=strategy)
+            for path in file_paths
+        }
+
+    # Cache lookups and stores are done in the calling thread
+    path_content_dict: Dict[str, bytes] = {}
+    pending: List[Tuple[Path, Optional[os.stat_result]]] = []
+    for path in file_paths:
+        path_content_dict[str(path)] = b""
+        stat_result = None
+        if cache is not None:
+            instrument.count(instrument.FILES_STATED, 1, "hash_path_contents")
+            try:
+                stat_result = path.stat()
+            except OSError:
+                continue
+            cached = cache.lookup(path=path, stat_result=stat_result)
+            if cached is not None:
+                path_content_dict[str(path)] = cached
+                continue
+        pending.append((path, stat_result))
+
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        digests = executor.map(
+            partial(hash_path_contents, strategy=strategy),
+            [path for path, _ in pending],
+            chunksize=max(1, len(pending) // (workers * 4)),
+        )
+        for (path, stat_result), digest in zip(pending, digests):
+            path_content_dict[str(path)] = digest
+            if cache is not None and stat_result is not None:
+                cache.store(path=path, stat_result=stat_result, digest=digest)
     return path_content_dict
 
 
-def hash_path_contents(path: Path) -> bytes:
+def hash_path_contents(
+    path: Path,
+    cache: Optional[PathHashCache] = None,
+    strategy: Optional[str] = None,
+) -> bytes:
     """
     Create hash of file contents at path if it exists.
+
+    strategy names a hash strategy of ``HASH_STRATEGIES`` and defaults to
+    the strategy of cache or ``sha256``.
     """
+    strategy = _resolve_strategy(cache, strategy)
+    if cache is not None:
+        return cache.hash_path_contents(path)
+    instrument.count(instrument.FILES_STATED, 1, "hash_path_contents")
     if not path.exists():
         return b""
-    contents = path.read_bytes()
-    if len(contents) == 0:
-        return b""
-    hashed = sha256(contents).digest()
-    return hashed
+    return _hash_file(path, strategy)
 
 
-def create_path_content_hash(file_paths: List[Path]) -> str:
+@instrument.timed
+def create_path_content_hash(
+    file_paths: List[Path],
+    cache: Optional[PathHashCache] = None,
+    workers: Optional[int] = None,
+    strategy: Optional[str] = None,
+) -> str:
     """
     Create doit usable hash from file_paths.
     """
-    hashed = create_path_content_dict(file_paths=file_paths)
+    hashed = create_path_content_dict(
+        file_paths=file_paths, cache=cache, workers=workers, strategy=strategy
+    )
     hashed_json = dumps(hashed)
     return sha256(hashed_json).hexdigest()
+
+
+def _is_racy(stat_result: os.stat_result) -> bool:
+    """
+    Check if file was modified too recently for its stat data to be trusted.
+    """
+    return stat_result.st_mtime_ns >= time.time_ns() - RACY_MTIME_WINDOW_NS
+
+
+class ContentChanged:
+    """
+    doit uptodate checker that hashes file contents only when checked.
+
+    Holds file_paths and glob patterns (relative to base_dir) which are
+    resolved and hashed when doit checks whether the task is up-to-date,
+    not when ``dodo.py`` is loaded. Per-file stat data and digests are
+    stored in the saved values of the task under key and files whose stat
+    data is unchanged since the last successful run are not re-hashed.
+    Files are hashed with strategy (see ``HASH_STRATEGIES``).
+
+    The default key is derived from the paths, globs, base_dir and strategy
+    so that several checkers of a task do not overwrite each other.
+    """
+
+    def __init__(
+        self,
+        file_paths: Sequence[StrPathType] = (),
+        globs: Sequence[str] = (),
+        base_dir: StrPathType = ".",
+        key: str = "",
+        strategy: str = DEFAULT_HASH_STRATEGY,
+    ):
+        """
+        Initialize checker.
+        """
+        get_hash_strategy(strategy)
+        self.file_paths = tuple(file_paths)
+        self.globs = tuple(globs)
+        self.base_dir = Path(base_dir)
+        self.strategy = strategy
+        self.key = key or f"_content_changed:{self._config_digest()}"
+
+    def _config_digest(self) -> str:
+        """
+        Get a short digest of the paths, globs, base_dir and strategy.
+        """
+        config = [
+            [os.fspath(path) for path in self.file_paths],
+            list(self.globs),
+            os.fspath(self.base_dir),
+            self.strategy,
+        ]
+        return sha256(json.dumps(config).encode("utf-8")).hexdigest()[:16]
+
+    def resolve_paths(self) -> List[Path]:
+        """
+        Resolve file paths and glob matches.
+        """
+        resolved = [Path(path) for path in self.file_paths]
+        for pattern in self.globs:
+            resolved.extend(
+                path for path in sorted(self.base_dir.glob(pattern)) if path.is_file()
+            )
+        return resolved
+
+    def current_values(
+        self, saved_values: Dict[str, List[Any]]
+    ) -> Dict[str, Optional[List[Any]]]:
+        """
+        Resolve current stat data and digests reusing unchanged saved values.
+        """
+        current_values: Dict[str, Optional[List[Any]]] = {}
+        for path in self.resolve_paths():
+            path_key = str(path)
+            instrument.count(instrument.FILES_STATED, 1, "hash_path_contents")
+            try:
+                stat_result = path.stat()
+            except OSError:
+                current_values[path_key] = None
+                continue
+            # Racily modified files are saved with a stat key that never matches
+            stat_key = (
+                [-1, -1, -1] if _is_racy(stat_result) else list(_stat_key(stat_result))
+            )
+            saved = saved_values.get(path_key)
+            if saved is not None and saved[:3] == stat_key and stat_key[0] != -1:
+                current_values[path_key] = saved
+                continue
+            current_values[path_key] = [
+                *stat_key,
+                _hash_file(path, self.strategy).hex(),
+            ]
+        return current_values
+
+    def __call__(self, task: Any, values: Dict[str, Any]) -> bool:
+        """
+        Return True if contents are unchanged since the last successful run.
+        """
+        saved_values = values.get(self.key) or {}
+        current_values = self.current_values(saved_values)
+        task.value_savers.append(lambda: {self.key: current_values})
+        if self.key not in values:
+            return False
+
+        def _digests(
+            path_values: Dict[str, Optional[List[Any]]],
+        ) -> Dict[str, Optional[str]]:
+            return {
+                path: (None if entry is None else entry[3])
+                for path, entry in path_values.items()
+            }
+
+        return _digests(current_values) == _digests(saved_values)
+
+    def __repr__(self) -> str:
+        return (
+            f"ContentChanged({self.file_paths!r}, globs={self.globs!r}, "
+            f"strategy={self.strategy!r})"
+        )
+
+
+def _ancestors(rel_path: str) -> Iterator[str]:
+    """
+    Yield parent directories of rel_path up to the root ``""``.
+    """
+    while rel_path:
+        rel_path = rel_path.rpartition("/")[0]
+        yield rel_path
+
+
+class MerkleTree:
+    """
+    Merkle tree of file contents in base_dir with per-directory digests.
+
+    Files are found with ``walk_files`` using suffixes, excludes and
+    respect_gitignore. The digest of a directory is the hash of the names,
+    kinds and digests of its entries, so a change of a file changes only
+    the digests of its ancestor directories. ``update`` re-hashes changed
+    files (by stat data when cache is given) and recomputes only the
+    directories on their paths to the root. With state_path, digests and
+    stat data of files are persisted between runs and files with unchanged
+    stat data are not re-hashed by a full ``update``. Files are hashed with strategy, which defaults
+    to the strategy of cache.
+    """
+
+    def __init__(
+        self,
+        base_dir: StrPathType,
+        suffixes: Sequence[str] = ("",),
+        excludes: Sequence[str] = DEFAULT_EXCLUDES,
+        respect_gitignore: bool = True,
+        cache: Optional[PathHashCache] = None,
+        state_path: Optional[StrPathType] = None,
+        strategy: Optional[str] = None,
+    ):
+        """
+        Initialize tree and load persisted digests from state_path.
+        """
+        self.base_dir = Path(base_dir)
+        self.suffixes = tuple(suffixes)
+        self.excludes = tuple(excludes)
+        self.respect_gitignore = respect_gitignore
+        self.cache = cache
+        self.strategy = _resolve_strategy(cache, strategy)
+        self.state_path = None if state_path is None else Path(state_path)
+        self.updated = False
+        self._files: Dict[str, bytes] = {}
+        self._stats: Dict[str, StatKeyType] = {}
+        self._stats_changed = False
+        self._dirs: Dict[str, bytes] = {}
+        # Entries of directories as names mapped to is_dir
+        self._children: Dict[str, Dict[str, bool]] = {}
+        if self.state_path is not None:
+            self._load()
+
+    def _config(self) -> List[Any]:
+        """
+        Get configuration that persisted state must match.
+        """
+        return [
+            str(self.base_dir),
+            list(self.suffixes),
+            list(self.excludes),
+            self.respect_gitignore,
+            self.strategy,
+        ]
+
+    def _load(self):
+        """
+        Load persisted digests if they match the configuration.
+        """
+        try:
+            state = json.loads(self.state_path.read_text())  # type: ignore[union-attr]
+        except (OSError, ValueError):
+            return
+        if state.get("config") != self._config():
+            return
+        for rel_path, digest in state["files"].items():
+            self._files[rel_path] = bytes.fromhex(digest)
+            self._link(rel_path)
+        self._stats = {
+            rel_path: tuple(stat_key)  # type: ignore[misc]
+            for rel_path, stat_key in state.get("stats", {}).items()
+        }
+        self._dirs = {
+            rel_dir: bytes.fromhex(digest) for rel_dir, digest in state["dirs"].items()
+        }
+
+    def _save(self):
+        """
+        Persist digests to state_path.
+        """
+        state = dict(
+            config=self._config(),
+            files={rel_path: digest.hex() for rel_path, digest in self._files.items()},
+            stats={
+                rel_path: list(stat_key) for rel_path, stat_key in self._stats.items()
+            },
+            dirs={rel_dir: digest.hex() for rel_dir, digest in self._dirs.items()},
+        )
+        tmp_path = self.state_path.with_name(  # type: ignore[union-attr]
+            f".{self.state_path.name}.tmp"  # type: ignore[union-attr]
+        )
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self.state_path)  # type: ignore[arg-type]
+
+    def _link(self, rel_path: str):
+        """
+        Add file at rel_path and its parent directories to their parents.
+        """
+        is_dir = False
+        name_path = rel_path
+        for parent in _ancestors(rel_path):
+            name = name_path[len(parent) + 1 :] if parent else name_path
+            self._children.setdefault(parent, {})[name] = is_dir
+            is_dir = True
+            name_path = parent
+
+    def _hash(self, rel_path: str, force: bool = False) -> Optional[bytes]:
+        """
+        Hash file at rel_path or return None if it does not exist.
+
+        The known digest is reused if the stat data of the file is unchanged
+        unless force is True.
+        """
+        path = self.base_dir / rel_path
+        try:
+            stat_result = path.stat()
+        except OSError:
+            stat_result = None
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            self._stats_changed |= self._stats.pop(rel_path, None) is not None
+            return None
+        stat_key = _stat_key(stat_result)
+        if (
+            not force
+            and rel_path in self._files
+            and self._stats.get(rel_path) == stat_key
+        ):
+            return self._files[rel_path]
+        digest = hash_path_contents(path, cache=self.cache, strategy=self.strategy)
+        # Racily modified files are re-hashed on the next update
+        if _is_racy(stat_result):
+            self._stats.pop(rel_path, None)
+        else:
+            self._stats[rel_path] = stat_key
+        self._stats_changed = True
+        return digest
+
+    def _rel_path(self, path: StrPathType) -> Optional[str]:
+        """
+        Resolve path relative to base_dir or None if outside of it.
+        """
+        rel_path = os.path.relpath(os.fspath(path), self.base_dir)
+        if rel_path == ".." or rel_path.startswith(f"..{os.sep}"):
+            return None
+        return "" if rel_path == "." else rel_path.replace(os.sep, "/")
+
+    def _directory_digest(self, rel_dir: str) -> bytes:
+        """
+        Hash names, kinds and digests of entries of a directory.
+        """
+        hasher = sha256()
+        for name, is_dir in sorted(self._children[rel_dir].items()):
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            digest = self._dirs[rel_path] if is_dir else self._files[rel_path]
+            hasher.update(b"d" if is_dir else b"f")
+            hasher.update(name.encode("utf-8", "surrogateescape"))
+            hasher.update(b"\0")
+            hasher.update(digest)
+        return hasher.digest()
+
+    @instrument.timed
+    def update(
+        self, changed_paths: Optional[Iterable[StrPathType]] = None
+    ) -> List[str]:
+        """
+        Update digests and return relative paths of changed files.
+
+        Without changed_paths, base_dir is walked to find changed, added and
+        removed files. With changed_paths (e.g. from a file watcher), only
+        those paths are re-hashed. New files are then only found if they are
+        given and are not excluded by name.
+        """
+        new_digests: Dict[str, Optional[bytes]] = {}
+        if changed_paths is None:
+            found = set()
+            for path in walk_files(
+                base_dir=self.base_dir,
+                suffixes=self.suffixes,
+                excludes=self.excludes,
+                respect_gitignore=self.respect_gitignore,
+            ):
+                rel_path = self._rel_path(path)
+                assert rel_path is not None
+                found.add(rel_path)
+                new_digests[rel_path] = self._hash(rel_path)
+            new_digests.update(
+                (rel_path, None) for rel_path in self._files if rel_path not in found
+            )
+            for rel_path in [
+                rel_path for rel_path in self._stats if rel_path not in found
+            ]:
+                del self._stats[rel_path]
+                self._stats_changed = True
+        else:
+            excludes, rel_excludes = _compile_excludes(self.excludes)
+            for changed_path in changed_paths:
+                rel_path = self._rel_path(changed_path)
+                if not rel_path:
+                    continue
+                if rel_path not in self._files and (
+                    not rel_path.endswith(self.suffixes)
+                    or (
+                        excludes is not None
+                        and any(excludes.match(part) for part in rel_path.split("/"))
+                    )
+                    or (
+                        rel_excludes is not None
+                        and any(
+                            rel_excludes.match(rel_dir)
+                            for rel_dir in _ancestors(rel_path)
+                            if rel_dir
+                        )
+                    )
+                ):
+                    continue
+                if self.cache is not None:
+                    self.cache.invalidate([self.base_dir / rel_path])
+                new_digests[rel_path] = self._hash(rel_path, force=True)
+
+        changed = sorted(
+            rel_path
+            for rel_path, digest in new_digests.items()
+            if self._files.get(rel_path) != digest
+        )
+        dirty: Set[str] = set()
+        for rel_path in changed:
+            digest = new_digests[rel_path]
+            if digest is None:
+                if self._files.pop(rel_path, None) is not None:
+                    parent = rel_path.rpartition("/")[0]
+                    del self._children[parent][rel_path.rpartition("/")[2]]
+            else:
+                self._files[rel_path] = digest
+                self._link(rel_path)
+            dirty.update(_ancestors(rel_path))
+        # Directories without a (persisted) digest are computed as well
+        dirty.update(rel_dir for rel_dir in self._children if rel_dir not in self._dirs)
+        dirty.add("")
+        self._children.setdefault("", {})
+
+        # Deepest directories first so that subdirectory digests are current
+        for rel_dir in sorted(
+            dirty,
+            key=lambda rel_dir: rel_dir.count("/") + 1 if rel_dir else 0,
+            reverse=True,
+        ):
+            if rel_dir and not self._children.get(rel_dir):
+                # Directories without files are not part of the tree
+                self._children.pop(rel_dir, None)
+                self._dirs.pop(rel_dir, None)
+                parent, _, name = rel_dir.rpartition("/")
+                self._children.get(parent, {}).pop(name, None)
+                continue
+            self._dirs[rel_dir] = self._directory_digest(rel_dir)
+
+        self.updated = True
+        if self.state_path is not None and (
+            changed or dirty - {""} or self._stats_changed
+        ):
+            self._save()
+        self._stats_changed = False
+        return changed
+
+    def digest(self, rel_path: str = "") -> str:
+        """
+        Get hex digest of the directory or file at rel_path.
+
+        The tree is updated first if it has not been updated yet. Raises
+        KeyError if rel_path is not part of the tree.
+        """
+        if not self.updated:
+            self.update()
+        rel_path = self._rel_path(self.base_dir / rel_path) or ""
+        if rel_path in self._dirs:
+            return self._dirs[rel_path].hex()
+        return self._files[rel_path].hex()
+
+
+class SubtreeChanged:
+    """
+    doit uptodate checker of the digest of a MerkleTree subtree.
+    """
+
+    def __init__(self, tree: MerkleTree, rel_path: str = "", key: str = ""):
+        """
+        Initialize checker.
+        """
+        self.tree = tree
+        self.rel_path = rel_path
+        self.key = key or f"_subtree_changed:{rel_path}"
+
+    def __call__(self, task: Any, values: Dict[str, Any]) -> bool:
+        """
+        Return True if the subtree digest is unchanged since the last run.
+        """
+        try:
+            digest: Optional[str] = self.tree.digest(self.rel_path)
+        except KeyError:
+            digest = None
+        task.value_savers.append(lambda: {self.key: digest})
+        return self.key in values and values[self.key] == digest
+
+    def __repr__(self) -> str:
+        return f"SubtreeChanged({str(self.tree.base_dir)!r}, {self.rel_path!r})"
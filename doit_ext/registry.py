@@ -0,0 +1,114 @@
+"""
+Registry of ComposeTasks with automatic task_dep inference.
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+
+from doit_ext.compose import ComposeTask, _dedup, _path_key
+
+
+class TaskRegistry:
+    """
+    Registry that infers task_dep entries from targets of registered tasks.
+
+    Targets of every registered task, including ``Target`` parameters of
+    ``Action``s, are indexed by their normalized path. When a task is
+    compiled, every file_dep produced by another registered task adds that
+    task to task_dep with a single lookup per file_dep. Names may refer to
+    subtasks using the doit ``basename:name`` notation.
+
+    >>> registry = TaskRegistry()
+    >>> registry.register("build", ComposeTask().add_actions("b").add_targets("out"))
+    >>> registry.register("test", ComposeTask().add_actions("t").add_file_deps("./out"))
+    >>> registry.compile("test")["task_dep"]
+    ('build',)
+    """
+
+    def __init__(self):
+        """
+        Initialize empty registry.
+        """
+        self._compiled: Dict[str, Dict[str, Any]] = {}
+        self.producers: Dict[Any, str] = {}
+
+    def register(self, name: str, task: ComposeTask):
+        """
+        Register task under name and index its targets.
+
+        Raises ValueError if a target is already produced by another task.
+        """
+        if name in self._compiled:
+            raise ValueError(f"Task {name} is already registered.")
+        compiled = task.compile()
+        compiled.pop("name", None)
+        target_keys = [_path_key(target) for target in compiled.get("targets", ())]
+        for target_key in target_keys:
+            producer = self.producers.get(target_key)
+            if producer is not None and producer != name:
+                raise ValueError(
+                    f"Target {target_key} of {name} is already produced by {producer}."
+                )
+        for target_key in target_keys:
+            self.producers[target_key] = name
+        self._compiled[name] = compiled
+
+    def inferred_task_deps(self, name: str) -> Tuple[str, ...]:
+        """
+        Get names of registered tasks that produce file_dep entries of name.
+        """
+        producers = self.producers
+        inferred = []
+        for file_dep in self._compiled[name].get("file_dep", ()):
+            producer = producers.get(_path_key(file_dep))
+            if producer is not None and producer != name:
+                inferred.append(producer)
+        return _dedup(inferred, key=lambda value: value)
+
+    def compile(self, name: str) -> Dict[str, Any]:
+        """
+        Get compiled task definition with inferred task_dep entries.
+        """
+        compiled = dict(self._compiled[name])
+        inferred = self.inferred_task_deps(name)
+        if inferred:
+            compiled["task_dep"] = _dedup(
+                (*compiled.get("task_dep", ()), *inferred), key=lambda value: value
+            )
+        return compiled
+
+    def compile_all(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Compile all registered tasks.
+        """
+        return {name: self.compile(name) for name in self._compiled}
+
+    def task_creators(self) -> Dict[str, Callable[[], Any]]:
+        """
+        Create doit task creator functions of all registered tasks.
+
+        The result can be added to the ``dodo.py`` namespace, e.g., with
+        ``globals().update(registry.task_creators())``. Subtasks are yielded
+        by the task creator of their basename.
+        """
+        groups: Dict[str, List[str]] = {}
+        for name in self._compiled:
+            groups.setdefault(name.split(":", 1)[0], []).append(name)
+
+        def _creator(basename: str, names: List[str]) -> Callable[[], Any]:
+            if names == [basename]:
+                return lambda: self.compile(basename)
+
+            def _yield_subtasks() -> Iterator[Dict[str, Any]]:
+                for name in names:
+                    yield {**self.compile(name), "name": name.split(":", 1)[1]}
+
+            return _yield_subtasks
+
+        creators: Dict[str, Callable[[], Union[Dict, Iterator[Dict]]]] = {}
+        for basename, names in groups.items():
+            if basename in names and len(names) > 1:
+                raise ValueError(f"Task {basename} cannot also have subtasks.")
+            creator = _creator(basename, names)
+            creator.__name__ = f"task_{basename}"
+            creators[creator.__name__] = creator
+        return creators
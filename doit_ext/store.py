@@ -0,0 +1,206 @@
+"""
+Content-addressed file store with zero-copy materialization.
+
+Files are stored once per content digest. Files are put into and
+materialized out of the store as hardlinks (opt-in), as ``FICLONE``
+reflinks on filesystems that support them (e.g. btrfs and XFS) or as copies
+otherwise. With links, the time to materialize a file does not depend on
+its size.
+
+Hardlinked files share their data with the store, so modifying one in
+place would corrupt the store. Stored files are therefore made read-only
+and ``detach`` replaces a hardlinked file with a private copy before it
+is rewritten.
+"""
+
+import os
+import shutil
+import stat
+import uuid
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from doit_ext.paths import (
+    DEFAULT_HASH_STRATEGY,
+    PathHashCache,
+    StrPathType,
+    hash_path_contents,
+)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore[assignment]
+
+# ioctl request of Linux for cloning file contents (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+COPY = "copy"
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+LINK_MODES = (COPY, REFLINK, HARDLINK)
+
+_EMPTY_DIGEST = sha256().hexdigest()
+
+
+def _reflink(source: Path, destination: Path) -> bool:
+    """
+    Clone source to a new file at destination if supported.
+    """
+    if fcntl is None:
+        return False
+    with source.open("rb") as source_handle, destination.open("wb") as handle:
+        try:
+            fcntl.ioctl(handle.fileno(), FICLONE, source_handle.fileno())
+        except OSError:
+            cloned = False
+        else:
+            cloned = True
+    if not cloned:
+        destination.unlink()
+    return cloned
+
+
+def materialize(source: Path, destination: Path, link_mode: str = REFLINK) -> str:
+    """
+    Create destination with the contents of source.
+
+    Tries a hardlink (only with link_mode ``hardlink``), then a reflink
+    (unless link_mode is ``copy``) and finally copies. The destination is
+    replaced atomically. Returns the method that was used.
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Expected link_mode to be one of {LINK_MODES}.")
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = destination.with_name(f".{destination.name}.{uuid.uuid4().hex}")
+    method = COPY
+    try:
+        if link_mode == HARDLINK:
+            try:
+                os.link(source, tmp_path)
+                method = HARDLINK
+            except OSError:
+                pass
+        if method == COPY and link_mode != COPY and _reflink(source, tmp_path):
+            method = REFLINK
+        if method == COPY:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return method
+
+
+def detach(path: Path) -> bool:
+    """
+    Replace a hardlinked file with a writable private copy.
+
+    Returns True if path was detached.
+    """
+    try:
+        stat_result = path.stat()
+    except OSError:
+        return False
+    if stat_result.st_nlink <= 1:
+        return False
+    materialize(path, path, link_mode=COPY)
+    path.chmod(stat.S_IMODE(stat_result.st_mode) | stat.S_IWUSR)
+    return True
+
+
+class ContentStore:
+    """
+    Store of files keyed by the sha256 digest of their contents.
+    """
+
+    def __init__(
+        self,
+        store_dir: StrPathType,
+        link_mode: str = REFLINK,
+        hash_cache: Optional[PathHashCache] = None,
+    ):
+        """
+        Initialize store without touching the file system.
+        """
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Expected link_mode to be one of {LINK_MODES}.")
+        if hash_cache is not None and hash_cache.strategy != DEFAULT_HASH_STRATEGY:
+            raise ValueError(
+                f"Expected hash_cache with the {DEFAULT_HASH_STRATEGY} strategy."
+            )
+        self.store_dir = Path(store_dir)
+        self.link_mode = link_mode
+        self.hash_cache = hash_cache
+        self.stats: Dict[str, int] = {method: 0 for method in LINK_MODES}
+        self.stats["deduplicated"] = 0
+
+    def blob_path(self, digest: str) -> Path:
+        """
+        Get path of stored file with digest.
+        """
+        return self.store_dir / digest[:2] / digest
+
+    def digest(self, path: Path) -> str:
+        """
+        Get content digest of file at path.
+        """
+        digest = hash_path_contents(path, cache=self.hash_cache)
+        return digest.hex() if digest else _EMPTY_DIGEST
+
+    def has(self, digest: str) -> bool:
+        """
+        Check if a file with digest is stored.
+        """
+        return self.blob_path(digest).is_file()
+
+    def put(self, path: Path) -> Tuple[str, int]:
+        """
+        Store file at path and return its digest and size.
+
+        Files whose contents are already stored are not stored again.
+        """
+        digest = self.digest(path)
+        size = path.stat().st_size
+        blob_path = self.blob_path(digest)
+        if blob_path.is_file():
+            self.stats["deduplicated"] += 1
+            return digest, size
+        self.stats[materialize(path, blob_path, link_mode=self.link_mode)] += 1
+        # Stored files are read-only to protect hardlinked copies
+        blob_path.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        return digest, size
+
+    def get(self, digest: str, destination: Path) -> str:
+        """
+        Materialize stored file with digest at destination.
+
+        Returns the method that was used.
+        """
+        method = materialize(
+            self.blob_path(digest), destination, link_mode=self.link_mode
+        )
+        self.stats[method] += 1
+        return method
+
+    def remove(self, digest: str):
+        """
+        Remove stored file with digest.
+        """
+        try:
+            self.blob_path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def blobs(self) -> Iterator[Tuple[str, int]]:
+        """
+        Iterate over digests and sizes of stored files.
+        """
+        for blob_path in self.store_dir.glob("*/*"):
+            if blob_path.name.startswith("."):
+                continue
+            try:
+                yield blob_path.name, blob_path.stat().st_size
+            except OSError:
+                continue
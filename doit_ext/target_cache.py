@@ -0,0 +1,290 @@
+"""
+Local content-addressable cache of task targets.
+
+A cached task runs through a single Python action. The action computes a
+key from the shell actions, the config dependencies, the targets and the
+content hashes of the file dependencies of the task. On a hit, the targets
+are restored from the cache directory instead of running the actions. On
+a miss, the actions are run and the targets are stored. Target contents are
+deduplicated by digest and restored as reflinks or hardlinks where
+possible. Entries are evicted in least recently used order once the cache
+exceeds its maximum size.
+"""
+
+import json
+import os
+import sys
+import uuid
+from hashlib import sha256
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from doit_ext.compose import ComposeTask, digest_config_value
+from doit_ext.paths import PathHashCache, StrPathType, create_path_content_hash
+from doit_ext.store import HARDLINK, REFLINK, ContentStore, detach
+
+if TYPE_CHECKING:
+    from doit.task import Task
+
+DEFAULT_TARGET_CACHE_DIR = Path(".doit_ext_target_cache")
+DEFAULT_MAX_SIZE = 1024**3
+
+
+class CacheEntry(NamedTuple):
+    """
+    Stored cache entry.
+    """
+
+    key: str
+    path: Path
+    digests: Tuple[str, ...]
+    last_used_ns: int
+
+
+class TargetCache:
+    """
+    Content-addressable store of task targets in cache_dir.
+
+    Only tasks with shell string actions and regular file targets are
+    cached. Target contents are deduplicated in a ``ContentStore`` and
+    restored with link_mode (see ``doit_ext.store``). hash_cache is used to
+    avoid re-hashing unchanged file dependencies and targets.
+    """
+
+    def __init__(
+        self,
+        cache_dir: StrPathType = DEFAULT_TARGET_CACHE_DIR,
+        max_size: int = DEFAULT_MAX_SIZE,
+        hash_cache: Optional[PathHashCache] = None,
+        link_mode: str = REFLINK,
+    ):
+        """
+        Initialize cache without touching the file system.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.hash_cache = hash_cache
+        self.content_store = ContentStore(
+            self.cache_dir / "blobs", link_mode=link_mode, hash_cache=hash_cache
+        )
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _manifest_path(self, key: str) -> Path:
+        """
+        Get path of manifest of entry with key.
+        """
+        return self.cache_dir / "entries" / key[:2] / f"{key}.json"
+
+    def restore(self, key: str, targets: Sequence[StrPathType]) -> bool:
+        """
+        Restore targets of entry with key.
+
+        Returns False if there is no complete entry with key.
+        """
+        manifest_path = self._manifest_path(key)
+        try:
+            manifest = json.loads(manifest_path.read_text())
+        except (OSError, ValueError):
+            return False
+        if [item["target"] for item in manifest] != [str(path) for path in targets]:
+            return False
+        if not all(self.content_store.has(item["digest"]) for item in manifest):
+            return False
+        for item in manifest:
+            self.content_store.get(item["digest"], Path(item["target"]))
+        # Modification time of the manifest tracks the last use
+        os.utime(manifest_path)
+        return True
+
+    def store(self, key: str, targets: Sequence[StrPathType]) -> bool:
+        """
+        Store targets under key.
+
+        Returns False if a target is not a regular file.
+        """
+        target_paths = [Path(target) for target in targets]
+        if not all(target.is_file() for target in target_paths):
+            return False
+        manifest = []
+        for target in target_paths:
+            digest, size = self.content_store.put(target)
+            manifest.append(dict(target=str(target), digest=digest, size=size))
+        # The manifest is moved in place so that concurrent tasks never see
+        # a partial entry
+        manifest_path = self._manifest_path(key)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = manifest_path.with_name(f".{key}.{uuid.uuid4().hex}")
+        tmp_path.write_text(json.dumps(manifest))
+        os.replace(tmp_path, manifest_path)
+        self.stats["stores"] += 1
+        self.evict()
+        return True
+
+    def entries(self) -> List[CacheEntry]:
+        """
+        Get stored entries.
+        """
+        entries = []
+        for manifest_path in self.cache_dir.glob("entries/*/*.json"):
+            try:
+                manifest = json.loads(manifest_path.read_text())
+                last_used_ns = manifest_path.stat().st_mtime_ns
+            except (OSError, ValueError):
+                continue
+            entries.append(
+                CacheEntry(
+                    key=manifest_path.stem,
+                    path=manifest_path,
+                    digests=tuple(item["digest"] for item in manifest),
+                    last_used_ns=last_used_ns,
+                )
+            )
+        return entries
+
+    def size(self) -> int:
+        """
+        Get total size of stored target contents in bytes.
+        """
+        return sum(size for _, size in self.content_store.blobs())
+
+    def evict(self, max_size: Optional[int] = None) -> int:
+        """
+        Evict least recently used entries until the cache fits max_size.
+
+        Stored contents are removed once no remaining entry refers to them.
+        Returns the amount of evicted entries.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        blob_sizes = dict(self.content_store.blobs())
+        total_size = sum(blob_sizes.values())
+        if total_size <= max_size:
+            return 0
+        entries = self.entries()
+        references: Dict[str, int] = {}
+        for entry in entries:
+            for digest in set(entry.digests):
+                references[digest] = references.get(digest, 0) + 1
+        evicted = 0
+        for entry in sorted(entries, key=lambda entry: entry.last_used_ns):
+            if total_size <= max_size:
+                break
+            entry.path.unlink()
+            evicted += 1
+            for digest in set(entry.digests):
+                references[digest] -= 1
+                if references[digest] == 0:
+                    self.content_store.remove(digest)
+                    total_size -= blob_sizes.get(digest, 0)
+        self.stats["evictions"] += evicted
+        return evicted
+
+    def cache_task(self, compose_task: ComposeTask) -> Dict[str, Any]:
+        """
+        Compile compose_task with its actions replaced by a cached action.
+
+        Raises ValueError if the task has other than shell string actions.
+        """
+        compiled = compose_task.compile()
+        actions = compiled.get("actions", ())
+        if not all(isinstance(action, str) for action in actions):
+            raise ValueError("Only tasks with shell string actions can be cached.")
+        targets = [str(target) for target in compiled.get("targets", ())]
+        uptodate = compose_task.compile_actions().uptodate
+        static_key = json.dumps(
+            dict(
+                actions=list(actions),
+                config=digest_config_value(uptodate.config_changed or {}),
+                config_digests=uptodate.config_digests or {},
+                targets=targets,
+            ),
+            sort_keys=True,
+        )
+        compiled["actions"] = (
+            CachedActions(
+                cache=self,
+                static_key=static_key,
+                actions=tuple(actions),
+                file_dep=tuple(str(path) for path in compiled.get("file_dep", ())),
+                targets=tuple(targets),
+            ),
+        )
+        return compiled
+
+
+class CachedActions:
+    """
+    doit Python-callable action that runs shell actions through a cache.
+    """
+
+    __slots__ = ("cache", "static_key", "actions", "file_dep", "targets")
+
+    def __init__(
+        self,
+        cache: TargetCache,
+        static_key: str,
+        actions: Sequence[str],
+        file_dep: Sequence[str],
+        targets: Sequence[str],
+    ):
+        """
+        Initialize action.
+        """
+        self.cache = cache
+        self.static_key = static_key
+        self.actions = actions
+        self.file_dep = file_dep
+        self.targets = targets
+
+    def key(self) -> str:
+        """
+        Compute cache key from the static key and file dependency contents.
+        """
+        file_dep_hash = create_path_content_hash(
+            file_paths=[Path(path) for path in self.file_dep],
+            cache=self.cache.hash_cache,
+        )
+        return sha256(f"{self.static_key}\0{file_dep_hash}".encode()).hexdigest()
+
+    def __call__(self, task: "Task") -> Any:
+        """
+        Restore targets from the cache or run the actions and store targets.
+
+        The actions run as doit ``CmdAction``s of task so that keyword
+        substitution and output handling match an uncached run.
+        """
+        # pylint: disable=import-outside-toplevel
+        from doit.action import CmdAction
+
+        key = self.key()
+        if self.cache.restore(key, self.targets):
+            self.cache.stats["hits"] += 1
+            return {"target_cache": "hit"}
+        self.cache.stats["misses"] += 1
+        if self.cache.content_store.link_mode == HARDLINK:
+            # Actions must not rewrite files shared with the store
+            for target in self.targets:
+                detach(Path(target))
+        for action in self.actions:
+            # Output is written to the streams captured by the Python action
+            failure = CmdAction(action, task=task).execute(
+                out=sys.stdout, err=sys.stderr
+            )
+            if failure is not None:
+                return failure
+        self.cache.store(key, self.targets)
+        return {"target_cache": "miss"}
+
+    def __repr__(self) -> str:
+        """
+        Represent action by its shell actions.
+        """
+        return f"CachedActions({list(self.actions)})"
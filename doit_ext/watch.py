@@ -0,0 +1,577 @@
+"""
+Watch mode that reruns only the tasks whose file dependencies changed.
+
+On Linux, directories are watched with inotify through ``ctypes`` and
+elsewhere by polling their entries. Parent directories of ``file_dep``
+paths are watched non-recursively and trees (e.g. those searched by
+``find_python_source_files``) recursively. Content hashes of all file
+dependencies are kept in an in-memory ``PathHashCache`` and only changed
+files are re-hashed. A task is triggered when the contents of one of its
+file dependencies changed or when a task it depends on is triggered.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from doit_ext.compose import _path_key
+from doit_ext.graph import TaskGraph, build_task_graph, load_dodo_task_graph
+from doit_ext.paths import (
+    DEFAULT_EXCLUDES,
+    PathHashCache,
+    StrPathType,
+    _compile_excludes,
+    clear_listing_cache,
+)
+
+DEFAULT_DEBOUNCE = 0.05
+DEFAULT_POLL_INTERVAL = 0.5
+
+# inotify event masks from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+STRUCTURE_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Changes(NamedTuple):
+    """
+    Changed paths reported by a watcher.
+
+    structure_changed is True when files or directories were created,
+    deleted or moved within watched directories.
+    """
+
+    paths: FrozenSet[str]
+    structure_changed: bool
+
+
+ExcludesType = Tuple[Optional[Pattern], Optional[Pattern]]
+
+
+def _is_excluded(name: str, rel_path: str, excludes: ExcludesType) -> bool:
+    """
+    Check if directory name or its rel_path matches any of excludes.
+
+    excludes are compiled with ``_compile_excludes`` so that patterns are
+    matched like in ``doit_ext.paths.walk_files``.
+    """
+    name_excludes, rel_excludes = excludes
+    return bool(
+        (name_excludes is not None and name_excludes.match(name))
+        or (rel_excludes is not None and rel_excludes.match(rel_path))
+    )
+
+
+def _walk_directories(
+    directory: str, excludes: ExcludesType, rel_dir: str = ""
+) -> Iterable[Tuple[str, str]]:
+    """
+    Yield directory and its subdirectories that are not excluded.
+
+    Directories are yielded with their path relative to the walked root
+    directory, whose relative path is rel_dir.
+    """
+    yield directory, rel_dir
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+        if entry.is_dir(follow_symlinks=False) and not _is_excluded(
+            entry.name, rel_path, excludes
+        ):
+            yield from _walk_directories(entry.path, excludes, rel_path)
+
+
+class InotifyWatcher:
+    """
+    Directory watcher using Linux inotify.
+
+    Raises OSError if inotify is not available.
+    """
+
+    def __init__(self, excludes: Sequence[str] = DEFAULT_EXCLUDES):
+        """
+        Initialize inotify instance.
+        """
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux.")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.excludes = excludes
+        self._excludes = _compile_excludes(excludes)
+        # Watched directories with their path relative to the added directory
+        self._directories: Dict[int, Tuple[str, bool, str]] = {}
+
+    def _add_directories(self, directory: str, recursive: bool, rel_dir: str):
+        """
+        Watch directory with relative path rel_dir.
+        """
+        directories = (
+            _walk_directories(directory, self._excludes, rel_dir)
+            if recursive
+            else [(directory, rel_dir)]
+        )
+        for path, rel_path in directories:
+            watch_descriptor = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(path), WATCH_MASK
+            )
+            if watch_descriptor >= 0:
+                self._directories[watch_descriptor] = (path, recursive, rel_path)
+
+    def add_directory(self, directory: StrPathType, recursive: bool = False):
+        """
+        Watch directory and with recursive also its subdirectories.
+        """
+        self._add_directories(str(directory), recursive=recursive, rel_dir="")
+
+    def _read_events(self, changed: Set[str]) -> bool:
+        """
+        Read pending events into changed and report structure changes.
+        """
+        structure_changed = False
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _, name_length = _EVENT_HEADER.unpack_from(
+                data, offset
+            )
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost so every watched directory may have changed
+                changed.update(path for path, _, _ in self._directories.values())
+                structure_changed = True
+                continue
+            if watch_descriptor not in self._directories:
+                continue
+            directory, recursive, rel_dir = self._directories[watch_descriptor]
+            if mask & IN_IGNORED:
+                del self._directories[watch_descriptor]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(directory)
+                structure_changed = True
+                continue
+            path = os.path.join(directory, name)
+            changed.add(path)
+            if mask & STRUCTURE_MASK:
+                structure_changed = True
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                if (
+                    recursive
+                    and mask & IN_ISDIR
+                    and mask & (IN_CREATE | IN_MOVED_TO)
+                    and not _is_excluded(name, rel_path, self._excludes)
+                ):
+                    self._add_directories(path, recursive=True, rel_dir=rel_path)
+        return structure_changed
+
+    def read_changes(
+        self, timeout: Optional[float] = None, debounce: float = DEFAULT_DEBOUNCE
+    ) -> Changes:
+        """
+        Wait up to timeout seconds for changes.
+
+        Events arriving within debounce seconds of each other are collected
+        into the same changes.
+        """
+        changed: Set[str] = set()
+        structure_changed = False
+        wait: Optional[float] = timeout
+        while select.select([self._fd], [], [], wait)[0]:
+            structure_changed |= self._read_events(changed)
+            wait = debounce
+        return Changes(paths=frozenset(changed), structure_changed=structure_changed)
+
+    def close(self):
+        """
+        Close the inotify instance.
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """
+    Directory watcher that compares stat data of directory entries.
+    """
+
+    def __init__(
+        self,
+        excludes: Sequence[str] = DEFAULT_EXCLUDES,
+        interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        """
+        Initialize watcher without watched directories.
+        """
+        self.excludes = excludes
+        self._excludes = _compile_excludes(excludes)
+        self.interval = interval
+        self._directories: Dict[str, bool] = {}
+        self._snapshot: Dict[str, Tuple[int, int, int]] = {}
+
+    def _scan(self) -> Dict[str, Tuple[int, int, int]]:
+        """
+        Stat entries of watched directories.
+        """
+        snapshot = {}
+        directories: List[str] = []
+        for directory, recursive in self._directories.items():
+            if recursive:
+                directories.extend(
+                    path for path, _ in _walk_directories(directory, self._excludes)
+                )
+            else:
+                directories.append(directory)
+        for directory in directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    stat_result = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                snapshot[entry.path] = (
+                    stat_result.st_size,
+                    stat_result.st_mtime_ns,
+                    stat_result.st_ino,
+                )
+        return snapshot
+
+    def add_directory(self, directory: StrPathType, recursive: bool = False):
+        """
+        Watch directory and with recursive also its subdirectories.
+        """
+        self._directories[str(directory)] = (
+            self._directories.get(str(directory), False) or recursive
+        )
+        self._snapshot = self._scan()
+
+    def read_changes(
+        self, timeout: Optional[float] = None, debounce: float = DEFAULT_DEBOUNCE
+    ) -> Changes:
+        """
+        Poll every interval seconds for up to timeout seconds for changes.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            if snapshot != self._snapshot:
+                time.sleep(debounce)
+                snapshot = self._scan()
+                previous, self._snapshot = self._snapshot, snapshot
+                changed = {
+                    path
+                    for path in set(previous) | set(snapshot)
+                    if previous.get(path) != snapshot.get(path)
+                }
+                return Changes(
+                    paths=frozenset(changed),
+                    structure_changed=set(previous) != set(snapshot),
+                )
+            if deadline is not None and time.monotonic() >= deadline:
+                return Changes(paths=frozenset(), structure_changed=False)
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            time.sleep(wait)
+
+    def close(self):
+        """
+        Stop watching.
+        """
+        self._directories.clear()
+        self._snapshot.clear()
+
+
+WatcherType = Union[InotifyWatcher, PollingWatcher]
+
+
+def create_watcher(excludes: Sequence[str] = DEFAULT_EXCLUDES) -> WatcherType:
+    """
+    Create an inotify watcher or a polling watcher if inotify is unavailable.
+    """
+    try:
+        return InotifyWatcher(excludes=excludes)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(excludes=excludes)
+
+
+class WatchEvent(NamedTuple):
+    """
+    Result of a watch cycle.
+    """
+
+    changed_paths: Tuple[str, ...]
+    tasks: Tuple[str, ...]
+    structure_changed: bool
+
+
+class WatchSession:
+    """
+    Incremental tracking of file dependency changes of tasks.
+
+    tasks is given as to ``build_task_graph``. directories are watched
+    recursively in addition to the parent directories of file
+    dependencies. ``reload`` replaces the tasks while keeping the watcher,
+    the hash cache and the digests of file dependencies.
+    """
+
+    def __init__(
+        self,
+        tasks: Union[Mapping[str, Any], Sequence[Any], TaskGraph],
+        directories: Sequence[StrPathType] = (),
+        watcher: Optional[WatcherType] = None,
+        hash_cache: Optional[PathHashCache] = None,
+    ):
+        """
+        Start watching and hash all file dependencies.
+        """
+        self.watcher = create_watcher() if watcher is None else watcher
+        self.hash_cache = (
+            PathHashCache(db_path=":memory:") if hash_cache is None else hash_cache
+        )
+        self.digests: Dict[str, bytes] = {}
+        self._watched: Set[str] = set()
+        self._index(tasks)
+        for directory in directories:
+            self.watcher.add_directory(directory, recursive=True)
+
+    def _index(self, tasks: Union[Mapping[str, Any], Sequence[Any], TaskGraph]):
+        """
+        Index tasks, watch their directories and hash new file dependencies.
+        """
+        self.graph = tasks if isinstance(tasks, TaskGraph) else build_task_graph(tasks)
+        self.dependents: Dict[str, Set[str]] = {
+            name: set() for name in self.graph.nodes
+        }
+        for name, dependencies in self.graph.dependencies.items():
+            for dep in dependencies:
+                self.dependents[dep].add(name)
+
+        # Tasks by file dependency and file dependencies by directory
+        self.dep_tasks: Dict[str, Set[str]] = {}
+        self.directory_deps: Dict[str, Set[str]] = {}
+        for node in self.graph.nodes.values():
+            for file_dep in node.file_dep:
+                self.dep_tasks.setdefault(file_dep, set()).add(node.name)
+                directory = os.path.dirname(file_dep) or "."
+                self.directory_deps.setdefault(directory, set()).add(file_dep)
+
+        for directory in self.directory_deps:
+            if directory not in self._watched:
+                self._watched.add(directory)
+                self.watcher.add_directory(directory)
+        self.digests = {
+            file_dep: (
+                self.digests[file_dep]
+                if file_dep in self.digests
+                else self.hash_cache.hash_path_contents(Path(file_dep))
+            )
+            for file_dep in self.dep_tasks
+        }
+
+    def reload(
+        self, tasks: Union[Mapping[str, Any], Sequence[Any], TaskGraph]
+    ) -> WatchEvent:
+        """
+        Replace tracked tasks and resolve tasks to run.
+
+        New tasks and tasks whose file dependencies differ from before are
+        returned with their dependent tasks. Digests of unchanged file
+        dependencies are kept.
+        """
+        old_file_deps = {
+            name: set(node.file_dep) for name, node in self.graph.nodes.items()
+        }
+        old_digests = self.digests
+        self._index(tasks)
+        changed = [
+            name
+            for name, node in self.graph.nodes.items()
+            if old_file_deps.get(name) != set(node.file_dep)
+        ]
+        return WatchEvent(
+            changed_paths=tuple(
+                sorted(
+                    file_dep for file_dep in self.digests if file_dep not in old_digests
+                )
+            ),
+            tasks=self._with_dependents(changed),
+            structure_changed=True,
+        )
+
+    def affected_tasks(self, file_deps: Iterable[str]) -> Tuple[str, ...]:
+        """
+        Get tasks that depend on file_deps and their dependent tasks.
+        """
+        return self._with_dependents(
+            name for file_dep in file_deps for name in self.dep_tasks[file_dep]
+        )
+
+    def _with_dependents(self, names: Iterable[str]) -> Tuple[str, ...]:
+        """
+        Get tasks of names and their dependent tasks.
+        """
+        affected: Set[str] = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in affected:
+                continue
+            affected.add(name)
+            stack.extend(self.dependents[name])
+        return tuple(sorted(affected))
+
+    def update(self, changes: Changes) -> WatchEvent:
+        """
+        Re-hash changed file dependencies and resolve tasks to run.
+        """
+        candidates: Set[str] = set()
+        for path in changes.paths:
+            key = _path_key(path)
+            if key in self.dep_tasks:
+                candidates.add(key)
+            # Changes of directories themselves may affect all their entries
+            candidates.update(self.directory_deps.get(key, ()))
+        if changes.structure_changed:
+            clear_listing_cache()
+
+        self.hash_cache.invalidate([Path(file_dep) for file_dep in candidates])
+        changed_deps = []
+        for file_dep in sorted(candidates):
+            digest = self.hash_cache.hash_path_contents(Path(file_dep))
+            if digest != self.digests[file_dep]:
+                self.digests[file_dep] = digest
+                changed_deps.append(file_dep)
+        return WatchEvent(
+            changed_paths=tuple(changed_deps),
+            tasks=self.affected_tasks(changed_deps),
+            structure_changed=changes.structure_changed,
+        )
+
+    def poll(self, timeout: Optional[float] = None) -> WatchEvent:
+        """
+        Wait up to timeout seconds for changes.
+        """
+        return self.update(self.watcher.read_changes(timeout=timeout))
+
+    def close(self):
+        """
+        Stop watching.
+        """
+        self.watcher.close()
+
+
+def watch_dodo(
+    dodo_path: StrPathType = "dodo.py",
+    directories: Sequence[StrPathType] = (),
+    run: Optional[Callable[[Sequence[str]], Any]] = None,
+    max_cycles: Optional[int] = None,
+):
+    """
+    Run tasks of a ``dodo.py`` file whenever their file dependencies change.
+
+    run is called with the names of the tasks to run and defaults to
+    running them with ``doit``. When files are created or deleted in
+    directories, the tasks are reloaded (see ``WatchSession.reload``) and
+    only new tasks and tasks whose file dependencies changed are run in
+    addition to tasks whose file dependency contents changed.
+    """
+    if run is None:
+        run = _run_doit_tasks(dodo_path)
+    cycles = 0
+    session = WatchSession(load_dodo_task_graph(dodo_path), directories=directories)
+    try:
+        while max_cycles is None or cycles < max_cycles:
+            event = session.poll()
+            tasks = set(event.tasks)
+            if event.structure_changed and directories:
+                tasks.update(session.reload(_reload_dodo_task_graph(dodo_path)).tasks)
+                # Tasks may have been removed from dodo.py
+                tasks.intersection_update(session.graph.nodes)
+            if tasks:
+                run(tuple(sorted(tasks)))
+            cycles += 1
+    finally:
+        session.close()
+
+
+def _reload_dodo_task_graph(dodo_path: StrPathType) -> TaskGraph:
+    """
+    Load task graph of a ``dodo.py`` file after re-importing it.
+    """
+    module_name = Path(dodo_path).stem
+    sys.modules.pop(module_name, None)
+    return load_dodo_task_graph(dodo_path)
+
+
+def _run_doit_tasks(dodo_path: StrPathType) -> Callable[[Sequence[str]], Any]:
+    """
+    Create function that runs tasks with doit in this process.
+    """
+
+    def _run(task_names: Sequence[str]) -> Any:
+        # pylint: disable=import-outside-toplevel
+        from doit.doit_cmd import DoitMain
+
+        return DoitMain().run(["run", "--file", str(dodo_path), *task_names])
+
+    return _run
@@ -1,14 +1,559 @@
 """
-Script for profiling ``doit_ext`` performance.
+Benchmark suite for ``doit_ext`` performance.
+
+Run all benchmarks (optionally filtered by a name glob pattern)::
+
+    python -m tests._profile
+    python -m tests._profile --filter "compose_*"
+
+Save the results as a baseline and compare later runs against it::
+
+    python -m tests._profile --save
+    python -m tests._profile --compare --threshold 20
+
+Without a path, the baseline committed at ``tests/benchmark_baseline.json``
+is used. Results depend on the machine, so re-save the committed baseline
+on the machine that runs the comparison when either changes. Other paths,
+e.g., within the git-ignored ``.benchmarks/`` directory, can be given for
+local baselines.
+
+Comparison exits with a non-zero code if any benchmark is more than
+threshold percent slower (or larger for memory benchmarks) than in the
+baseline.
 """
 
+import argparse
+import fnmatch
+import json
+import operator
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from doit_ext import compact, compose, executor, paths, store
+
+DEFAULT_REPEAT = 5
+DEFAULT_BASELINE_PATH = Path(__file__).parent / "benchmark_baseline.json"
+DEFAULT_THRESHOLD = 20.0
+
+KIB = 1024
+MIB = 1024 * KIB
+
+
+class Benchmark(NamedTuple):
+    """
+    Benchmark case.
+
+    setup is called with a temporary directory and returns the function to
+    measure. Benchmarks with unit ``s`` measure the fastest run time and
+    with unit ``B`` the peak memory allocated by the function.
+    """
+
+    name: str
+    setup: Callable[[Path], Callable[[], Any]]
+    unit: str = "s"
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def register(name: str, setup: Callable[[Path], Callable[[], Any]], unit: str = "s"):
+    """
+    Register a benchmark case.
+    """
+    BENCHMARKS[name] = Benchmark(name=name, setup=setup, unit=unit)
+
+
+def _write_files(base_dir: Path, file_count: int, file_size: int) -> List[Path]:
+    """
+    Write file_count files of random contents with file_size bytes.
+    """
+    base_dir.mkdir(parents=True, exist_ok=True)
+    file_paths = []
+    old_time = time.time() - 60
+    for idx in range(file_count):
+        file_path = base_dir / f"dir_{idx % 10}" / f"file_{idx}.py"
+        file_path.parent.mkdir(exist_ok=True)
+        file_path.write_bytes(os.urandom(file_size))
+        # Outside the racy window of PathHashCache
+        os.utime(file_path, (old_time, old_time))
+        file_paths.append(file_path)
+    return file_paths
+
+
+def setup_compose_chain(_: Path, dep_count: int) -> Callable[[], Any]:
+    """
+    Chain ComposeTask.add_file_deps calls.
+    """
+
+    def _run():
+        compose_task = compose.ComposeTask()
+        for idx in range(dep_count):
+            compose_task = compose_task.add_file_deps(f"file_{idx}.py")
+        return compose_task
+
+    return _run
+
+
+def setup_compose_builder(_: Path, dep_count: int) -> Callable[[], Any]:
+    """
+    Chain ComposeTaskBuilder.add_file_deps calls.
+    """
+
+    def _run():
+        builder = compose.ComposeTask().builder()
+        for idx in range(dep_count):
+            builder.add_file_deps(f"file_{idx}.py")
+        return builder.build()
+
+    return _run
+
+
+def _create_compose_tasks(task_count: int) -> List[compose.ComposeTask]:
+    """
+    Create task_count ComposeTasks that share fragments.
+    """
+    base = (
+        compose.ComposeTask()
+        .add_file_deps("pyproject.toml", "dodo.py")
+        .add_config_dependency(dict(python="3.11"))
+        .add_actions("mkdir -p build")
+    )
+    return [
+        base.add_actions(
+            compose.Action(
+                "python -m tool {} {}",
+                (compose.FileDep(f"src/file_{idx % 50}.py"), compose.Target("out")),
+            )
+        )
+        for idx in range(task_count)
+    ]
+
+
+def setup_compile(_: Path, task_count: int, use_cache: bool) -> Callable[[], Any]:
+    """
+    Compile many ComposeTasks.
+    """
+    compose_tasks = _create_compose_tasks(task_count)
+
+    def _run():
+        compose.compile_cache_clear()
+        return [
+            compose_task.compile(use_cache=use_cache) for compose_task in compose_tasks
+        ]
+
+    return _run
+
+
+def setup_action_compile(_: Path, action_count: int) -> Callable[[], Any]:
+    """
+    Compile many Actions.
+    """
+    actions = [
+        compose.Action(
+            "python script.py --input {} --output {}",
+            (compose.FileDep(f"in_{idx}.csv"), compose.Target(f"out_{idx}.csv")),
+        )
+        for idx in range(action_count)
+    ]
+    return lambda: [action.compile() for action in actions]
+
+
+def setup_action_template_render(_: Path, action_count: int) -> Callable[[], Any]:
+    """
+    Render many parameter sets with an ActionTemplate.
+    """
+    template = compose.ActionTemplate("python script.py --input {} --output {}")
+    parameter_sets = [
+        (compose.FileDep(f"in_{idx}.csv"), compose.Target(f"out_{idx}.csv"))
+        for idx in range(action_count)
+    ]
+    return lambda: [template.render(*params) for params in parameter_sets]
+
+
+def setup_path_content_hash(
+    tmp_dir: Path,
+    file_count: int,
+    file_size: int,
+    use_cache: bool = False,
+    workers: Optional[int] = None,
+    strategy: str = paths.DEFAULT_HASH_STRATEGY,
+) -> Callable[[], Any]:
+    """
+    Hash a synthetic tree of files.
+    """
+    file_paths = _write_files(tmp_dir / "tree", file_count, file_size)
+    if not use_cache:
+        return partial(
+            paths.create_path_content_hash,
+            file_paths=file_paths,
+            workers=workers,
+            strategy=strategy,
+        )
+
+    cache = paths.PathHashCache(db_path=":memory:")
+    paths.create_path_content_hash(file_paths=file_paths, cache=cache)
+    return partial(
+        paths.create_path_content_hash,
+        file_paths=file_paths,
+        cache=cache,
+        workers=workers,
+    )
+
+
+def setup_find_python_source_files(tmp_dir: Path, file_count: int) -> Callable[[], Any]:
+    """
+    Find python source files in a synthetic tree with excluded directories.
+    """
+    _write_files(tmp_dir / "tree" / "src", file_count, 0)
+    _write_files(tmp_dir / "tree" / ".venv", file_count, 0)
+    _write_files(tmp_dir / "tree" / ".git", file_count, 0)
+    return partial(paths.find_python_source_files, tmp_dir / "tree")
+
+
+def setup_hash_memory(tmp_dir: Path, file_size: int) -> Callable[[], Any]:
+    """
+    Hash a single large file.
+    """
+    file_path = tmp_dir / "large_file.bin"
+    with file_path.open("wb") as handle:
+        handle.truncate(file_size)
+    return partial(paths.hash_path_contents, file_path)
+
+
+def setup_import(_: Path, module: str) -> Callable[[], Any]:
+    """
+    Import module in a fresh interpreter.
+    """
+    return partial(
+        subprocess.run, [sys.executable, "-c", f"import {module}"], check=True
+    )
+
+
+def setup_action_pool_map(_: Path, call_count: int) -> Callable[[], Any]:
+    """
+    Run many tiny calls in the default ActionPool.
+    """
+    pool = executor.default_pool()
+    # Start the worker processes outside the measurement
+    pool.submit(operator.neg, 0).result()
+    items = list(range(call_count))
+    return partial(pool.map, operator.neg, items)
+
+
+def setup_doit_run(
+    tmp_dir: Path, task_count: int, use_pool: bool, runner_args: Sequence[str]
+) -> Callable[[], Any]:
+    """
+    Run doit on tasks with a CPU-bound Python action each.
+    """
+    action = "pool_action(work)" if use_pool else "work"
+    dodo_path = tmp_dir / "dodo.py"
+    dodo_path.write_text(
+        "from doit_ext.compose import ComposeTask\n"
+        "from doit_ext.executor import pool_action\n\n"
+        "def work():\n"
+        "    return all(range(1, 200000))\n\n"
+        "def task_work():\n"
+        f"    for idx in range({task_count}):\n"
+        f"        yield ComposeTask(name=str(idx)).add_actions({action}).compile()\n"
+    )
+    command = [
+        sys.executable,
+        "-m",
+        "doit",
+        "--file",
+        str(dodo_path),
+        "--db-file",
+        str(tmp_dir / ".doit.db"),
+        "--always-execute",
+        *runner_args,
+    ]
+    # The dodo.py imports doit_ext from this checkout
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).resolve().parent.parent)}
+    return partial(
+        subprocess.run,
+        command,
+        cwd=tmp_dir,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def setup_shell_actions(
+    tmp_dir: Path, file_count: int, batch: bool
+) -> Callable[[], Any]:
+    """
+    Run a per-file shell Action for many files.
+    """
+    file_paths = _write_files(tmp_dir / "tree", file_count, 0)
+    compose_task = compose.ComposeTask().add_actions(
+        *(compose.Action("true {}", (compose.FileDep(path),)) for path in file_paths)
+    )
+    if batch:
+        compose_task = compose_task.batch_actions()
+    commands = compose_task.compile()["actions"]
+    return lambda: [subprocess.run(command, shell=True) for command in commands]
+
+
+def setup_store_get(tmp_dir: Path, file_size: int, link_mode: str) -> Callable[[], Any]:
+    """
+    Materialize a large file from a ContentStore.
+    """
+    file_path = tmp_dir / "large_file.bin"
+    file_path.write_bytes(os.urandom(file_size))
+    content_store = store.ContentStore(tmp_dir / "store", link_mode=link_mode)
+    digest, _ = content_store.put(file_path)
+    return partial(content_store.get, digest, tmp_dir / "restored.bin")
+
+
+def setup_task_memory(_: Path, task_count: int, use_compact: bool) -> Callable[[], Any]:
+    """
+    Compile a large synthetic task set and keep it in memory.
+    """
+    compose_tasks = _create_compose_tasks(task_count)
+
+    def _run():
+        if use_compact:
+            table = compact.PathTable()
+            return [
+                compact.CompactTask.from_compose_task(compose_task, table=table)
+                for compose_task in compose_tasks
+            ]
+        return [compose_task.compile(use_cache=False) for compose_task in compose_tasks]
+
+    return _run
+
+
+def setup_merkle_tree_update(
+    tmp_dir: Path, file_count: int, file_size: int
+) -> Callable[[], Any]:
+    """
+    Update a MerkleTree after a single file has changed.
+    """
+    file_paths = _write_files(tmp_dir / "tree", file_count, file_size)
+    tree = paths.MerkleTree(tmp_dir / "tree")
+    tree.update()
+
+    def _run():
+        file_paths[0].write_bytes(os.urandom(file_size))
+        return tree.update([file_paths[0]])
+
+    return _run
+
+
+for _count in (1000, 4000):
+    register(f"compose_chain[{_count}]", partial(setup_compose_chain, dep_count=_count))
+    register(
+        f"compose_builder[{_count}]", partial(setup_compose_builder, dep_count=_count)
+    )
+register("import_compose", partial(setup_import, module="doit_ext.compose"))
+register("compile[1000]", partial(setup_compile, task_count=1000, use_cache=False))
+register(
+    "compile_cached[1000]", partial(setup_compile, task_count=1000, use_cache=True)
+)
+register("action_compile[10000]", partial(setup_action_compile, action_count=10000))
+register(
+    "action_template_render[10000]",
+    partial(setup_action_template_render, action_count=10000),
+)
+for _file_count, _file_size in ((100, KIB), (1000, KIB), (10, 4 * MIB)):
+    _size_name = f"{_file_count}x{_file_size // KIB}KiB"
+    register(
+        f"create_path_content_hash[{_size_name}]",
+        partial(setup_path_content_hash, file_count=_file_count, file_size=_file_size),
+    )
+    register(
+        f"create_path_content_hash_cached[{_size_name}]",
+        partial(
+            setup_path_content_hash,
+            file_count=_file_count,
+            file_size=_file_size,
+            use_cache=True,
+        ),
+    )
+register(
+    "create_path_content_hash_parallel[1000x1KiB]",
+    partial(
+        setup_path_content_hash,
+        file_count=1000,
+        file_size=KIB,
+        workers=os.cpu_count(),
+    ),
+)
+for _strategy in paths.HASH_STRATEGIES:
+    for _file_count, _file_size in ((1000, KIB), (10, 4 * MIB), (1, 64 * MIB)):
+        _size_name = f"{_file_count}x{_file_size // KIB}KiB"
+        register(
+            f"hash_strategy_{_strategy}[{_size_name}]",
+            partial(
+                setup_path_content_hash,
+                file_count=_file_count,
+                file_size=_file_size,
+                strategy=_strategy,
+            ),
+        )
+register("action_pool_map[10000]", partial(setup_action_pool_map, call_count=10000))
+for _runner, _runner_args in (
+    ("sequential", ()),
+    ("process", ("-n", "4")),
+    ("thread", ("-n", "4", "-P", "thread")),
+):
+    for _use_pool in (False, True):
+        register(
+            f"doit_run_{_runner}{'_pool' if _use_pool else ''}[200]",
+            partial(
+                setup_doit_run,
+                task_count=200,
+                use_pool=_use_pool,
+                runner_args=_runner_args,
+            ),
+        )
+for _batch in (False, True):
+    register(
+        f"shell_actions{'_batched' if _batch else ''}[200]",
+        partial(setup_shell_actions, file_count=200, batch=_batch),
+    )
+for _link_mode in store.LINK_MODES:
+    register(
+        f"store_get_{_link_mode}[64MiB]",
+        partial(setup_store_get, file_size=64 * MIB, link_mode=_link_mode),
+    )
+for _use_compact in (False, True):
+    register(
+        f"task_memory{'_compact' if _use_compact else ''}[20000]",
+        partial(setup_task_memory, task_count=20000, use_compact=_use_compact),
+        unit="B",
+    )
+register(
+    "merkle_tree_update[1000x1KiB]",
+    partial(setup_merkle_tree_update, file_count=1000, file_size=KIB),
+)
+register(
+    "find_python_source_files[1000]",
+    partial(setup_find_python_source_files, file_count=1000),
+)
+register(
+    "hash_path_contents_memory[64MiB]",
+    partial(setup_hash_memory, file_size=64 * MIB),
+    unit="B",
+)
+
+
+def run_benchmark(benchmark: Benchmark, repeat: int = DEFAULT_REPEAT) -> float:
+    """
+    Run benchmark and return its measured value.
+    """
+    with TemporaryDirectory() as tmp_dir:
+        function = benchmark.setup(Path(tmp_dir))
+        if benchmark.unit == "B":
+            tracemalloc.start()
+            try:
+                function()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            return float(peak)
+
+        elapsed_times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            elapsed_times.append(time.perf_counter() - start)
+        return min(elapsed_times)
+
+
+def compare_results(
+    baseline: Dict[str, float], results: Dict[str, float], threshold: float
+) -> List[str]:
+    """
+    Compare results against baseline.
+
+    Returns a message for every benchmark that regressed by more than
+    threshold percent.
+
+    >>> compare_results({"a": 1.0, "b": 1.0}, {"a": 1.5, "b": 1.1}, 20.0)
+    ['a: 1.5 vs. baseline 1 (+50.0 %)']
+    """
+    regressions = []
+    for name, value in results.items():
+        baseline_value = baseline.get(name)
+        if baseline_value is None or baseline_value <= 0:
+            continue
+        change = (value - baseline_value) / baseline_value * 100
+        if change > threshold:
+            regressions.append(
+                f"{name}: {value:.4g} vs. baseline {baseline_value:.4g} "
+                f"(+{change:.1f} %)"
+            )
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """
+    Run benchmarks from the command-line.
+    """
+    parser = argparse.ArgumentParser(description="Run doit_ext benchmarks.")
+    parser.add_argument("--filter", default="*", help="Benchmark name glob pattern.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument(
+        "--save",
+        type=Path,
+        nargs="?",
+        const=DEFAULT_BASELINE_PATH,
+        help="Save results as a baseline.",
+    )
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        nargs="?",
+        const=DEFAULT_BASELINE_PATH,
+        help="Compare results to baseline.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Allowed regression in percent.",
+    )
+    args = parser.parse_args(argv)
+
+    results: Dict[str, float] = {}
+    for name, benchmark in BENCHMARKS.items():
+        if not fnmatch.fnmatchcase(name, args.filter):
+            continue
+        results[name] = run_benchmark(benchmark, repeat=args.repeat)
+        print(f"{name:<50} {results[name]:>12.6g} {benchmark.unit}")
+
+    if args.save is not None:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare_results(
+            baseline=baseline, results=results, threshold=args.threshold
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
 
-def perf_profile():
+def perf_profile() -> int:
     """
     Profile ``doit_ext`` performance.
     """
-    return
+    return main()
 
 
 if __name__ == "__main__":
-    perf_profile()
+    sys.exit(perf_profile())
@@ -0,0 +1,84 @@
+"""
+Tests for compact.py.
+"""
+
+import tracemalloc
+from pathlib import Path
+
+from doit_ext import compact, compose
+
+
+def _create_compose_task(idx: int) -> compose.ComposeTask:
+    """
+    Create a ComposeTask sharing paths with other tasks.
+    """
+    return (
+        compose.ComposeTask(name=f"file_{idx}")
+        .add_actions(
+            compose.Action(
+                "python check.py {} {}",
+                (
+                    compose.FileDep(Path(f"src/file_{idx % 50}.py")),
+                    compose.Target(f"build/file_{idx}.txt"),
+                ),
+            )
+        )
+        .add_file_deps("./pyproject.toml", Path("dodo.py"))
+        .add_task_deps("setup")
+        .add_config_dependency(dict(python="3.11"))
+    )
+
+
+def test_compact_task_round_trip():
+    """
+    Test converting between compiled tasks and CompactTasks.
+    """
+    table = compact.PathTable()
+    compose_task = _create_compose_task(1)
+    compact_task = compact.CompactTask.from_compose_task(compose_task, table=table)
+    compiled = compose_task.compile()
+    converted = compact_task.to_dict()
+    assert converted["file_dep"] == ("pyproject.toml", "dodo.py", "src/file_1.py")
+    assert converted["targets"] == ("build/file_1.txt",)
+    for key in ("actions", "task_dep", "name"):
+        assert converted[key] == compiled[key]
+    assert [entry.config for entry in converted["uptodate"]] == [
+        entry.config for entry in compiled["uptodate"]
+    ]
+    # Equal uptodate values are shared between tasks
+    other_task = compact.CompactTask.from_compose_task(
+        _create_compose_task(2), table=table
+    )
+    assert other_task.extra is compact_task.extra
+    assert len(table) == 6
+
+    assert compact.CompactTask.from_compiled({}, table=table).to_dict() == {}
+
+
+def test_compact_task_memory():
+    """
+    Test that CompactTasks use less memory than compiled dictionaries.
+    """
+    compose_tasks = [_create_compose_task(idx) for idx in range(2000)]
+
+    def _measure(function):
+        tracemalloc.start()
+        try:
+            retained = function()
+            current, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert retained
+        return current
+
+    compiled_size = _measure(
+        lambda: [task.compile(use_cache=False) for task in compose_tasks]
+    )
+    table = compact.PathTable()
+    compact_size = _measure(
+        lambda: [
+            compact.CompactTask.from_compose_task(task, table=table)
+            for task in compose_tasks
+        ]
+    )
+    assert compact_size < compiled_size
@@ -2,15 +2,18 @@
 Test compose.py.
 """
 
+import subprocess
+import sys
 from contextlib import nullcontext as does_not_raise
 from pathlib import Path
 
 import pytest
+from doit.loader import load_tasks
 from doit.task import Task, dict_to_task
 from doit.tools import check_timestamp_unchanged, config_changed, result_dep
 
 import tests
-from doit_ext import compose
+from doit_ext import compose, paths
 
 
 def task_hey_there():
@@ -194,3 +197,438 @@ def test_action(base, parameters: tuple, raises):
         result = compose.Action(base=base, parameters=parameters).compile()
         assert isinstance(result, str)
         assert base[: base.index("{}")] in result
+
+
+@pytest.mark.parametrize(
+    "base,parameters,expected",
+    [
+        ("echo ${HOME}", (), "echo ${HOME}"),
+        ("awk '{print $1}' f", (), "awk '{print $1}' f"),
+        ("awk '{print $1}' {} > ${OUT}", ("f",), "awk '{print $1}' f > ${OUT}"),
+        ("echo {name} {}", (compose.FileDep("a.txt"),), "echo {name} a.txt"),
+        ("awk '{{print $1}}' {}", ("f",), "awk '{print $1}' f"),
+        ("echo {{}} {}", ("a",), "echo {} a"),
+        ("awk '{{print $1}}' f", (), "awk '{{print $1}}' f"),
+    ],
+)
+def test_action_literal_braces(base: str, parameters: tuple, expected: str):
+    """
+    Test that only bare {} of Action bases are filled and {{ }} unescaped.
+    """
+    assert compose.Action(base=base, parameters=parameters).compile() == expected
+
+
+def test_composetask_builder():
+    """
+    Test that ComposeTaskBuilder matches chained ComposeTask updates.
+    """
+    timestamp_entry = check_timestamp_unchanged("some_directory")
+    action = compose.Action(
+        base="python script.py {} {}",
+        parameters=(compose.FileDep("data.csv"), compose.Target("out.csv")),
+    )
+    base_task = compose.ComposeTask(name="base").add_config_dependency(dict(x=1))
+
+    chained = (
+        base_task.add_actions("mkdir -p tmp", action)
+        .add_file_deps("dodo.py", Path("setup.py"))
+        .add_task_deps(task_hey_there, "other")
+        .add_targets("target.csv")
+        .add_result_dep("result_task")
+        .add_config_dependency(dict(y=2))
+        .add_uptodate_entry(timestamp_entry)
+        .toggle_run_once()
+        .add_name("new_name")
+    )
+    builder = base_task.builder()
+    built = (
+        builder.add_actions("mkdir -p tmp", action)
+        .add_file_deps("dodo.py", Path("setup.py"))
+        .add_task_deps(task_hey_there, "other")
+        .add_targets("target.csv")
+        .add_result_dep("result_task")
+        .add_config_dependency(dict(y=2))
+        .add_uptodate_entry(timestamp_entry)
+        .toggle_run_once()
+        .add_name("new_name")
+        .build()
+    )
+    assert built == chained
+    assert built.compile().keys() == chained.compile().keys()
+
+    # Builder does not mutate the task it was created from
+    assert base_task.uptodate.config_changed == dict(x=1)
+    builder.add_file_deps("more.py")
+    assert "more.py" not in built.file_dep
+
+
+def test_composetask_builder_add_methods(tmp_path: Path):
+    """
+    Test that ComposeTaskBuilder has the add methods of ComposeTask.
+    """
+    add_methods = {name for name in dir(compose.ComposeTask) if name.startswith("add_")}
+    assert add_methods <= set(dir(compose.ComposeTaskBuilder))
+
+    template = compose.ActionTemplate("cp {} {out}", file_deps=(0,), targets=("out",))
+    tree = paths.MerkleTree(tmp_path)
+    chained = (
+        compose.ComposeTask()
+        .add_template_action(template, "a.txt", out="b.txt")
+        .add_content_dependency("a.txt")
+        .add_subtree_dependency(tree)
+    )
+    built = (
+        compose.ComposeTask()
+        .builder()
+        .add_template_action(template, "a.txt", out="b.txt")
+        .add_content_dependency("a.txt")
+        .add_subtree_dependency(tree)
+        .build()
+    )
+    assert built._replace(uptodate=None) == chained._replace(uptodate=None)
+    assert built.uptodate.config_changed == chained.uptodate.config_changed
+    assert [repr(entry) for entry in built.uptodate.extra_entries] == [
+        repr(entry) for entry in chained.uptodate.extra_entries
+    ]
+
+
+def test_composetask_compile_cache():
+    """
+    Test ComposeTask.compile caching.
+    """
+    compose.compile_cache_clear()
+    compose_task = (
+        compose.ComposeTask()
+        .add_actions(compose.Action("echo {}", (compose.FileDep("a.txt"),)))
+        .add_config_dependency(dict(x=[1, 2]))
+        .add_result_dep("other")
+    )
+    first = compose_task.compile()
+    second = compose.ComposeTask(*compose_task).compile()
+    assert first == second
+    assert first is not second
+    assert compose.compile_cache_info().misses == 1
+    assert compose.compile_cache_info().hits == 1
+    assert compose.compile_cache_info().currsize == 1
+
+    # Mutating a compiled result does not affect the cache
+    first["name"] = "changed"
+    assert "name" not in compose_task.compile()
+
+    # Structurally different tasks compile separately
+    assert (
+        compose_task.fingerprint()
+        != compose_task.add_config_dependency(dict(x=[1, True])).fingerprint()
+    )
+    compose_task.add_file_deps(Path("a.txt")).compile()
+    assert compose.compile_cache_info().misses == 2
+
+    # Unhashable values bypass the cache
+    compose.ComposeTask().add_uptodate_entry(bytearray(b"a")).compile()
+    assert compose.compile_cache_info().misses == 2
+
+    compose.compile_cache_clear()
+    assert compose.compile_cache_info() == (0, 0, compose.COMPILE_CACHE_MAXSIZE, 0)
+
+
+def test_compose_matrix():
+    """
+    Test compose_matrix.
+    """
+    calls = []
+
+    def _subtask(python: str, session: str) -> compose.ComposeTask:
+        calls.append((python, session))
+        return compose.ComposeTask().add_actions(
+            compose.Action(
+                "nox -p {} -s {} --report {}",
+                (python, session, compose.Target(f"{python}_{session}.json")),
+            )
+        )
+
+    base = (
+        compose.ComposeTask(name="ignored")
+        .add_file_deps("noxfile.py")
+        .add_actions("mkdir -p reports")
+        .add_config_dependency(dict(x=1))
+    )
+    subtasks = compose.compose_matrix(
+        base=base,
+        axes={"python": ("3.8", "3.9"), "session": ("tests", "lint")},
+        subtask=_subtask,
+    )
+    assert calls == []
+
+    first = next(subtasks)
+    assert calls == [("3.8", "tests")]
+    assert first["name"] == "3.8-tests"
+    assert first["actions"] == (
+        "mkdir -p reports",
+        "nox -p 3.8 -s tests --report 3.8_tests.json",
+    )
+    assert first["file_dep"] == ("noxfile.py",)
+    assert first["targets"] == ("3.8_tests.json",)
+    # Config of base and subtask is checked by a single config_changed
+    (config_changed,) = first["uptodate"]
+    assert config_changed.config == {
+        "x": 1,
+        "nox -p {} -s {} --report {}": "nox -p {} -s {} --report {}",
+    }
+    assert isinstance(dict_to_task({**first, "name": "matrix:" + first["name"]}), Task)
+
+    rest = list(subtasks)
+    assert len(rest) == 3
+    assert [task["name"] for task in rest] == [
+        "3.8-lint",
+        "3.9-tests",
+        "3.9-lint",
+    ]
+
+
+@pytest.mark.parametrize(
+    "base,args,kwargs,expected",
+    [
+        ("echo {}", ("hello",), {}, "echo hello"),
+        (("echo", "{0}", "{0}"), ("hello",), {}, "echo hello hello"),
+        ("echo {name} {}", (compose.FileDep("a.txt"),), dict(name="x"), "echo x a.txt"),
+        ("echo {value:>3}{{}} {!r}", ("a",), dict(value=1), "echo   1{} 'a'"),
+    ],
+)
+def test_action_template(base, args: tuple, kwargs: dict, expected: str):
+    """
+    Test ActionTemplate rendering.
+    """
+    template = compose.ActionTemplate(base)
+    assert template.render(*args, **kwargs) == expected
+    assert template.render(*args, **kwargs) == expected
+
+    with pytest.raises(ValueError):
+        template.render(*args, "extra", **kwargs)
+
+
+def test_action_template_deps():
+    """
+    Test ActionTemplate file dependencies and targets.
+    """
+    template = compose.ActionTemplate(
+        "python {script} {} {output}", file_deps=("script",), targets=("output",)
+    )
+    parameters = dict(script="script.py", output="out.csv")
+    compose_task = compose.ComposeTask().add_template_action(
+        template, compose.FileDep("data.csv"), **parameters
+    )
+    assert compose_task.actions == ("python script.py data.csv out.csv",)
+    assert compose_task.file_dep == ("script.py", "data.csv")
+    assert compose_task.targets == ("out.csv",)
+    assert compose_task.uptodate.config_changed == {
+        template.base_str: template.base_str
+    }
+
+    with pytest.raises(ValueError):
+        compose.ActionTemplate("echo {} {1}")
+    with pytest.raises(ValueError):
+        compose.ActionTemplate("echo {a.b}")
+    with pytest.raises(ValueError):
+        compose.Action("echo {name}", ("value",)).compile()
+
+
+def test_config_digest_dependency():
+    """
+    Test config_changed dependencies in digest mode.
+    """
+    large_config = {f"src/file_{idx}.py": bytes([idx % 256]) * 32 for idx in range(500)}
+    compose_task = (
+        compose.ComposeTask()
+        .add_config_digest_dependency(dict(hashes=large_config))
+        .add_config_digest_dependency(dict(path=Path("a/b"), version=1))
+        .add_config_dependency(dict(x=2))
+        .add_actions(compose.Action("echo {}", ("hello",)))
+    )
+    assert compose_task.uptodate.config_digests is not None
+    assert len(compose_task.uptodate.config_digests["hashes"]) == 64
+
+    compiled = compose_task.compile(use_cache=False)
+    config_entries = [
+        entry for entry in compiled["uptodate"] if isinstance(entry, config_changed)
+    ]
+    assert len(config_entries) == 1
+    digest = config_entries[0].config
+    assert isinstance(digest, str) and len(digest) == 64
+    assert isinstance(dict_to_task({**compiled, "name": "digest"}), Task)
+
+    # Same config composed in another order gives the same digest
+    reordered = (
+        compose.ComposeTask()
+        .builder()
+        .add_config_dependency(dict(x=2))
+        .add_config_digest_dependency(dict(version=1, path=Path("a/b")))
+        .add_config_digest_dependency(dict(hashes=dict(reversed(large_config.items()))))
+        .add_actions(compose.Action("echo {}", ("hello",)))
+        .build()
+    )
+    assert reordered.compile(use_cache=False)["uptodate"][0].config == digest
+
+    # Any change changes the digest
+    changed = compose_task.add_config_dependency(dict(x=3))
+    assert changed.compile(use_cache=False)["uptodate"][0].config != digest
+    changed = compose_task.add_config_digest_dependency(dict(version=2))
+    assert changed.uptodate.config_digest() != compose_task.uptodate.config_digest()
+
+
+def test_composetask_file_glob(tmp_path: Path):
+    """
+    Test FileGlob file dependencies.
+    """
+    (tmp_path / "a.py").touch()
+    compose_task = compose.ComposeTask().add_file_deps(
+        "dodo.py", paths.FileGlob(tmp_path)
+    )
+    assert compose_task.compile()["file_dep"] == ("dodo.py", tmp_path / "a.py")
+
+    # New files are found only after the listing cache is cleared
+    (tmp_path / "b.py").touch()
+    assert compose_task.compile()["file_dep"] == ("dodo.py", tmp_path / "a.py")
+    paths.clear_listing_cache()
+    assert compose_task.compile()["file_dep"] == (
+        "dodo.py",
+        tmp_path / "a.py",
+        tmp_path / "b.py",
+    )
+
+
+def test_composetask_compile_dedup():
+    """
+    Test order-preserving and normalized deduplication in compile.
+    """
+    compose_task = (
+        compose.ComposeTask()
+        .add_file_deps("b.py", Path("a.py"), "./a.py", "src/../b.py", "c.py")
+        .add_targets(Path("out.csv"), "out.csv")
+        .add_task_deps("first", "second", "first")
+        .add_actions(
+            "echo a.py",
+            compose.Action("echo {}", (compose.FileDep("a.py"),)),
+            compose.Action("cat {} > {}", ("c.py", compose.Target("./out.csv"))),
+            compose.Action("cat {} > {}", ("c.py", compose.Target("./out.csv"))),
+        )
+    )
+    compiled = compose_task.compile(use_cache=False)
+    assert compiled["file_dep"] == ("b.py", Path("a.py"), "c.py")
+    assert compiled["targets"] == (Path("out.csv"),)
+    assert compiled["task_dep"] == ("first", "second")
+    assert compiled["actions"] == ("echo a.py", "cat c.py > ./out.csv")
+    assert set(compiled["uptodate"][0].config) == {"echo {}", "cat {} > {}"}
+
+    # Keys with no values are omitted
+    assert "targets" not in compose.ComposeTask().add_actions("ls").compile()
+
+
+def test_lazy_task():
+    """
+    Test that lazy tasks are composed only when doit creates them.
+    """
+    calls = []
+
+    @compose.lazy_task
+    def task_lazy():
+        """
+        Lazy task.
+        """
+        calls.append(1)
+        return compose.ComposeTask().add_actions("echo lazy").add_file_deps("dodo.py")
+
+    def task_lazy_group():
+        return (
+            compose.ComposeTask(name=str(idx)).add_actions(f"echo {idx}")
+            for idx in range(2)
+        )
+
+    task_lazy_group = compose.lazy_task(task_lazy_group)
+
+    tasks = load_tasks({"task_lazy": task_lazy, "task_lazy_group": task_lazy_group})
+    assert calls == []
+    assert [task.name for task in tasks] == ["lazy", "lazy_group"]
+    assert tasks[0].doc.strip() == "Lazy task."
+    assert tasks[0].loader.creator() == dict(
+        actions=("echo lazy",), file_dep=("dodo.py",)
+    )
+    assert calls == [1]
+    assert [subtask["name"] for subtask in tasks[1].loader.creator()] == ["0", "1"]
+
+
+def test_import_does_not_import_doit():
+    """
+    Test that importing doit_ext.compose defers heavy imports.
+    """
+    code = (
+        "import sys, doit_ext.compose, doit_ext.registry; "
+        "print([name for name in ('doit', 'sqlite3', 'concurrent.futures') "
+        "if name in sys.modules])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    assert result.stdout.strip() == "[]"
+
+
+@pytest.mark.parametrize(
+    "base,batchable",
+    [
+        ("ruff check {}", True),
+        ("{} --check", True),
+        ("black --check {} && echo done", True),
+        ('ruff check "{}"', False),
+        ("ruff check --output={}", False),
+        ("ruff check {!r}", False),
+        ("cp {} {}", False),
+    ],
+)
+def test_is_batchable_base(base: str, batchable: bool):
+    """
+    Test resolving if an Action base can be filled with a Batch.
+    """
+    assert compose._is_batchable_base(base) is batchable
+
+
+def test_composetask_batch_actions():
+    """
+    Test batching Actions with the same base.
+    """
+    paths_ = [f"src/file_{idx}.py" for idx in range(5)]
+    compose_task = compose.ComposeTask().add_actions(
+        "mkdir -p build",
+        *(compose.Action("ruff check {}", (compose.FileDep(path),)) for path in paths_),
+        compose.Action("cp {} {}", (compose.FileDep("a"), compose.Target("b"))),
+        *(
+            compose.Action("black --check {}", (compose.FileDep(path),))
+            for path in paths_
+        ),
+    )
+    batched = compose_task.batch_actions(max_arg_length=60)
+    compiled = batched.compile()
+    assert compiled["actions"] == (
+        "mkdir -p build",
+        "ruff check src/file_0.py src/file_1.py src/file_2.py",
+        "ruff check src/file_3.py src/file_4.py",
+        "cp a b",
+        "black --check src/file_0.py src/file_1.py src/file_2.py",
+        "black --check src/file_3.py src/file_4.py",
+    )
+    assert all(len(action) <= 60 for action in compiled["actions"])
+    # File dependencies and targets are tracked as without batching
+    unbatched = compose_task.compile()
+    assert compiled["file_dep"] == unbatched["file_dep"]
+    assert compiled["targets"] == unbatched["targets"]
+    assert (
+        compose_task.builder().batch_actions(max_arg_length=60).build().compile()
+        == compiled
+    )
+
+    # Literal braces of shell syntax are kept
+    for base in ("awk '{print $1}' {}", "awk '{{print $1}}' {}"):
+        awk_actions = [
+            compose.Action(base, (compose.FileDep(path),)) for path in ("a", "b")
+        ]
+        assert [action.compile() for action in compose.batch_actions(awk_actions)] == [
+            "awk '{print $1}' a b"
+        ]
@@ -0,0 +1,142 @@
+"""
+Tests for executor.py.
+"""
+
+import operator
+import os
+import pickle
+import sys
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+from doit.doit_cmd import DoitMain
+from doit.exceptions import BaseFail, TaskError, TaskFailed
+from doit.task import Stream, dict_to_task
+
+from doit_ext import compose, executor
+
+
+@pytest.fixture
+def action_pool():
+    """
+    Create an ActionPool with two workers.
+    """
+    pool = executor.ActionPool(workers=2, max_batch_size=16)
+    yield pool
+    pool.shutdown()
+
+
+def test_action_pool_map(action_pool: executor.ActionPool):
+    """
+    Test that calls are batched and results kept in order.
+    """
+    results = action_pool.map(operator.add, range(500), range(500))
+    assert results == [value * 2 for value in range(500)]
+    assert action_pool.stats["calls"] == 500
+    assert action_pool.stats["batches"] < 500
+
+
+def test_action_pool_failure(action_pool: executor.ActionPool):
+    """
+    Test that exceptions propagate with the remote traceback.
+    """
+    future = action_pool.submit(operator.truediv, 1, 0)
+    with pytest.raises(ZeroDivisionError) as exc_info:
+        future.result()
+    assert isinstance(exc_info.value.__cause__, executor.RemoteTraceback)
+    assert "ZeroDivisionError" in str(exc_info.value.__cause__)
+    # Pool keeps working after failures
+    assert action_pool.submit(operator.neg, 1).result() == -1
+
+
+def test_action_pool_crashed_worker():
+    """
+    Test that calls queued behind a crashed worker still run.
+    """
+    pool = executor.ActionPool(workers=1)
+    try:
+        crashed = pool.submit(os._exit, 1)
+        queued = [pool.submit(operator.neg, value) for value in range(2)]
+        with pytest.raises(BrokenProcessPool):
+            crashed.result(timeout=60)
+        assert [future.result(timeout=60) for future in queued] == [0, -1]
+        assert pool.submit(operator.neg, 2).result(timeout=60) == -2
+        assert pool._running == 0
+    finally:
+        pool.shutdown()
+
+
+def test_action_pool_pickle(action_pool: executor.ActionPool):
+    """
+    Test that pools are pickled by configuration only.
+    """
+    action_pool.submit(operator.neg, 1).result()
+    unpickled = pickle.loads(pickle.dumps(action_pool))
+    assert unpickled.workers == 2
+    assert unpickled.stats["calls"] == 0
+
+
+@pytest.mark.parametrize(
+    "function,args,expected_failure",
+    [
+        (operator.eq, (1, 1), None),
+        (operator.eq, (1, 2), TaskFailed),
+        (operator.truediv, (1, 0), TaskError),
+    ],
+)
+def test_pool_action_doit(
+    action_pool: executor.ActionPool, function, args, expected_failure
+):
+    """
+    Test running pool actions as doit task actions.
+    """
+    compiled = (
+        compose.ComposeTask()
+        .add_actions(executor.pool_action(function, *args, pool=action_pool))
+        .compile()
+    )
+    task = dict_to_task(dict(name="pool", **compiled))
+    failure = task.execute(Stream(0))
+    if expected_failure is None:
+        assert failure is None
+    else:
+        assert isinstance(failure, BaseFail)
+        assert type(failure) is expected_failure
+
+
+def test_pool_action_default_pool(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that the default pool is used only from doit runner threads.
+    """
+    executor.shutdown_default_pool()
+    action = executor.pool_action(operator.truth, 1)
+    assert action() is True
+    assert "pool" not in executor._DEFAULT_POOL
+
+    dodo_py_contents = dedent("""
+        import operator
+
+        from doit_ext.compose import ComposeTask
+        from doit_ext.executor import pool_action
+
+        def task_pool():
+            for idx in range(4):
+                yield (
+                    ComposeTask(name=str(idx))
+                    .add_actions(pool_action(operator.truth, 1))
+                    .compile()
+                )
+        """)
+    (tmp_path / "dodo.py").write_text(dodo_py_contents)
+    monkeypatch.chdir(tmp_path)
+    # Make sure dodo.py of other tests is not reused
+    monkeypatch.delitem(sys.modules, "dodo", raising=False)
+    try:
+        assert DoitMain().run(["-n", "2", "-P", "thread"]) == 0
+        assert executor.default_pool().stats["calls"] == 4
+    finally:
+        executor.shutdown_default_pool()
+        # Later tests must not reuse this dodo.py
+        sys.modules.pop("dodo", None)
@@ -0,0 +1,98 @@
+"""
+Test graph.py.
+"""
+
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from doit_ext import graph
+from doit_ext.compose import Action, ComposeTask, FileDep, Target
+
+
+def _diamond_tasks():
+    """
+    Create tasks with file, task and result dependencies.
+    """
+    return {
+        "produce": ComposeTask().add_actions(
+            Action("python produce.py > {}", (Target("data/x.txt"),))
+        ),
+        "consume": ComposeTask().add_actions(
+            Action("python consume.py {}", (FileDep(Path("data/./x.txt")),))
+        ),
+        "check": ComposeTask().add_task_deps("produce").add_actions("check"),
+        "report": ComposeTask()
+        .add_result_dep("consume")
+        .add_task_deps("check", "unknown"),
+        "lint": dict(actions=["lint"]),
+    }
+
+
+def test_task_graph():
+    """
+    Test TaskGraph analysis.
+    """
+    task_graph = graph.build_task_graph(_diamond_tasks())
+    assert task_graph.dependencies == {
+        "produce": set(),
+        "consume": {"produce"},
+        "check": {"produce"},
+        "report": {"consume", "check"},
+        "lint": set(),
+    }
+    assert task_graph.missing == {"report": {"unknown"}}
+
+    report = task_graph.report()
+    assert report.cycles == []
+    assert report.levels == [["lint", "produce"], ["check", "consume"], ["report"]]
+    assert report.critical_path == ["produce", "consume", "report"]
+    assert report.critical_path_duration == 3.0
+    assert report.max_parallelism == 2
+
+    durations = {"check": 10.0, "lint": 20.0}
+    weighted = graph.build_task_graph(_diamond_tasks(), durations=durations)
+    assert weighted.critical_path() == (["lint"], 20.0)
+    assert weighted.max_parallelism() == 3
+
+
+def test_task_graph_cycles():
+    """
+    Test cycle detection.
+    """
+    tasks = {
+        "a": dict(task_dep=["b"]),
+        "b": dict(task_dep=["c"], file_dep=["a.txt"]),
+        "c": dict(targets=["a.txt"], task_dep=["b"]),
+        "d": dict(task_dep=["d"]),
+        "e": dict(task_dep=["a"]),
+    }
+    task_graph = graph.build_task_graph(tasks)
+    assert task_graph.find_cycles() == [["b", "c"], ["d"]]
+    assert task_graph.report().cycles == [["b", "c"], ["d"]]
+    with pytest.raises(ValueError):
+        task_graph.levels()
+
+
+def test_load_dodo_task_graph(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test building graph of tasks in a dodo.py file.
+    """
+    dodo_path = tmp_path / "dodo_graph.py"
+    dodo_path.write_text(dedent("""
+            from doit_ext.compose import ComposeTask
+
+            def task_build():
+                return ComposeTask().add_actions("build").add_targets("out").compile()
+
+            def task_test():
+                for name in ("a", "b"):
+                    yield (
+                        ComposeTask(name=name).add_actions("t").add_file_deps("out")
+                    ).compile()
+            """))
+    monkeypatch.chdir(tmp_path)
+    task_graph = graph.load_dodo_task_graph(dodo_path)
+    assert task_graph.levels() == [["build"], ["test:a", "test:b"], ["test"]]
+    assert task_graph.max_parallelism() == 2
@@ -0,0 +1,86 @@
+"""
+Test instrument.py.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import tests
+from doit_ext import compose, instrument, paths
+
+
+def task_instrumented_example():
+    """
+    Dummy task using instrumented functions.
+    """
+    file_paths = paths.find_python_source_files(tests.SAMPLE_PROJECT_WITH_PYTHON_FILES)
+    content_hash = paths.create_path_content_hash(file_paths)
+    return (
+        compose.ComposeTask()
+        .add_file_deps(*file_paths)
+        .add_config_dependency(dict(content_hash=content_hash))
+        .compile(use_cache=False)
+    )
+
+
+def test_instrumented(tmp_path: Path):
+    """
+    Test instrumented context manager.
+    """
+    report_path = tmp_path / "report.json"
+    with instrument.instrumented(report_path=report_path):
+        task_instrumented_example()
+        paths.hash_path_contents(tests.SAMPLE_PROJECT_SOME_FILE)
+        stats = instrument.report()
+
+    task_stats = stats["instrumented_example"]
+    assert task_stats["find_python_source_files"][instrument.CALLS] == 1
+    assert task_stats["create_path_content_hash"][instrument.CALLS] == 1
+    assert task_stats["ComposeTask.update"][instrument.CALLS] == 2
+    assert task_stats["ComposeTask.compile"][instrument.SECONDS] > 0
+    file_paths = paths.find_python_source_files(tests.SAMPLE_PROJECT_WITH_PYTHON_FILES)
+    assert task_stats["hash_path_contents"][instrument.FILES_STATED] == len(file_paths)
+    assert task_stats["hash_path_contents"][instrument.BYTES_HASHED] == sum(
+        path.stat().st_size for path in file_paths
+    )
+    assert (
+        stats[instrument.UNKNOWN_TASK_LABEL]["hash_path_contents"][
+            instrument.FILES_STATED
+        ]
+        == 1
+    )
+    assert json.loads(report_path.read_text()) == stats
+
+    # Disabled after the context
+    assert not instrument.is_enabled()
+    task_instrumented_example()
+    assert instrument.report() == {}
+
+
+@pytest.mark.parametrize("report_name", ["report.json", "report.folded"])
+def test_instrument_env_var(tmp_path: Path, report_name: str):
+    """
+    Test enabling instrumentation with the environment variable.
+    """
+    report_path = tmp_path / report_name
+    code = (
+        "from doit_ext.compose import ComposeTask\n"
+        "def task_env():\n"
+        "    ComposeTask().add_file_deps('a').compile()\n"
+        "task_env()\n"
+    )
+    subprocess.check_call(
+        [sys.executable, "-c", code],
+        env={**os.environ, instrument.INSTRUMENT_ENV_VAR: str(report_path)},
+        cwd=Path(__file__).parent.parent,
+    )
+    contents = report_path.read_text()
+    if report_path.suffix == ".json":
+        assert json.loads(contents)["env"]["ComposeTask.compile"]["calls"] == 1
+    else:
+        assert "env;ComposeTask.compile " in contents
@@ -2,6 +2,7 @@
 Integration tests for doit-ext.
 """
 
+import sys
 from pathlib import Path
 
 # from subprocess import check_call
@@ -71,3 +72,84 @@ def task_main():
     result = DoitMain().run(cmds)
     assert result == 0
     assert_function(tmp_path=tmp_path)
+
+
+def test_content_dependency_integration(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    Test that tasks with content dependencies rerun only on content change.
+    """
+    dodo_py_contents = dedent(
+        """
+        from doit_ext.compose import ComposeTask
+
+        def task_main():
+            return (
+                ComposeTask()
+                .add_actions("echo run >> runs.txt")
+                .add_content_dependency(globs=["src/*.py"])
+                .add_content_dependency("data.txt")
+                .compile()
+            )
+        """
+    )
+    (tmp_path / "dodo.py").write_text(dodo_py_contents)
+    (tmp_path / "src").mkdir()
+    source_path = tmp_path / "src/module.py"
+    source_path.write_text("x = 1\n")
+    data_path = tmp_path / "data.txt"
+    data_path.write_text("data")
+    runs_path = tmp_path / "runs.txt"
+    monkeypatch.chdir(tmp_path)
+    # Make sure dodo.py of other tests is not reused
+    monkeypatch.delitem(sys.modules, "dodo", raising=False)
+
+    for expected_runs in (1, 1, 1):
+        assert DoitMain().run([]) == 0
+        assert len(runs_path.read_text().splitlines()) == expected_runs
+
+    source_path.write_text("x = 2\n")
+    assert DoitMain().run([]) == 0
+    assert len(runs_path.read_text().splitlines()) == 2
+
+    data_path.write_text("changed")
+    for expected_runs in (3, 3):
+        assert DoitMain().run([]) == 0
+        assert len(runs_path.read_text().splitlines()) == expected_runs
+
+
+def test_compose_matrix_integration(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that compose_matrix subtasks are up-to-date on a second run.
+    """
+    dodo_py_contents = dedent(
+        """
+        from doit_ext.compose import Action, ComposeTask, compose_matrix
+
+        def task_m():
+            return compose_matrix(
+                base=(
+                    ComposeTask()
+                    .add_actions(Action("echo {} >> runs.txt", ("base",)))
+                    .add_content_dependency("dodo.py")
+                ),
+                axes={"value": ["a"]},
+                subtask=lambda value: (
+                    ComposeTask()
+                    .add_actions(Action("echo sub {} >> runs.txt", (value,)))
+                    .add_content_dependency(f"{value}.txt")
+                ),
+            )
+        """
+    )
+    (tmp_path / "dodo.py").write_text(dodo_py_contents)
+    (tmp_path / "a.txt").write_text("a")
+    runs_path = tmp_path / "runs.txt"
+    monkeypatch.chdir(tmp_path)
+    # Make sure dodo.py of other tests is not reused
+    monkeypatch.delitem(sys.modules, "dodo", raising=False)
+
+    for _ in range(3):
+        assert DoitMain().run([]) == 0
+        assert runs_path.read_text().splitlines() == ["base", "sub a"]
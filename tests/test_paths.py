@@ -2,6 +2,11 @@
 Test paths.py.
 """
 
+import importlib.util
+import os
+import time
+import tracemalloc
+from hashlib import sha256
 from pathlib import Path
 from typing import List
 
@@ -20,6 +25,74 @@ def test_find_python_source_files():
     assert isinstance(result, list)
     assert tests.SAMPLE_PROJECT_SOME_FILE in result
     assert tests.SAMPLE_PROJECT_OTHER_FILE in result
+    assert result == sorted(result)
+
+
+def _create_tree(base_dir: Path, rel_paths: List[str]):
+    """
+    Create empty files at rel_paths under base_dir.
+    """
+    for rel_path in rel_paths:
+        path = base_dir / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+
+def test_walk_files(tmp_path: Path):
+    """
+    Test walk_files pruning and .gitignore handling.
+    """
+    _create_tree(
+        tmp_path,
+        [
+            "a.py",
+            "a/b.py",
+            "a-b.py",
+            "src/pkg/module.py",
+            "src/pkg/module.pyi",
+            "src/pkg/data.txt",
+            "src/generated/gen.py",
+            "src/generated/keep.py",
+            "docs/conf.py",
+            "ignored_dir/x.py",
+            ".git/hooks/hook.py",
+            ".venv/lib/site.py",
+            "node_modules/pkg/index.py",
+            "src/pkg/__pycache__/module.py",
+            "build/lib/module.py",
+            "src/pkg/build/module.py",
+            "pkg.egg-info/x.py",
+        ],
+    )
+    (tmp_path / ".gitignore").write_text("# comment\nignored_dir/\n/docs\n")
+    (tmp_path / "src/generated/.gitignore").write_text("*.py\n!keep.py\n")
+
+    result = paths.walk_files(tmp_path)
+    assert not isinstance(result, list)
+    rel_paths = [path.relative_to(tmp_path).as_posix() for path in result]
+    assert rel_paths == [
+        "a/b.py",
+        "a-b.py",
+        "a.py",
+        "src/generated/keep.py",
+        "src/pkg/build/module.py",
+        "src/pkg/module.py",
+    ]
+    assert rel_paths == sorted(rel_paths, key=lambda path: Path(path).parts)
+
+    result_with_suffixes = paths.walk_files(
+        tmp_path,
+        suffixes=(".py", ".pyi"),
+        excludes=(*paths.DEFAULT_EXCLUDES, "src/generated"),
+        respect_gitignore=False,
+    )
+    rel_paths = [path.relative_to(tmp_path).as_posix() for path in result_with_suffixes]
+    assert "src/pkg/module.pyi" in rel_paths
+    assert "docs/conf.py" in rel_paths
+    assert "ignored_dir/x.py" in rel_paths
+    assert not any(path.startswith("src/generated") for path in rel_paths)
+
+    assert paths.find_python_source_files(tmp_path / "non_existing") == []
 
 
 @pytest.mark.parametrize(
@@ -70,3 +143,392 @@ def test_create_path_content_hash(file_paths: List[Path]):
     assert all(isinstance(path, Path) for path in file_paths)
     result = paths.create_path_content_hash(file_paths=file_paths)
     assert isinstance(result, str)
+
+
+def _write_old_file(path: Path, contents: bytes):
+    """
+    Write file with a modification time outside the racy window.
+    """
+    path.write_bytes(contents)
+    old_time = path.stat().st_mtime - 60
+    os.utime(path, (old_time, old_time))
+
+
+@pytest.mark.parametrize("strategy", ["sha256", "blake2b", "stat", "sampled"])
+@pytest.mark.parametrize("size", [0, 1000, 4 * 1024 * 1024])
+def test_hash_strategies(tmp_path: Path, strategy: str, size: int):
+    """
+    Test that hash strategies detect changes of files.
+    """
+    path = tmp_path / "file"
+    path.write_bytes(os.urandom(size))
+    digest = paths.hash_path_contents(path, strategy=strategy)
+    assert digest == paths.hash_path_contents(path, strategy=strategy)
+    if size == 0 and strategy != "stat":
+        assert digest == b""
+    if strategy == "sha256":
+        assert digest == (sha256(path.read_bytes()).digest() if size else b"")
+
+    # Sampled hashing only reads blocks, so change the head of the file
+    with path.open("r+b") as handle:
+        handle.write(b"changed")
+    os.utime(path, ns=(0, 0))
+    assert paths.hash_path_contents(path, strategy=strategy) != digest
+
+
+def test_hash_strategy_selection(tmp_path: Path):
+    """
+    Test selecting hash strategies per cache and checker.
+    """
+    path = tmp_path / "file"
+    path.write_text("contents")
+    with pytest.raises(ValueError, match="Unknown hash strategy"):
+        paths.get_hash_strategy("md4")
+    with pytest.raises(ValueError, match="identifier"):
+        paths.register_hash_strategy("not valid", paths._hash_stat)
+
+    db_path = tmp_path / "hashes.db"
+    with paths.PathHashCache(db_path) as cache, paths.PathHashCache(
+        db_path, strategy="blake2b"
+    ) as blake2b_cache:
+        sha256_digest = paths.hash_path_contents(path, cache=cache)
+        blake2b_digest = paths.hash_path_contents(path, cache=blake2b_cache)
+        assert sha256_digest != blake2b_digest
+        assert paths.create_path_content_dict(
+            [path], cache=blake2b_cache, strategy="blake2b"
+        ) == {str(path): blake2b_digest}
+        with pytest.raises(ValueError, match="differs"):
+            paths.hash_path_contents(path, cache=cache, strategy="blake2b")
+    # Entries of each strategy are persisted separately
+    with paths.PathHashCache(db_path, strategy="blake2b") as blake2b_cache:
+        assert blake2b_cache.hash_path_contents(path) == blake2b_digest
+
+    checker = paths.ContentChanged([path], strategy="sampled")
+    values = {checker.key: checker.current_values({})}
+    assert values[checker.key][str(path)][3] == paths._hash_sampled(path).hex()
+
+
+def test_hash_strategy_xxhash(tmp_path: Path):
+    """
+    Test that xxhash can only be selected when it is installed.
+    """
+    path = tmp_path / "file"
+    path.write_text("contents")
+    if importlib.util.find_spec("xxhash") is None:
+        assert "xxhash" not in paths.HASH_STRATEGIES
+        with pytest.raises(ValueError, match="Unknown hash strategy"):
+            paths.ContentChanged([path], strategy="xxhash")
+        with pytest.raises(ValueError, match="Unknown hash strategy"):
+            paths.PathHashCache(tmp_path / "hashes.db", strategy="xxhash")
+    else:
+        digest = paths.hash_path_contents(path, strategy="xxhash")
+        assert len(digest) == 16
+
+
+def test_path_hash_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test PathHashCache.
+    """
+    db_path = tmp_path / "hash_cache.sqlite3"
+    file_path = tmp_path / "file.txt"
+    _write_old_file(file_path, b"hello")
+    expected = paths.hash_path_contents(file_path)
+
+    with paths.PathHashCache(db_path=db_path) as cache:
+        assert cache.hash_path_contents(file_path) == expected
+
+    hashed_paths = []
+    original_hash_file = paths._hash_file
+
+    def _counting_hash_file(path: Path, *args) -> bytes:
+        hashed_paths.append(path)
+        return original_hash_file(path, *args)
+
+    monkeypatch.setattr(paths, "_hash_file", _counting_hash_file)
+
+    # Unchanged file is not re-read from a persisted cache
+    with paths.PathHashCache(db_path=db_path) as cache:
+        result = paths.create_path_content_dict([file_path], cache=cache)
+        assert result == {str(file_path): expected}
+        assert hashed_paths == []
+
+        # Changed stat data invalidates the entry
+        _write_old_file(file_path, b"hello there")
+        assert cache.hash_path_contents(file_path) != expected
+        assert hashed_paths == [file_path]
+
+        # Explicit invalidation
+        cache.invalidate([file_path])
+        cache.hash_path_contents(file_path)
+        assert len(hashed_paths) == 2
+
+        # Eviction of deleted paths
+        file_path.unlink()
+        assert cache.evict_missing() == 1
+        assert cache.hash_path_contents(file_path) == b""
+
+
+def test_path_hash_cache_racy(tmp_path: Path):
+    """
+    Test that recently modified files are not cached.
+    """
+    file_path = tmp_path / "file.txt"
+    file_path.write_bytes(b"hello")
+    with paths.PathHashCache(db_path=":memory:") as cache:
+        cache.hash_path_contents(file_path)
+        assert cache.lookup(file_path, file_path.stat()) is None
+
+
+def test_hash_path_contents_memory(tmp_path: Path):
+    """
+    Test that hashing memory use does not grow with file size.
+    """
+    file_path = tmp_path / "large_file.bin"
+    file_size = 8 * paths.HASH_BUFFER_SIZE
+    with file_path.open("wb") as handle:
+        for _ in range(8):
+            handle.write(os.urandom(paths.HASH_BUFFER_SIZE))
+
+    tracemalloc.start()
+    try:
+        result = paths.hash_path_contents(file_path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result == sha256(file_path.read_bytes()).digest()
+    assert peak < 2 * paths.HASH_BUFFER_SIZE < file_size
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_create_path_content_dict_parallel(
+    tmp_path: Path, use_processes: bool, use_cache: bool
+):
+    """
+    Test that parallel hashing matches sequential hashing.
+    """
+    file_paths = [*tests.SAMPLE_PROJECT_FILE_PATHS[0]]
+    for idx in range(20):
+        file_path = tmp_path / f"file_{idx}.txt"
+        _write_old_file(file_path, str(idx).encode() * idx)
+        file_paths.append(file_path)
+
+    expected = paths.create_path_content_dict(file_paths=file_paths)
+    with paths.PathHashCache(db_path=":memory:") as cache:
+        for _ in range(2):
+            result = paths.create_path_content_dict(
+                file_paths=file_paths,
+                cache=cache if use_cache else None,
+                workers=4,
+                use_processes=use_processes,
+            )
+            assert result == expected
+            assert list(result) == list(expected)
+
+
+class _DummyTask:
+    """
+    Task with value_savers like doit.task.Task.
+    """
+
+    def __init__(self):
+        self.value_savers = []
+
+    def saved_values(self):
+        values = {}
+        for value_saver in self.value_savers:
+            values.update(value_saver())
+        return values
+
+
+def test_content_changed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test ContentChanged uptodate checker.
+    """
+    _create_tree(tmp_path, ["src/a.py", "src/b.py"])
+    _write_old_file(tmp_path / "src/a.py", b"a")
+    _write_old_file(tmp_path / "src/b.py", b"b")
+    data_path = tmp_path / "data.csv"
+    _write_old_file(data_path, b"1,2")
+    checker = paths.ContentChanged(
+        file_paths=[data_path], globs=["src/*.py"], base_dir=tmp_path
+    )
+
+    # Nothing is resolved or hashed on creation
+    assert checker.resolve_paths() == [
+        data_path,
+        tmp_path / "src/a.py",
+        tmp_path / "src/b.py",
+    ]
+
+    task = _DummyTask()
+    assert not checker(task, {})
+    values = task.saved_values()
+
+    hashed_paths = []
+    original_hash_file = paths._hash_file
+
+    def _counting_hash_file(path: Path, *args) -> bytes:
+        hashed_paths.append(path)
+        return original_hash_file(path, *args)
+
+    monkeypatch.setattr(paths, "_hash_file", _counting_hash_file)
+
+    # Unchanged files are not re-hashed
+    task = _DummyTask()
+    assert checker(task, values)
+    assert hashed_paths == []
+    values = task.saved_values()
+
+    # Touched files with identical contents are re-hashed but up-to-date
+    os.utime(data_path, (data_path.stat().st_mtime - 10,) * 2)
+    task = _DummyTask()
+    assert checker(task, values)
+    assert hashed_paths == [data_path]
+    values = task.saved_values()
+
+    # Changed and new files
+    _write_old_file(data_path, b"1,2,3")
+    assert not checker(_DummyTask(), values)
+    _write_old_file(tmp_path / "src/c.py", b"c")
+    assert not checker(_DummyTask(), values)
+
+
+def test_file_glob_listing_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that FileGlobs over overlapping trees share directory listings.
+    """
+    _create_tree(tmp_path, ["src/pkg/a.py", "src/pkg/b.txt", "src/c.py", "d.py"])
+    paths.clear_listing_cache()
+    scanned_dirs = []
+    original_scandir = os.scandir
+
+    def _counting_scandir(path):
+        scanned_dirs.append(path)
+        return original_scandir(path)
+
+    monkeypatch.setattr(os, "scandir", _counting_scandir)
+
+    assert paths.FileGlob(tmp_path).resolve() == [
+        tmp_path / "d.py",
+        tmp_path / "src/c.py",
+        tmp_path / "src/pkg/a.py",
+    ]
+    assert len(scanned_dirs) == 3
+    assert paths.FileGlob(tmp_path / "src", pattern="pkg/*").resolve() == [
+        tmp_path / "src/pkg/a.py",
+        tmp_path / "src/pkg/b.txt",
+    ]
+    assert paths.FileGlob(tmp_path, pattern="src/*.txt").resolve() == [
+        tmp_path / "src/pkg/b.txt"
+    ]
+    assert len(scanned_dirs) == 3
+
+    paths.clear_listing_cache()
+    paths.FileGlob(tmp_path).resolve()
+    assert len(scanned_dirs) == 6
+
+
+def test_merkle_tree(tmp_path: Path):
+    """
+    Test incremental updates of MerkleTree digests.
+    """
+    base_dir = tmp_path / "repo"
+    _create_tree(base_dir, ["src/pkg/a.py", "src/pkg/b.py", "src/other/c.py", "d.txt"])
+    state_path = tmp_path / "state.json"
+    tree = paths.MerkleTree(base_dir, state_path=state_path)
+    root = tree.digest()
+    pkg = tree.digest("src/pkg/")
+    other = tree.digest("src/other")
+    assert len({root, pkg, other}) == 3
+
+    (base_dir / "src/pkg/a.py").write_text("changed")
+    computed_dirs = []
+    original_directory_digest = tree._directory_digest
+
+    def _counting_directory_digest(rel_dir: str) -> bytes:
+        computed_dirs.append(rel_dir)
+        return original_directory_digest(rel_dir)
+
+    tree._directory_digest = _counting_directory_digest  # type: ignore[assignment]
+    assert tree.update([base_dir / "src/pkg/a.py"]) == ["src/pkg/a.py"]
+    # Only the path from the changed file to the root is recomputed
+    assert computed_dirs == ["src/pkg", "src", ""]
+    assert tree.digest("src/other") == other
+    assert tree.digest("src/pkg") != pkg
+    assert tree.digest() != root
+
+    # Persisted digests are reused and equal a full recomputation
+    reloaded = paths.MerkleTree(base_dir, state_path=state_path)
+    assert reloaded._dirs == tree._dirs
+    assert reloaded.update() == []
+    assert reloaded.digest() == paths.MerkleTree(base_dir).digest()
+
+    # Removing files prunes empty directories and restores digests
+    (base_dir / "src/pkg/a.py").write_text("")
+    (base_dir / "src/new").mkdir()
+    (base_dir / "src/new/e.py").touch()
+    assert reloaded.update() == ["src/new/e.py", "src/pkg/a.py"]
+    (base_dir / "src/new/e.py").unlink()
+    assert reloaded.update([base_dir / "src/new/e.py"]) == ["src/new/e.py"]
+    assert reloaded.digest() == root
+    with pytest.raises(KeyError):
+        reloaded.digest("src/new")
+
+    # Anchored excludes apply to changed paths as when walking
+    _create_tree(base_dir, ["build/lib/f.py", "src/build/g.py"])
+    assert reloaded.update(
+        [base_dir / "build/lib/f.py", base_dir / "src/build/g.py"]
+    ) == ["src/build/g.py"]
+
+
+def test_merkle_tree_reload(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that a reloaded MerkleTree re-hashes only files with changed stat data.
+    """
+    _create_tree(tmp_path / "base", ["a.py", "src/b.py", "src/c.py"])
+    old_time = time.time() - 60
+    for path in (tmp_path / "base").rglob("*.py"):
+        # Outside the racy window
+        os.utime(path, (old_time, old_time))
+    state_path = tmp_path / "state.json"
+    digest = paths.MerkleTree(tmp_path / "base", state_path=state_path).digest()
+
+    hashed: List[Path] = []
+    original_hash_path_contents = paths.hash_path_contents
+
+    def _counting_hash_path_contents(path: Path, *args, **kwargs) -> bytes:
+        hashed.append(path)
+        return original_hash_path_contents(path, *args, **kwargs)
+
+    monkeypatch.setattr(paths, "hash_path_contents", _counting_hash_path_contents)
+    reloaded = paths.MerkleTree(tmp_path / "base", state_path=state_path)
+    assert reloaded.digest() == digest
+    assert hashed == []
+
+    (tmp_path / "base/src/b.py").write_text("changed")
+    os.utime(tmp_path / "base/src/b.py", (old_time, old_time))
+    reloaded = paths.MerkleTree(tmp_path / "base", state_path=state_path)
+    assert reloaded.update() == ["src/b.py"]
+    assert hashed == [tmp_path / "base/src/b.py"]
+
+
+def test_subtree_changed(tmp_path: Path):
+    """
+    Test SubtreeChanged uptodate checker.
+    """
+    _create_tree(tmp_path, ["src/pkg/a.py", "docs/index.md"])
+    tree = paths.MerkleTree(tmp_path)
+    checker = paths.SubtreeChanged(tree, "src/pkg")
+    task = _DummyTask()
+    assert not checker(task, {})
+    values = task.saved_values()
+    assert checker(_DummyTask(), values)
+
+    (tmp_path / "docs/index.md").write_text("docs")
+    tree.update()
+    assert checker(_DummyTask(), values)
+    (tmp_path / "src/pkg/a.py").write_text("a")
+    tree.update()
+    assert not checker(_DummyTask(), values)
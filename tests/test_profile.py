@@ -0,0 +1,62 @@
+"""
+Test _profile.py.
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from tests import _profile
+
+
+@pytest.mark.parametrize(
+    "name", ["compose_builder[1000]", "hash_path_contents_memory[64MiB]"]
+)
+def test_run_benchmark(name: str):
+    """
+    Test run_benchmark.
+    """
+    result = _profile.run_benchmark(_profile.BENCHMARKS[name], repeat=1)
+    assert result > 0
+
+
+def test_main_compare(tmp_path: Path):
+    """
+    Test saving a baseline and comparing against it.
+    """
+    baseline_path = tmp_path / "baseline.json"
+    args = ["--filter", "compose_builder[[]1000[]]", "--repeat", "1"]
+    assert _profile.main([*args, "--save", str(baseline_path)]) == 0
+    baseline = json.loads(baseline_path.read_text())
+    assert list(baseline) == ["compose_builder[1000]"]
+
+    # A baseline of much faster results fails the comparison
+    baseline_path.write_text(
+        json.dumps({name: value / 100 for name, value in baseline.items()})
+    )
+    assert _profile.main([*args, "--compare", str(baseline_path)]) == 1
+
+
+def test_main_default_baseline(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that the default baseline is used without a path.
+    """
+    baseline_path = tmp_path / "baseline.json"
+    monkeypatch.setattr(_profile, "DEFAULT_BASELINE_PATH", baseline_path)
+    args = ["--filter", "compose_builder[[]1000[]]", "--repeat", "1"]
+    assert _profile.main([*args, "--save"]) == 0
+    assert list(json.loads(baseline_path.read_text())) == ["compose_builder[1000]"]
+    assert _profile.main([*args, "--compare", "--threshold", "1000"]) == 0
+
+
+def test_committed_baseline():
+    """
+    Test that the committed baseline covers the benchmarks.
+    """
+    baseline = json.loads(_profile.DEFAULT_BASELINE_PATH.read_text())
+    assert set(baseline) <= set(_profile.BENCHMARKS)
+    # The xxhash benchmarks depend on the optional xxhash package
+    assert {name for name in _profile.BENCHMARKS if "xxhash" not in name} <= set(
+        baseline
+    )
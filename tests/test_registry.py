@@ -0,0 +1,82 @@
+"""
+Tests for registry.py.
+"""
+
+import pytest
+
+from doit_ext import compose, registry
+
+
+def _registry_with_pipeline() -> registry.TaskRegistry:
+    """
+    Create registry with a producer and consumers.
+    """
+    task_registry = registry.TaskRegistry()
+    task_registry.register(
+        "build",
+        compose.ComposeTask().add_actions(
+            compose.Action(
+                "build {} {}",
+                (compose.FileDep("src.txt"), compose.Target("build/out.txt")),
+            )
+        ),
+    )
+    task_registry.register(
+        "test",
+        compose.ComposeTask()
+        .add_actions("test")
+        .add_file_deps("./build/out.txt", "src.txt")
+        .add_task_deps("lint"),
+    )
+    task_registry.register("lint", compose.ComposeTask().add_actions("lint"))
+    return task_registry
+
+
+def test_task_registry_inference():
+    """
+    Test inferring task_dep from Action Target parameters.
+    """
+    task_registry = _registry_with_pipeline()
+    assert task_registry.inferred_task_deps("test") == ("build",)
+    compiled = task_registry.compile("test")
+    assert compiled["task_dep"] == ("lint", "build")
+    assert "task_dep" not in task_registry.compile("build")
+    assert set(task_registry.compile_all()) == {"build", "test", "lint"}
+
+
+def test_task_registry_conflicting_targets():
+    """
+    Test that two producers of the same target are rejected.
+    """
+    task_registry = registry.TaskRegistry()
+    task_registry.register(
+        "a", compose.ComposeTask().add_actions("a").add_targets("out")
+    )
+    with pytest.raises(ValueError):
+        task_registry.register(
+            "b", compose.ComposeTask().add_actions("b").add_targets("./out")
+        )
+    with pytest.raises(ValueError):
+        task_registry.register("a", compose.ComposeTask().add_actions("a"))
+
+
+def test_task_registry_task_creators():
+    """
+    Test creating doit task creator functions including subtasks.
+    """
+    task_registry = _registry_with_pipeline()
+    task_registry.register(
+        "check:one",
+        compose.ComposeTask().add_actions("c").add_file_deps("build/out.txt"),
+    )
+    task_registry.register("check:two", compose.ComposeTask().add_actions("c"))
+    creators = task_registry.task_creators()
+    assert set(creators) == {"task_build", "task_test", "task_lint", "task_check"}
+    assert creators["task_test"]()["task_dep"] == ("lint", "build")
+    subtasks = list(creators["task_check"]())
+    assert [subtask["name"] for subtask in subtasks] == ["one", "two"]
+    assert subtasks[0]["task_dep"] == ("build",)
+
+    task_registry.register("check", compose.ComposeTask().add_actions("c"))
+    with pytest.raises(ValueError):
+        task_registry.task_creators()
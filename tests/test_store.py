@@ -0,0 +1,65 @@
+"""
+Tests for store.py.
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+from doit_ext import store
+
+
+@pytest.mark.parametrize("link_mode", store.LINK_MODES)
+def test_content_store(tmp_path: Path, link_mode: str):
+    """
+    Test storing, deduplicating and materializing files.
+    """
+    content_store = store.ContentStore(tmp_path / "store", link_mode=link_mode)
+    first = tmp_path / "first.bin"
+    second = tmp_path / "second.bin"
+    first.write_bytes(b"data" * 1000)
+    second.write_bytes(b"data" * 1000)
+
+    digest, size = content_store.put(first)
+    assert content_store.put(second) == (digest, size)
+    assert size == 4000
+    assert content_store.stats["deduplicated"] == 1
+    assert list(content_store.blobs()) == [(digest, size)]
+
+    restored = tmp_path / "restored" / "file.bin"
+    method = content_store.get(digest, restored)
+    assert restored.read_bytes() == b"data" * 1000
+    assert method in store.LINK_MODES
+    if link_mode == store.COPY:
+        assert method == store.COPY
+    if method == store.HARDLINK:
+        assert os.path.samefile(restored, content_store.blob_path(digest))
+        assert store.detach(restored)
+        restored.write_bytes(b"modified")
+    assert content_store.blob_path(digest).read_bytes() == b"data" * 1000
+
+    content_store.remove(digest)
+    assert not content_store.has(digest)
+
+
+def test_content_store_empty_file(tmp_path: Path):
+    """
+    Test storing an empty file.
+    """
+    content_store = store.ContentStore(tmp_path / "store")
+    empty = tmp_path / "empty"
+    empty.touch()
+    digest, size = content_store.put(empty)
+    assert size == 0
+    assert len(digest) == 64
+
+
+def test_materialize_invalid_link_mode(tmp_path: Path):
+    """
+    Test that unknown link modes are rejected.
+    """
+    with pytest.raises(ValueError):
+        store.materialize(tmp_path / "a", tmp_path / "b", link_mode="symlink")
+    with pytest.raises(ValueError):
+        store.ContentStore(tmp_path, link_mode="symlink")
@@ -0,0 +1,170 @@
+"""
+Tests for target_cache.py.
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+from doit.task import Stream, dict_to_task
+
+from doit_ext import compose, target_cache
+
+
+def _run_task(compiled: dict):
+    """
+    Run compiled task with doit and return its saved values.
+    """
+    task = dict_to_task(dict(name="cached", **compiled))
+    assert task.execute(Stream(0)) is None
+    return task.values
+
+
+def test_target_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test restoring targets on a hit after file dependency changes.
+    """
+    monkeypatch.chdir(tmp_path)
+    Path("src.txt").write_text("first")
+    cache = target_cache.TargetCache(cache_dir=tmp_path / "cache")
+    compose_task = compose.ComposeTask().add_actions(
+        compose.Action(
+            "cat {} >> {}", (compose.FileDep("src.txt"), compose.Target("out.txt"))
+        )
+    )
+    compiled = cache.cache_task(compose_task)
+    assert len(compiled["actions"]) == 1
+    assert compiled["file_dep"] == ("src.txt",)
+
+    assert _run_task(compiled) == {"target_cache": "miss"}
+    assert Path("out.txt").read_text() == "first"
+
+    # Actions would append again but the target is restored from the cache
+    assert _run_task(compiled) == {"target_cache": "hit"}
+    assert Path("out.txt").read_text() == "first"
+
+    Path("src.txt").write_text("second")
+    os.remove("out.txt")
+    assert _run_task(compiled) == {"target_cache": "miss"}
+    assert Path("out.txt").read_text() == "second"
+
+    Path("src.txt").write_text("first")
+    assert _run_task(compiled) == {"target_cache": "hit"}
+    assert Path("out.txt").read_text() == "first"
+    assert cache.stats == dict(hits=2, misses=2, stores=2, evictions=0)
+    assert len(cache.entries()) == 2
+
+
+def test_target_cache_config(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that tasks differing only in config do not share entries.
+    """
+    monkeypatch.chdir(tmp_path)
+    cache = target_cache.TargetCache(cache_dir=tmp_path / "cache")
+    compose_task = compose.ComposeTask().add_actions(
+        compose.Action("echo run >> {}", (compose.Target("out.txt"),))
+    )
+    first = cache.cache_task(compose_task.add_config_dependency({"opt": 1}))
+    second = cache.cache_task(compose_task.add_config_dependency({"opt": 2}))
+    digest = cache.cache_task(compose_task.add_config_digest_dependency({"opt": 2}))
+    keys = [compiled["actions"][0].key() for compiled in (first, second, digest)]
+    assert len(set(keys)) == 3
+
+    assert _run_task(first) == {"target_cache": "miss"}
+    assert _run_task(second) == {"target_cache": "miss"}
+    assert Path("out.txt").read_text() == "run\nrun\n"
+
+
+def test_target_cache_doit_keywords(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that actions are expanded like doit command actions.
+    """
+    monkeypatch.chdir(tmp_path)
+    Path("src.txt").write_text("data")
+    cache = target_cache.TargetCache(cache_dir=tmp_path / "cache")
+    compiled = cache.cache_task(
+        compose.ComposeTask()
+        .add_actions("cp %(dependencies)s %(targets)s", "echo 100%%")
+        .add_file_deps("src.txt")
+        .add_targets("out.txt")
+    )
+    task = dict_to_task(dict(name="cached", **compiled))
+    assert task.execute(Stream(0)) is None
+    assert task.values == {"target_cache": "miss"}
+    assert Path("out.txt").read_text() == "data"
+    assert task.actions[0].out == "100%\n"
+
+
+def test_target_cache_failure(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that failed actions are not cached.
+    """
+    monkeypatch.chdir(tmp_path)
+    cache = target_cache.TargetCache(cache_dir=tmp_path / "cache")
+    compiled = cache.cache_task(
+        compose.ComposeTask()
+        .add_actions("touch out.txt", "exit 1")
+        .add_targets("out.txt")
+    )
+    task = dict_to_task(dict(name="cached", **compiled))
+    assert task.execute(Stream(0)) is not None
+    assert cache.entries() == []
+
+    with pytest.raises(ValueError):
+        cache.cache_task(compose.ComposeTask().add_actions(lambda: True))
+
+
+def test_target_cache_evict(tmp_path: Path):
+    """
+    Test evicting least recently used entries and unreferenced contents.
+    """
+    cache = target_cache.TargetCache(cache_dir=tmp_path / "cache", max_size=250)
+    target = tmp_path / "target.bin"
+    keys = ["a" * 64, "b" * 64, "c" * 64, "d" * 64]
+    for idx, key in enumerate(keys):
+        # The last entry shares its contents with the first one
+        target.write_bytes(str(idx % 3).encode() * 100)
+        assert cache.store(key, [target])
+        os.utime(cache._manifest_path(key), ns=(idx, idx))
+        if idx == 1:
+            # Using the first entry makes the second the least recently used
+            assert cache.restore(keys[0], [target])
+    assert sorted(entry.key for entry in cache.entries()) == [
+        keys[0],
+        keys[2],
+        keys[3],
+    ]
+    assert cache.stats["evictions"] == 1
+    assert cache.size() == 200
+    assert not cache.restore(keys[1], [target])
+    assert not cache.store("e" * 64, [tmp_path])
+
+
+@pytest.mark.parametrize("link_mode", ["copy", "reflink", "hardlink"])
+def test_target_cache_link_mode(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, link_mode: str
+):
+    """
+    Test that restored targets are correct and the store stays intact.
+    """
+    monkeypatch.chdir(tmp_path)
+    cache = target_cache.TargetCache(cache_dir=tmp_path / "cache", link_mode=link_mode)
+    compiled = cache.cache_task(
+        compose.ComposeTask()
+        .add_actions("echo data > out.txt")
+        .add_file_deps("dodo.py")
+        .add_targets("out.txt")
+    )
+    Path("dodo.py").write_text("")
+    assert _run_task(compiled) == {"target_cache": "miss"}
+    os.remove("out.txt")
+    assert _run_task(compiled) == {"target_cache": "hit"}
+    assert Path("out.txt").read_text() == "data\n"
+
+    # Rerunning the actions must not modify the stored contents
+    Path("dodo.py").write_text("changed")
+    assert _run_task(compiled) == {"target_cache": "miss"}
+    Path("dodo.py").write_text("")
+    os.remove("out.txt")
+    assert _run_task(compiled) == {"target_cache": "hit"}
+    assert Path("out.txt").read_text() == "data\n"
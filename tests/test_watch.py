@@ -0,0 +1,219 @@
+"""
+Tests for watch.py.
+"""
+
+from pathlib import Path
+
+import pytest
+
+from doit_ext import compose, paths, watch
+
+
+def _create_watchers():
+    """
+    Create available watcher implementations.
+    """
+    watchers = [watch.PollingWatcher(interval=0.01)]
+    try:
+        watchers.append(watch.InotifyWatcher())
+    except OSError:
+        pass
+    return watchers
+
+
+@pytest.mark.parametrize(
+    "watcher_index", range(len(_create_watchers())), ids=lambda idx: str(idx)
+)
+def test_watcher(tmp_path: Path, watcher_index: int):
+    """
+    Test detecting modified, created and deleted files.
+    """
+    watcher = _create_watchers()[watcher_index]
+    tree = tmp_path / "tree"
+    (tree / "sub").mkdir(parents=True)
+    (tree / "sub" / "a.py").write_text("a")
+    watcher.add_directory(tree, recursive=True)
+    try:
+        assert watcher.read_changes(timeout=0.05).paths == frozenset()
+
+        (tree / "sub" / "a.py").write_text("changed")
+        changes = watcher.read_changes(timeout=2)
+        assert str(tree / "sub" / "a.py") in changes.paths
+
+        (tree / "new").mkdir()
+        watcher.read_changes(timeout=2)
+        (tree / "new" / "b.py").write_text("b")
+        changes = watcher.read_changes(timeout=2)
+        assert str(tree / "new" / "b.py") in changes.paths
+        assert changes.structure_changed
+
+        # Directories created within excluded directories are not watched
+        (tree / "build").mkdir()
+        watcher.read_changes(timeout=2)
+        (tree / "build" / "c.py").write_text("c")
+        changes = watcher.read_changes(timeout=0.2)
+        assert str(tree / "build" / "c.py") not in changes.paths
+    finally:
+        watcher.close()
+
+
+def test_walk_directories(tmp_path: Path):
+    """
+    Test that directories are excluded like in walk_files.
+    """
+    tree = tmp_path / "wt"
+    for directory in (
+        "venv/lib/site/pkg",
+        "build/x",
+        "node_modules/x",
+        "src/build/mod",
+    ):
+        (tree / directory).mkdir(parents=True)
+    directories = watch._walk_directories(
+        str(tree), paths._compile_excludes(paths.DEFAULT_EXCLUDES)
+    )
+    assert sorted(rel_dir for _, rel_dir in directories) == [
+        "",
+        "src",
+        "src/build",
+        "src/build/mod",
+    ]
+
+
+def test_watch_session(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test triggering tasks whose file dependency contents changed.
+    """
+    monkeypatch.chdir(tmp_path)
+    Path("src").mkdir()
+    for name in ("a.py", "b.py"):
+        (Path("src") / name).write_text(name)
+    tasks = {
+        "lint_a": compose.ComposeTask().add_actions("lint").add_file_deps("src/a.py"),
+        "lint_b": compose.ComposeTask().add_actions("lint").add_file_deps("src/b.py"),
+        "build": compose.ComposeTask()
+        .add_actions("build")
+        .add_file_deps("src/a.py")
+        .add_targets("out"),
+        "test": compose.ComposeTask().add_actions("test").add_file_deps("out"),
+    }
+    session = watch.WatchSession(tasks, watcher=watch.PollingWatcher(interval=0.01))
+    try:
+        Path("src/a.py").write_text("changed")
+        event = session.poll(timeout=2)
+        assert event.changed_paths == ("src/a.py",)
+        assert event.tasks == ("build", "lint_a", "test")
+
+        # Rewriting identical contents triggers nothing
+        Path("src/b.py").write_text("b.py")
+        event = session.update(
+            watch.Changes(paths=frozenset({"src/b.py"}), structure_changed=False)
+        )
+        assert event.tasks == ()
+
+        event = session.update(
+            watch.Changes(paths=frozenset({"src"}), structure_changed=True)
+        )
+        assert event.tasks == ()
+        Path("src/b.py").write_text("changed")
+        event = session.update(
+            watch.Changes(paths=frozenset({"src"}), structure_changed=True)
+        )
+        assert event.tasks == ("lint_b",)
+
+        # Reloading keeps digests and returns only tasks with new file deps
+        Path("src/c.py").write_text("c.py")
+        hash_calls = []
+        original_hash = session.hash_cache.hash_path_contents
+        monkeypatch.setattr(
+            session.hash_cache,
+            "hash_path_contents",
+            lambda path: hash_calls.append(str(path)) or original_hash(path),
+        )
+        event = session.reload(
+            {
+                **tasks,
+                "lint_b": tasks["lint_b"].add_file_deps("src/c.py"),
+                "lint_c": compose.ComposeTask()
+                .add_actions("lint")
+                .add_file_deps("src/c.py"),
+            }
+        )
+        assert event.changed_paths == ("src/c.py",)
+        assert event.tasks == ("lint_b", "lint_c")
+        assert hash_calls == ["src/c.py"]
+        assert session.reload(tasks).tasks == ("lint_b",)
+    finally:
+        session.close()
+
+
+def test_watch_dodo(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test watching tasks of a dodo.py file.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delitem(__import__("sys").modules, "dodo", raising=False)
+    Path("src.txt").write_text("src")
+    Path("dodo.py").write_text(
+        "from doit_ext.compose import ComposeTask\n"
+        "def task_copy():\n"
+        "    return ComposeTask().add_actions('cp src.txt out.txt')"
+        ".add_file_deps('src.txt').add_targets('out.txt').compile()\n"
+    )
+    runs = []
+    original_read_changes = watch.PollingWatcher.read_changes
+
+    def _read_changes(self, timeout=None, debounce=watch.DEFAULT_DEBOUNCE):
+        Path("src.txt").write_text("changed")
+        return original_read_changes(self, timeout=2, debounce=debounce)
+
+    monkeypatch.setattr(watch.PollingWatcher, "read_changes", _read_changes)
+    monkeypatch.setattr(
+        watch, "create_watcher", lambda: watch.PollingWatcher(interval=0.01)
+    )
+    watch.watch_dodo("dodo.py", run=lambda tasks: runs.append(tasks), max_cycles=1)
+    assert runs == [("copy",)]
+
+
+def test_watch_dodo_reload(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    Test that created files run only tasks whose file dependencies changed.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delitem(__import__("sys").modules, "dodo", raising=False)
+    Path("a.txt").write_text("a")
+    dodo_template = (
+        "from doit_ext.compose import ComposeTask\n"
+        "def task_copy():\n"
+        "    for name in {names}:\n"
+        "        yield ComposeTask(name=name).add_actions('true')"
+        ".add_file_deps(f'{{name}}.txt').compile()\n"
+    )
+    Path("dodo.py").write_text(dodo_template.format(names=["a"]))
+    steps = [
+        # An unrelated file, e.g. an editor swap file
+        lambda: Path(".dodo.py.swp").write_text("swap"),
+        lambda: (
+            Path("b.txt").write_text("b"),
+            Path("dodo.py").write_text(dodo_template.format(names=["a", "b"])),
+        ),
+    ]
+    runs = []
+    original_read_changes = watch.PollingWatcher.read_changes
+
+    def _read_changes(self, timeout=None, debounce=watch.DEFAULT_DEBOUNCE):
+        steps.pop(0)()
+        return original_read_changes(self, timeout=2, debounce=debounce)
+
+    monkeypatch.setattr(watch.PollingWatcher, "read_changes", _read_changes)
+    monkeypatch.setattr(
+        watch, "create_watcher", lambda: watch.PollingWatcher(interval=0.01)
+    )
+    watch.watch_dodo(
+        "dodo.py",
+        directories=["."],
+        run=lambda tasks: runs.append(tasks),
+        max_cycles=2,
+    )
+    # The swap file runs nothing and the group task depends on its new subtask
+    assert runs == [("copy", "copy:b")]